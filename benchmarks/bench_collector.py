@@ -0,0 +1,170 @@
+#!/usr/bin/python3
+#! encoding: utf-8
+
+'''
+Push/collect check and benchmark against a localhost collector.
+
+Starts a Collector on an ephemeral localhost port in a thread and drives
+ScanPusher sensors at it with the scan tables in fixtures/scan/:
+
+  * fleet: N sensors push S scans each; reports batches/s and events/s
+    and checks that every node and every scan was merged into one entry
+    per BSSID
+  * spool: two sensors sharing a spool push while the collector is down
+    and one exits; when a collector comes back the other delivers its own
+    spool and a later run the one left behind
+  * replay: a batch sent twice is merged once
+
+Exits with status 1 if a check fails.
+
+Usage: python3 benchmarks/bench_collector.py [--nodes 300] [--scans 20] [--json]
+'''
+
+import io
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import tempfile
+import threading
+import contextlib
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import wifimage  # noqa: E402
+from wifimage import Collector, CollectorView, ScanPusher, encode_batch, parse_scan_lines  # noqa: E402
+
+FIXTURES = os.path.join(ROOT, 'fixtures', 'scan')
+
+
+class LocalCollector:
+    """A Collector served from a background thread on 127.0.0.1."""
+
+    def __init__(self, port: int = 0):
+        self.view = CollectorView()
+        self.collector = Collector(('127.0.0.1', port), self.view, interval=3600)
+        self.thread = threading.Thread(target=asyncio.run, args=(self.collector.serve(),), daemon=True)
+
+    def __enter__(self) -> 'LocalCollector':
+        self.thread.start()
+        self.collector.listening.wait(5)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.collector.stop()
+        self.thread.join(5)
+
+    @property
+    def address(self) -> tuple:
+        return self.collector.address
+
+
+def fixture_networks() -> list:
+    networks = []
+    for name in sorted(os.listdir(FIXTURES)):
+        with open(os.path.join(FIXTURES, name)) as f:
+            networks.extend(n.to_dict() for n in parse_scan_lines(f.read().splitlines()))
+    return networks
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def bench_fleet(spool: str, networks: list, nodes: int, scans: int) -> dict:
+    with LocalCollector() as local:
+        start = time.perf_counter()
+        pushers = [ScanPusher(local.address, f"node{i}", spool, batch_interval=0.05) for i in range(nodes)]
+        for _ in range(scans):
+            for pusher in pushers:
+                pusher.push('scan', interface='wlan0', networks=networks)
+        for pusher in pushers:
+            pusher.close()
+        elapsed = time.perf_counter() - start
+        view = local.view
+    merged = sum(node['scans'] for node in view.nodes.values())
+    batches = sum(node['batches'] for node in view.nodes.values())
+    return {'nodes': len(view.nodes), 'scans': merged, 'bssids': len(view.bss), 'seconds': elapsed,
+            'batches_per_second': batches / elapsed, 'events_per_second': merged / elapsed,
+            'ok': len(view.nodes) == nodes and merged == nodes * scans and
+            len(view.bss) == len({n['bssid'].upper() for n in networks if n['bssid']})}
+
+
+def check_spool(spool: str, networks: list) -> dict:
+    port = free_port()
+    # Collector down: both pushers spool, the first exits leaving its frames behind
+    first = ScanPusher(('127.0.0.1', port), 'spooler', spool, batch_interval=0.05, timeout=1)
+    second = ScanPusher(('127.0.0.1', port), 'spooler', spool, batch_interval=0.05, timeout=1)
+    for pusher in (first, second):
+        for _ in range(3):
+            pusher.push('scan', interface='wlan0', networks=networks)
+            time.sleep(0.1)
+    first.close()
+    spooled = sum(name.endswith('.batch') for _, _, names in os.walk(spool) for name in names)
+    with LocalCollector(port) as local:
+        # The second pusher is still running and sends its own spool; a later run picks up the first one's
+        second.retry_at = 0.0
+        second.push('scan', interface='wlan0', networks=networks)
+        third = ScanPusher(local.address, 'spooler', spool, batch_interval=0.05)
+        third.push('scan', interface='wlan0', networks=networks)
+        second.close()
+        third.close()
+        view = local.view
+    left = [name for name in os.listdir(spool) if not name.startswith('.')]
+    scans = view.nodes.get('spooler', {}).get('scans', 0)
+    return {'spooled_batches': spooled, 'delivered_scans': scans, 'left_in_spool': len(left),
+            'ok': spooled >= 2 and scans == 8 and not left}
+
+
+def check_replay(networks: list) -> dict:
+    batch = {'node': 'replayed', 'session': 'abcd', 'seq': 1,
+             'events': [{'type': 'scan', 'time': time.time(), 'interface': 'wlan0', 'networks': networks}]}
+    with LocalCollector() as local:
+        with socket.create_connection(local.address) as sock:
+            for _ in range(2):
+                sock.sendall(encode_batch(batch))
+                sock.recv(8)
+        view = local.view
+    scans = view.nodes.get('replayed', {}).get('scans', 0)
+    return {'merged_scans': scans, 'ok': scans == 1}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check and benchmark --push against a localhost collector')
+    parser.add_argument('--nodes', type=int, default=300)
+    parser.add_argument('--scans', type=int, default=20)
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+    args = parser.parse_args()
+
+    networks = fixture_networks()
+    with tempfile.TemporaryDirectory() as tmp, contextlib.redirect_stdout(io.StringIO()):
+        results = {
+            'fleet': bench_fleet(os.path.join(tmp, 'fleet'), networks, args.nodes, args.scans),
+            'spool': check_spool(os.path.join(tmp, 'spool'), networks),
+            'replay': check_replay(networks),
+        }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        fleet = results['fleet']
+        print(f"fleet   {fleet['nodes']} nodes x {args.scans} scans in {fleet['seconds']:.2f}s: "
+              f"{fleet['batches_per_second']:.0f} batches/s, {fleet['events_per_second']:.0f} scans/s, "
+              f"{fleet['bssids']} BSSIDs  {'ok' if fleet['ok'] else 'FAILED'}")
+        spool = results['spool']
+        print(f"spool   {spool['spooled_batches']} batches spooled, {spool['delivered_scans']} scans delivered, "
+              f"{spool['left_in_spool']} left  {'ok' if spool['ok'] else 'FAILED'}")
+        replay = results['replay']
+        print(f"replay  duplicate batch merged {replay['merged_scans']} time(s)  {'ok' if replay['ok'] else 'FAILED'}")
+    if not all(result['ok'] for result in results.values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
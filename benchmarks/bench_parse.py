@@ -0,0 +1,87 @@
+#!/usr/bin/python3
+#! encoding: utf-8
+
+'''
+Scan parser throughput benchmark.
+
+Replays the captured scan outputs in fixtures/scan/ and synthetic tables
+built from them through the streaming parser, reporting cells per second
+and the latency to the first parsed record.
+
+Usage: python3 benchmarks/bench_parse.py [--cells 10 100 1000 10000] [--repeat 5]
+'''
+
+import os
+import sys
+import time
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from wifimage import parse_scan_lines  # noqa: E402
+
+FIXTURES = os.path.join(ROOT, 'fixtures', 'scan')
+
+
+def load_cells(path: str) -> list:
+    """Split a captured scan into per-cell blocks of lines."""
+    cells = []
+    with open(path) as f:
+        for line in f:
+            if line.startswith('BSS ') or line.lstrip().startswith('Cell '):
+                cells.append([])
+            if cells:
+                cells[-1].append(line)
+    return cells
+
+
+def synthetic_scan(template: list, count: int) -> list:
+    """Build a scan of count cells by cycling template cells with unique BSSIDs."""
+    lines = []
+    for i in range(count):
+        cell = template[i % len(template)]
+        mac = f"02:{(i >> 24) & 0xff:02X}:{(i >> 16) & 0xff:02X}:{(i >> 8) & 0xff:02X}:{i & 0xff:02X}:00"
+        first = cell[0]
+        if first.startswith('BSS '):
+            first = f"BSS {mac.lower()}{first[21:]}"
+        else:
+            first = f"{first.split(' - Address: ')[0]} - Address: {mac}\n"
+        lines.append(first)
+        lines.extend(cell[1:])
+    return lines
+
+
+def bench(lines: list, repeat: int) -> dict:
+    best = None
+    first = None
+    count = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        records = parse_scan_lines(lines)
+        next(records, None)
+        first_latency = time.perf_counter() - start
+        count = 1 + sum(1 for _ in records)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best, first = elapsed, first_latency
+    return {'cells': count, 'seconds': best, 'first_record_ms': first * 1000,
+            'cells_per_second': count / best if best else 0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the WifiMage scan parser')
+    parser.add_argument('--cells', type=int, nargs='+', default=[10, 100, 1000, 10000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    for name in sorted(os.listdir(FIXTURES)):
+        template = load_cells(os.path.join(FIXTURES, name))
+        for count in args.cells:
+            result = bench(synthetic_scan(template, count), args.repeat)
+            print(f"{name:28} {result['cells']:>6} cells  {result['seconds'] * 1000:9.2f} ms  "
+                  f"{result['cells_per_second']:>10.0f} cells/s  first record {result['first_record_ms']:.3f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/python3
+#! encoding: utf-8
+
+'''
+CLI cold-start benchmark.
+
+Runs short WifiMage commands in fresh interpreters and reports the median
+and best wall time of each, next to a bare interpreter start, so import
+and startup regressions show up as a number.
+
+Usage: python3 benchmarks/bench_startup.py [--repeat 20] [--json]
+'''
+
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = os.path.join(ROOT, 'wifimage.py')
+
+CASES = [
+    ('python -c pass', [sys.executable, '-c', 'pass']),
+    ('import wifimage', [sys.executable, '-c', 'import wifimage']),
+    ('wifimage --help', [sys.executable, SCRIPT, '--help']),
+    # -m runs from cached bytecode instead of compiling the script on every start
+    ('python -m wifimage --help', [sys.executable, '-m', 'wifimage', '--help']),
+    ('wifimage -l --json', [sys.executable, SCRIPT, '-l', '--json']),
+    ('wifimage -i lo --ndjson', [sys.executable, SCRIPT, '-i', 'lo', '--ndjson']),
+]
+
+
+def time_command(argv: list, repeat: int) -> list:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(argv, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark WifiMage cold start')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args()
+
+    results = {}
+    for name, argv in CASES:
+        timings = time_command(argv, args.repeat)
+        results[name] = {'median_ms': statistics.median(timings) * 1000, 'best_ms': min(timings) * 1000}
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for name, result in results.items():
+        print(f"{name:28} median {result['median_ms']:7.1f} ms   best {result['best_ms']:7.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
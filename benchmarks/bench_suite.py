@@ -0,0 +1,190 @@
+#!/usr/bin/python3
+#! encoding: utf-8
+
+'''
+End-to-end benchmark suite on recorded command output.
+
+Replays a fixture written with --record-commands (default:
+fixtures/commands/office_wlan0.jsonl) through the real WifiMage code paths,
+so it needs neither root nor a radio, and measures:
+
+  * per-command latency: the recorded wall time of each command next to
+    the time WifiMage spends around it (runner, metrics, parsing)
+  * scan parser throughput on synthetic 10/100/1000/10000 cell tables
+  * CPU time per real-time monitor cycle (scan, diff, client poll)
+
+Results can be saved as JSON and compared against an earlier run; any
+metric that got worse by more than --threshold is reported and the exit
+status is 1.
+
+Usage: python3 benchmarks/bench_suite.py [--fixture F] [--output new.json] [--compare old.json]
+'''
+
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import subprocess
+import contextlib
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import wifimage  # noqa: E402
+from bench_parse import FIXTURES, load_cells, synthetic_scan, bench  # noqa: E402
+
+DEFAULT_FIXTURE = os.path.join(ROOT, 'fixtures', 'commands', 'office_wlan0.jsonl')
+
+
+def version() -> str:
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def replay_wifimage(fixture: str) -> wifimage.WifiMage:
+    """A WifiMage on the CLI backend answering every command from fixture, without delays."""
+    wifimage.RUNNER = wifimage.ReplayRunner(fixture, speed=0)
+    wm = wifimage.WifiMage()
+    wm.backend_name = 'cli'
+    wm.show_banner = False
+    return wm
+
+
+def bench_commands(fixture: str, repeat: int) -> dict:
+    """Recorded latency and WifiMage-side overhead of every command in the fixture."""
+    recorded = {}
+    with open(fixture) as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                if 'command' in entry:
+                    recorded.setdefault(entry['command'], []).append(entry['duration'])
+    results = {}
+    for command, durations in recorded.items():
+        wm = replay_wifimage(fixture)
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = wm.execute(command)
+            if command.endswith(' scan') or ' scan ' in command:
+                list(wifimage.parse_scan_lines(result.stdout.splitlines()))
+            timings.append(time.perf_counter() - start)
+        results[command] = {'recorded_ms': statistics.median(durations) * 1000,
+                            'overhead_ms': statistics.median(timings) * 1000}
+    return results
+
+
+def bench_parser(cells: list, repeat: int) -> dict:
+    """Cells per second of the streaming parser on synthetic tables of each size."""
+    results = {}
+    for name in sorted(os.listdir(FIXTURES)):
+        template = load_cells(os.path.join(FIXTURES, name))
+        for count in cells:
+            results[f"{name}/{count}"] = bench(synthetic_scan(template, count), repeat)['cells_per_second']
+    return results
+
+
+def bench_monitor(fixture: str, cycles: int) -> dict:
+    """CPU time of one real-time monitor cycle per scan tier, with output discarded."""
+    results = {}
+    for tier in ('cache', 'targeted', 'full'):
+        wm = replay_wifimage(fixture)
+        wm.scan_tier = tier
+        wm.scan_freqs = [2437, 5180]
+        monitor = wifimage.RealtimeMonitor(wm, 'wlan0')
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.process_time()
+            for _ in range(cycles):
+                monitor.on_networks(monitor.scheduler.run().networks)
+                monitor.poll_clients()
+            elapsed = time.process_time() - start
+        results[tier] = elapsed / cycles * 1000
+    return results
+
+
+def flatten(results: dict) -> dict:
+    """Name -> (value, True if lower is better) for every comparable metric."""
+    metrics = {}
+    for command, entry in results['commands'].items():
+        metrics[f"command {command} overhead ms"] = (entry['overhead_ms'], True)
+    for name, value in results['parse_cells_per_second'].items():
+        metrics[f"parse {name} cells/s"] = (value, False)
+    for tier, value in results['monitor_cpu_ms_per_cycle'].items():
+        metrics[f"monitor {tier} cpu ms/cycle"] = (value, True)
+    return metrics
+
+
+def compare(old: dict, new: dict, threshold: float) -> list:
+    """Metrics that got worse by more than threshold (a fraction) from old to new."""
+    regressions = []
+    old_metrics = flatten(old)
+    for name, (value, lower_is_better) in flatten(new).items():
+        if name not in old_metrics or not old_metrics[name][0]:
+            continue
+        before = old_metrics[name][0]
+        change = (value - before) / before
+        if (change if lower_is_better else -change) > threshold:
+            regressions.append((name, before, value, change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark WifiMage end to end on recorded command output')
+    parser.add_argument('--fixture', default=DEFAULT_FIXTURE, help='Recording made with --record-commands')
+    parser.add_argument('--cells', type=int, nargs='+', default=[10, 100, 1000, 10000])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--cycles', type=int, default=200, help='Monitor cycles per scan tier')
+    parser.add_argument('--output', help='Write the results as JSON')
+    parser.add_argument('--compare', help='Earlier --output file to check for regressions')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='Relative slowdown reported as a regression (default: 0.10)')
+    args = parser.parse_args()
+
+    results = {
+        'version': version(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'fixture': os.path.relpath(args.fixture, ROOT),
+        'commands': bench_commands(args.fixture, args.repeat),
+        'parse_cells_per_second': bench_parser(args.cells, args.repeat),
+        'monitor_cpu_ms_per_cycle': bench_monitor(args.fixture, args.cycles),
+    }
+
+    print(f"WifiMage {results['version']} on Python {results['python']} ({results['platform']})")
+    print('\nPer-command latency (recorded / WifiMage overhead):')
+    for command, entry in results['commands'].items():
+        print(f"  {command:40} {entry['recorded_ms']:9.2f} ms  {entry['overhead_ms']:8.3f} ms")
+    print('\nScan parser throughput:')
+    for name, value in results['parse_cells_per_second'].items():
+        print(f"  {name:40} {value:>10.0f} cells/s")
+    print('\nMonitor loop CPU per cycle:')
+    for tier, value in results['monitor_cpu_ms_per_cycle'].items():
+        print(f"  {tier:40} {value:8.3f} ms")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+            f.write('\n')
+
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        regressions = compare(old, results, args.threshold)
+        print(f"\nCompared with {old.get('version', '?')} (Python {old.get('python', '?')}): "
+              f"{len(regressions)} regression(s) over {args.threshold:.0%}")
+        for name, before, after, change in regressions:
+            print(f"  {name}: {before:.3f} -> {after:.3f} ({change:+.0%})")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
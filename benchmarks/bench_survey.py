@@ -0,0 +1,61 @@
+#!/usr/bin/python3
+#! encoding: utf-8
+
+'''
+Passive survey engine throughput benchmark.
+
+Feeds the frames of fixtures/pcap/beacons.pcap through SurveyEngine,
+cycling them with rewritten BSSIDs to simulate a busy site, and reports
+frames per second on one core.
+
+Usage: python3 benchmarks/bench_survey.py [--frames 200000] [--bss 500]
+'''
+
+import os
+import sys
+import time
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from wifimage import SurveyEngine, iter_pcap, parse_radiotap  # noqa: E402
+
+FIXTURE = os.path.join(ROOT, 'fixtures', 'pcap', 'beacons.pcap')
+
+
+def build_frames(count_bss: int) -> list:
+    """Copies of the fixture frames with BSSIDs spread over count_bss addresses."""
+    frames = []
+    for ts, frame, _ in iter_pcap(FIXTURE):
+        frames.append(bytes(frame))
+    out = []
+    for i in range(count_bss):
+        for frame in frames:
+            header = parse_radiotap(frame)[0]
+            data = bytearray(frame)
+            data[header + 20:header + 22] = i.to_bytes(2, 'big')
+            out.append(bytes(data))
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the WifiMage survey engine')
+    parser.add_argument('--frames', type=int, default=200000)
+    parser.add_argument('--bss', type=int, default=500)
+    args = parser.parse_args()
+
+    frames = build_frames(max(1, args.bss // 5))
+    engine = SurveyEngine()
+    feed = engine.feed
+    now = time.time()
+    start = time.perf_counter()
+    for i in range(args.frames):
+        feed(memoryview(frames[i % len(frames)]), now)
+    elapsed = time.perf_counter() - start
+    print(f"{args.frames} frames in {elapsed:.3f} s: {args.frames / elapsed:,.0f} frames/s, "
+          f"{len(engine.table)} BSS, {engine.errors} errors")
+
+
+if __name__ == '__main__':
+    main()
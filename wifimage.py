@@ -12,49 +12,3632 @@ import sys
 import subprocess
 import argparse
 import json
+import csv
+import glob
+import sqlite3
 import time
 import threading
 import signal
-from typing import Optional, Dict, List, Set
-from colorama import Fore, Style, init
+import io
+import errno
+import socket
+import struct
+import fnmatch
+import shlex
+import stat
+import fcntl
+import queue
+import zlib
+from functools import lru_cache
+from array import array
+from dataclasses import asdict, dataclass, field
+from typing import Optional, Dict, Iterator, List, Set
+from collections import OrderedDict, deque
 from datetime import datetime
+import importlib.util
+
+
+def lazy_import(name: str):
+    """Import a module on first attribute access, keeping it off the cold-start path."""
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    parent, _, child = name.rpartition('.')
+    if parent:
+        # `import a.b` binds b on a; code reaching it as an attribute (asyncio does) needs the same
+        setattr(sys.modules[parent], child, module)
+    return module
+
+
+# Only -rt and the scan daemon need the event loop, only multi-interface commands the pool
+asyncio = lazy_import('asyncio')
+futures = lazy_import('concurrent.futures')
+
+
+class _NoColor:
+    """Stand-in for colorama's Fore/Style when output is not a terminal: every color is ''."""
+
+    def __getattr__(self, name: str) -> str:
+        return ''
+
+
+Fore = Style = _NoColor()
+
+
+def init_colors() -> None:
+    """Load colorama only when stdout is a terminal (and NO_COLOR is unset)."""
+    global Fore, Style
+    if not sys.stdout.isatty() or os.environ.get('NO_COLOR'):
+        return
+    try:
+        from colorama import Fore, Style, init
+    except ImportError:
+        return
+    init(autoreset=True)
+
+
+def buffered_stdout(stream):
+    """A text stream on stream's descriptor, block-buffered so piped output goes out in one write.
+
+    On a terminal it stays line-buffered, so results streamed by -s and -rt appear as they arrive.
+    """
+    raw = io.FileIO(stream.fileno(), 'w', closefd=False)
+    return io.TextIOWrapper(io.BufferedWriter(raw, 1 << 20), encoding=stream.encoding, errors=stream.errors,
+                            line_buffering=stream.isatty())
+
+
+class JsonOutput:
+    """Structured output: --json collects one document written at exit, --ndjson writes one object per line at once."""
+
+    def __init__(self, stream, ndjson: bool = False):
+        self.stream = stream
+        self.ndjson = ndjson
+        self.records: List[Dict] = []
+        self.lock = threading.Lock()
+
+    def emit(self, kind: str, **data) -> None:
+        record = {'type': kind, 'time': time.time(), **data}
+        with self.lock:
+            if self.ndjson:
+                self.stream.write(json.dumps(record) + '\n')
+                self.stream.flush()
+            else:
+                self.records.append(record)
+
+    def close(self) -> None:
+        if not self.ndjson:
+            json.dump(self.records, self.stream, indent=2)
+            self.stream.write('\n')
+        self.stream.flush()
+
+SYSFS_NET = '/sys/class/net'
+PROC_WIRELESS = '/proc/net/wireless'
+PROC_ARP = '/proc/net/arp'
+IFNAMSIZ = 16
+
+
+def runtime_dir() -> str:
+    """Where per-user runtime state lives: $XDG_RUNTIME_DIR, /run for root, else a private directory in /tmp."""
+    xdg = os.environ.get('XDG_RUNTIME_DIR')
+    if xdg and os.path.isdir(xdg):
+        return xdg
+    if os.geteuid() == 0 and os.access('/run', os.W_OK):
+        return '/run'
+    return os.path.join('/tmp', f"wifimage-{os.geteuid()}")
+
+
+def private_dir(path: str) -> str:
+    """Create path as a 0700 directory, or check that an existing one is ours and not writable by others."""
+    try:
+        os.makedirs(path, mode=0o700)
+    except FileExistsError:
+        pass
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.geteuid() or st.st_mode & 0o022:
+        raise PermissionError(errno.EPERM, 'not a private directory owned by this user', path)
+    return path
+
+
+def valid_ifname(name) -> bool:
+    """The kernel's rules for interface names: 1-15 bytes, not . or .., no '/', ':' or whitespace."""
+    return (isinstance(name, str) and 0 < len(name.encode()) < IFNAMSIZ and name not in ('.', '..')
+            and not any(c in '/:' or c.isspace() or not c.isprintable() for c in name))
+
+
+# Interfaces WifiMage renamed or created, kept across runs for -man and --restore
+STATE_FILE = os.environ.get('WIFIMAGE_STATE') or os.path.join(runtime_dir(), 'wifimage-state.json')
+ATF_COM = 0x2
+ARPHRD_ETHER = '1'
+ARPHRD_IEEE80211_RADIOTAP = '803'
+
+
+class _Span:
+    __slots__ = ('metrics', 'name', 'start')
+
+    def __init__(self, metrics: 'Metrics', name: str):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Metrics:
+    """Counters and latency spans for commands and processing phases.
+
+    Disabled by default: span() then returns a shared no-op context manager
+    and incr()/observe() return immediately, so instrumented paths cost one
+    attribute check.
+    """
+
+    def __init__(self, enabled: bool = False, reservoir: int = 1024):
+        self.enabled = enabled
+        self.reservoir = reservoir
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.counters: Dict[str, float] = {}
+        # name -> [count, total, min, max, recent samples]
+        self.timings: Dict[str, list] = {}
+
+    def incr(self, name: str, value: float = 1) -> None:
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, seconds: float) -> None:
+        if not self.enabled:
+            return
+        with self.lock:
+            timing = self.timings.get(name)
+            if timing is None:
+                self.timings[name] = [1, seconds, seconds, seconds, deque([seconds], maxlen=self.reservoir)]
+                return
+            timing[0] += 1
+            timing[1] += seconds
+            timing[2] = min(timing[2], seconds)
+            timing[3] = max(timing[3], seconds)
+            timing[4].append(seconds)
+
+    def span(self, name: str):
+        """Context manager timing a block under name."""
+        return _Span(self, name) if self.enabled else NULL_SPAN
+
+    def snapshot(self) -> Dict:
+        """Current counters and timing summaries (seconds) as plain data."""
+        with self.lock:
+            elapsed = time.time() - self.started
+            timings = {}
+            for name, (count, total, low, high, recent) in self.timings.items():
+                ordered = sorted(recent)
+                timings[name] = {'count': count, 'total': total, 'min': low, 'max': high, 'avg': total / count,
+                                 'p50': ordered[len(ordered) // 2], 'p95': ordered[int(len(ordered) * 0.95)]}
+            counters = dict(self.counters)
+        counters['scans_per_minute'] = counters.get('scans', 0) / (elapsed / 60) if elapsed else 0
+        return {'timestamp': time.time(), 'uptime': elapsed, 'counters': counters, 'timings': timings}
+
+    def prometheus(self) -> str:
+        """Render the snapshot in the Prometheus text exposition format."""
+        snapshot = self.snapshot()
+        lines = ['# TYPE wifimage_uptime_seconds gauge', f"wifimage_uptime_seconds {snapshot['uptime']:.3f}"]
+        for name, value in sorted(snapshot['counters'].items()):
+            metric = 'wifimage_' + name.replace('.', '_').replace('-', '_')
+            lines.append(f"# TYPE {metric} {'gauge' if name == 'scans_per_minute' else 'counter'}")
+            lines.append(f"{metric} {value:g}")
+        if snapshot['timings']:
+            lines.append('# TYPE wifimage_duration_seconds summary')
+        for name, timing in sorted(snapshot['timings'].items()):
+            for quantile in ('p50', 'p95'):
+                lines.append(f'wifimage_duration_seconds{{span="{name}",quantile="0.{quantile[1:]}"}} '
+                             f"{timing[quantile]:.6f}")
+            lines.append(f'wifimage_duration_seconds_sum{{span="{name}"}} {timing["total"]:.6f}')
+            lines.append(f'wifimage_duration_seconds_count{{span="{name}"}} {timing["count"]}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path: str, fmt: str = 'prom') -> None:
+        """Replace path with Prometheus text, or append one JSON line for fmt 'jsonl'."""
+        if fmt == 'jsonl':
+            with open(path, 'a') as f:
+                f.write(json.dumps(self.snapshot()) + '\n')
+            return
+        tmp = f"{path}.tmp"
+        with open(tmp, 'w') as f:
+            f.write(self.prometheus())
+        os.replace(tmp, path)
+
+    def start_writer(self, path: str, fmt: str = 'prom', interval: float = 10.0) -> threading.Event:
+        """Write metrics every interval seconds from a daemon thread; set the returned event to stop."""
+        stop = threading.Event()
+
+        def writer():
+            while not stop.wait(interval):
+                try:
+                    self.write(path, fmt)
+                except OSError as e:
+                    print(f"{Fore.RED}Error writing metrics: {str(e)}")
+
+        threading.Thread(target=writer, daemon=True).start()
+        return stop
+
+
+METRICS = Metrics()
+
+
+def command_name(command) -> str:
+    """Metric name of a command line or argv, without a leading sudo."""
+    words = command.split() if isinstance(command, str) else list(command)
+    if words and words[0] == 'sudo':
+        words = words[1:]
+    return 'command.' + (os.path.basename(words[0]) if words else 'unknown')
+
+
+def freq_to_channel(freq: int) -> Optional[int]:
+    """Convert a centre frequency in MHz to an 802.11 channel number."""
+    if freq == 2484:
+        return 14
+    if 2412 <= freq < 2484:
+        return (freq - 2407) // 5
+    if 5000 <= freq < 5925:
+        return (freq - 5000) // 5
+    if 5955 <= freq <= 7115:
+        return (freq - 5950) // 5
+    return None
+
+
+def read_sysfs(iface: str, attr: str) -> Optional[str]:
+    """Read a single attribute from /sys/class/net/<iface>."""
+    content = RUNNER.read_file(os.path.join(SYSFS_NET, iface, attr))
+    return content.strip() if content is not None else None
+
+
+def list_wireless_interfaces(mode: Optional[str] = None) -> List[str]:
+    """List wireless interfaces from sysfs, optionally only 'monitor' or 'managed' ones."""
+    interfaces = []
+    for name in sorted(os.listdir(SYSFS_NET)):
+        if not os.path.exists(os.path.join(SYSFS_NET, name, 'phy80211')):
+            continue
+        link_type = read_sysfs(name, 'type')
+        if mode == 'monitor' and link_type != ARPHRD_IEEE80211_RADIOTAP:
+            continue
+        if mode == 'managed' and link_type != ARPHRD_ETHER:
+            continue
+        interfaces.append(name)
+    return interfaces
+
+
+class ThreadOutput(io.TextIOBase):
+    """sys.stdout proxy that sends writes from worker threads to per-thread buffers.
+
+    Lets commands that print as they go run concurrently on several
+    interfaces while their output is still shown grouped per interface.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def write(self, text: str) -> int:
+        buffer = getattr(self.local, 'buffer', None)
+        (buffer if buffer is not None else self.stream).write(text)
+        return len(text)
+
+    def flush(self) -> None:
+        self.stream.flush()
+
+
+def _to_int(value: str) -> Optional[int]:
+    try:
+        return int(float(value.rstrip('.')))
+    except ValueError:
+        return None
+
+
+def parse_proc_wireless(text: str, iface: str) -> Dict:
+    """Extract link quality, signal and noise for iface from /proc/net/wireless."""
+    for line in text.splitlines()[2:]:
+        name, _, rest = line.partition(':')
+        if name.strip() != iface:
+            continue
+        fields = rest.split()
+        if len(fields) < 4:
+            break
+        info = {'link_quality': _to_int(fields[1]), 'signal': _to_int(fields[2])}
+        noise = _to_int(fields[3])
+        # Drivers that do not report noise use -256 (or 0)
+        if noise is not None and -256 < noise < 0:
+            info['noise'] = noise
+        return info
+    return {}
+
+
+def parse_iw_info(text: str) -> Dict:
+    """Parse the output of `iw dev <iface> info`."""
+    info = {}
+    for line in text.splitlines():
+        words = line.split()
+        if len(words) < 2:
+            continue
+        key = words[0]
+        if key == 'type':
+            info['mode'] = words[1].capitalize()
+        elif key == 'wiphy':
+            info['phy'] = f"phy{words[1]}"
+        elif key == 'ssid':
+            info['ssid'] = line.split('ssid', 1)[1].strip()
+        elif key == 'channel':
+            info['channel'] = _to_int(words[1])
+            if len(words) > 2 and words[2].startswith('('):
+                info['frequency'] = _to_int(words[2][1:])
+    return info
+
+
+def parse_iw_link(text: str) -> Dict:
+    """Parse the output of `iw dev <iface> link`."""
+    info = {}
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith('Connected to'):
+            info['bssid'] = line.split()[2]
+        elif line.startswith('SSID:'):
+            info['ssid'] = line[5:].strip()
+        elif line.startswith('freq:'):
+            info['frequency'] = _to_int(line[5:].strip())
+        elif line.startswith('signal:'):
+            info['signal'] = _to_int(line[7:].split()[0])
+    return info
+
+
+def parse_iwconfig(text: str) -> Dict:
+    """Parse the output of `iwconfig <iface>` in a single pass."""
+    info = {}
+    for token in text.replace('  ', '\n').splitlines():
+        token = token.strip()
+        if token.startswith('Mode:'):
+            info['mode'] = token[5:].capitalize()
+        elif token.startswith('Frequency'):
+            value = token[10:].split()[0]
+            if value.replace('.', '', 1).isdigit():
+                info['frequency'] = int(round(float(value) * 1000))
+        elif token.startswith('Channel'):
+            info['channel'] = _to_int(token[8:].strip())
+        elif token.startswith('Access Point:'):
+            bssid = token[13:].strip()
+            if ':' in bssid:
+                info['bssid'] = bssid
+        elif token.startswith('ESSID:'):
+            info['ssid'] = token[6:].strip().strip('"')
+        elif token.startswith('Link Quality='):
+            current, _, maximum = token[13:].partition('/')
+            info['link_quality'] = _to_int(current)
+            if maximum:
+                info['link_quality_max'] = _to_int(maximum.split()[0])
+        elif token.startswith('Signal level='):
+            info['signal'] = _to_int(token[13:].split()[0].split('/')[0])
+        elif token.startswith('Encryption key:'):
+            info['encryption'] = token[15:].strip()
+        elif token.startswith('Authentication Suites'):
+            info['authentication'] = token.split(':', 1)[1].strip()
+        elif token.startswith('Power Management:'):
+            info['power_management'] = token[17:].strip()
+    return info
+
+
+@dataclass
+class InterfaceSnapshot:
+    """Point-in-time state of an interface, shared by the info, diagnose and security commands."""
+    name: str
+    status: Optional[str] = None
+    mac: Optional[str] = None
+    phy: Optional[str] = None
+    mode: Optional[str] = None
+    channel: Optional[int] = None
+    frequency: Optional[int] = None
+    ssid: Optional[str] = None
+    bssid: Optional[str] = None
+    signal: Optional[int] = None
+    noise: Optional[int] = None
+    link_quality: Optional[int] = None
+    link_quality_max: Optional[int] = 70
+    encryption: Optional[str] = None
+    authentication: Optional[str] = None
+    power_management: Optional[str] = None
+    timestamp: float = field(default_factory=time.time)
+
+    def update(self, values: Dict) -> None:
+        """Merge parsed values, keeping fields already set by a more precise source."""
+        for key, value in values.items():
+            if value is not None and getattr(self, key) is None:
+                setattr(self, key, value)
+
+    @property
+    def frequency_text(self) -> Optional[str]:
+        return f"{self.frequency / 1000:.3f} GHz" if self.frequency else None
+
+    @property
+    def signal_text(self) -> Optional[str]:
+        return f"{self.signal} dBm" if self.signal is not None else None
+
+    @property
+    def quality_text(self) -> Optional[str]:
+        if self.link_quality is None:
+            return None
+        return f"{self.link_quality}/{self.link_quality_max}"
+
+# 802.11 information elements and RSN suite selectors (IEEE 802.11-2020, 9.4.2)
+WLAN_EID_SSID = 0
+WLAN_EID_DS_PARAMS = 3
+WLAN_EID_RSN = 48
+WLAN_EID_VENDOR = 221
+WLAN_CAPABILITY_PRIVACY = 0x10
+WPA_OUI_TYPE = b'\x00\x50\xf2\x01'
+RSN_CAPABILITY_MFPR = 0x40
+RSN_CAPABILITY_MFPC = 0x80
+
+CIPHER_SUITES = {1: 'WEP-40', 2: 'TKIP', 4: 'CCMP', 5: 'WEP-104', 6: 'BIP-CMAC-128',
+                 8: 'GCMP-128', 9: 'GCMP-256', 10: 'CCMP-256'}
+AKM_SUITES = {1: '802.1X', 2: 'PSK', 3: 'FT/802.1X', 4: 'FT/PSK', 5: '802.1X/SHA-256',
+              6: 'PSK/SHA-256', 8: 'SAE', 9: 'FT/SAE', 12: '802.1X/SUITE-B-192', 18: 'OWE', 24: 'SAE-EXT-KEY'}
+
+
+def iter_ies(data: bytes):
+    """Yield (element id, body) pairs from an 802.11 information element blob."""
+    offset = 0
+    while offset + 2 <= len(data):
+        eid, length = data[offset], data[offset + 1]
+        yield eid, data[offset + 2:offset + 2 + length]
+        offset += 2 + length
+
+
+def parse_rsn_ie(body: bytes) -> Dict:
+    """Decode the body of an RSN (or WPA vendor) element into cipher/AKM names."""
+    info = {}
+    try:
+        info['group_cipher'] = CIPHER_SUITES.get(body[5], str(body[5]))
+        count = struct.unpack_from('<H', body, 6)[0]
+        offset = 8
+        info['pairwise_ciphers'] = tuple(CIPHER_SUITES.get(body[offset + 4 * i + 3], str(body[offset + 4 * i + 3]))
+                                         for i in range(count))
+        offset += 4 * count
+        count = struct.unpack_from('<H', body, offset)[0]
+        offset += 2
+        info['akm_suites'] = tuple(AKM_SUITES.get(body[offset + 4 * i + 3], str(body[offset + 4 * i + 3]))
+                                   for i in range(count))
+        offset += 4 * count
+        capabilities = struct.unpack_from('<H', body, offset)[0]
+        if capabilities & RSN_CAPABILITY_MFPR:
+            info['mfp'] = 'required'
+        elif capabilities & RSN_CAPABILITY_MFPC:
+            info['mfp'] = 'capable'
+    except (IndexError, struct.error):
+        pass
+    return info
+
+
+def channel_to_freq(channel: int) -> int:
+    """Convert a 2.4/5 GHz channel number to its centre frequency in MHz."""
+    if channel == 14:
+        return 2484
+    if channel < 14:
+        return 2407 + channel * 5
+    return 5000 + channel * 5
+
+
+def parse_channel_list(text: str) -> List[int]:
+    """argparse type for a comma separated channel list such as '1,6,36'."""
+    channels = []
+    for item in text.split(','):
+        if not item.strip().isdigit() or not 1 <= int(item) <= 196:
+            raise argparse.ArgumentTypeError(f"invalid channel {item.strip()!r} in {text!r}")
+        channels.append(int(item))
+    return channels
+
+
+class BSSRecord:
+    """One BSS seen in a scan. Signal is in dBm, frequency in MHz."""
+    __slots__ = ('bssid', 'ssid', 'frequency', 'channel', 'signal', 'quality', 'encrypted',
+                 'wpa', 'group_cipher', 'pairwise_ciphers', 'akm_suites', 'mfp', 'last_seen', 'associated')
+
+    def __init__(self, bssid: Optional[str] = None):
+        self.bssid = bssid
+        self.ssid: Optional[str] = None
+        self.frequency: Optional[int] = None
+        self.channel: Optional[int] = None
+        self.signal: Optional[int] = None
+        self.quality: Optional[str] = None
+        self.encrypted: bool = False
+        self.wpa: tuple = ()
+        self.group_cipher: Optional[str] = None
+        self.pairwise_ciphers: tuple = ()
+        self.akm_suites: tuple = ()
+        self.mfp: Optional[str] = None
+        self.last_seen: float = time.time()
+        self.associated: bool = False
+
+    def __repr__(self) -> str:
+        return f"BSSRecord({self.bssid!r}, ssid={self.ssid!r}, channel={self.channel}, signal={self.signal})"
+
+    def add_security(self, version: str, info: Dict) -> None:
+        """Merge an RSN/WPA element, keeping the union of advertised suites."""
+        self.encrypted = True
+        if version not in self.wpa:
+            self.wpa += (version,)
+        if info.get('group_cipher') and (self.group_cipher is None or version == 'WPA2'):
+            self.group_cipher = info['group_cipher']
+        for key in ('pairwise_ciphers', 'akm_suites'):
+            merged = getattr(self, key) + tuple(v for v in info.get(key, ()) if v not in getattr(self, key))
+            setattr(self, key, merged)
+        if info.get('mfp'):
+            self.mfp = info['mfp']
+
+    @property
+    def encryption(self) -> str:
+        """Short human readable summary of the advertised security."""
+        if not self.encrypted:
+            return 'No'
+        if not self.wpa:
+            return 'WEP'
+        return f"{'/'.join(self.wpa)} ({'/'.join(self.pairwise_ciphers + self.akm_suites)})"
+
+    def to_dict(self) -> Dict:
+        return {key: getattr(self, key) for key in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, values: Dict) -> 'BSSRecord':
+        """Rebuild a record from to_dict() output that went through JSON."""
+        record = cls(values.get('bssid'))
+        for key in cls.__slots__[1:]:
+            if key in values:
+                value = values[key]
+                setattr(record, key, tuple(value) if isinstance(value, list) else value)
+        return record
+
+
+def apply_ies(record: BSSRecord, data) -> None:
+    """Fill SSID, channel and RSN/WPA security of record from an IE blob."""
+    for eid, body in iter_ies(data):
+        if eid == WLAN_EID_SSID and record.ssid is None:
+            body = bytes(body)
+            record.ssid = body.decode('utf-8', 'replace') if body.strip(b'\0') else None
+        elif eid == WLAN_EID_DS_PARAMS and body:
+            record.channel = body[0]
+        elif eid == WLAN_EID_RSN:
+            record.add_security('WPA2', parse_rsn_ie(bytes(body)))
+        elif eid == WLAN_EID_VENDOR and bytes(body[:4]) == WPA_OUI_TYPE:
+            record.add_security('WPA', parse_rsn_ie(bytes(body[4:])))
+
+
+def _normalize_suite(name: str) -> str:
+    return name.replace('IEEE_', '').upper()
+
+
+class ScanParser:
+    """Line-at-a-time parser for `iwlist <iface> scan` and `iw dev <iface> scan` output.
+
+    feed() returns the previous record whenever a new cell starts, so results
+    can be consumed while the scanning process is still writing; close()
+    flushes the last one. The input format is detected from the first cell.
+    """
+
+    def __init__(self):
+        self.record: Optional[BSSRecord] = None
+        self.section: Optional[str] = None
+        self.section_info: Dict = {}
+        self.now = time.time()
+        self.errors = 0
+
+    def feed(self, line: str) -> Optional[BSSRecord]:
+        stripped = line.strip()
+        if not stripped:
+            return None
+        if stripped.startswith('Cell ') and ' - Address: ' in stripped:
+            return self._start(stripped.rsplit(' ', 1)[1])
+        if line.startswith('BSS '):
+            finished = self._start(line[4:21])
+            self.record.associated = line.rstrip().endswith('-- associated')
+            return finished
+        if self.record is None:
+            return None
+        try:
+            self._parse_field(line, stripped)
+        except (ValueError, IndexError):
+            self.errors += 1
+        return None
+
+    def close(self) -> Optional[BSSRecord]:
+        return self._start(None)
+
+    def _start(self, bssid: Optional[str]) -> Optional[BSSRecord]:
+        finished = self.record
+        self._end_section()
+        self.record = BSSRecord(bssid.upper()) if bssid else None
+        if finished is not None and finished.channel is None and finished.frequency:
+            finished.channel = freq_to_channel(finished.frequency)
+        return finished
+
+    def _end_section(self) -> None:
+        if self.section and self.record is not None:
+            self.record.add_security(self.section, self.section_info)
+        self.section = None
+        self.section_info = {}
+
+    def _parse_field(self, line: str, stripped: str) -> None:
+        record = self.record
+        key, sep, value = stripped.replace('IEEE 802.1X', 'IEEE_802.1X').partition(':')
+        value = value.strip()
+
+        # Security sub-blocks: iwlist "IE: IEEE 802.11i/WPA2 Version 1", iw "RSN:" / "WPA:"
+        if key == 'IE':
+            self._end_section()
+            if 'WPA2' in value:
+                self.section = 'WPA2'
+            elif value.startswith('WPA'):
+                self.section = 'WPA'
+            return
+        if key in ('RSN', 'WPA') and line.startswith('\t') and not line.startswith('\t\t'):
+            self._end_section()
+            self.section = 'WPA2' if key == 'RSN' else 'WPA'
+            key, sep, value = value.lstrip('* ').partition(':')
+            key, value = key.strip(), value.strip()
+        elif self.section and not (stripped.startswith('*') or line.startswith(' ' * 24)):
+            self._end_section()
+        if self.section:
+            key = key.lstrip('* ').strip().lower()
+            if key == 'group cipher':
+                self.section_info['group_cipher'] = value
+            elif key.startswith('pairwise ciphers'):
+                self.section_info['pairwise_ciphers'] = tuple(value.split())
+            elif key.startswith('authentication suites'):
+                self.section_info['akm_suites'] = tuple(_normalize_suite(v) for v in value.split())
+            elif key == 'capabilities':
+                if 'MFP-required' in value:
+                    self.section_info['mfp'] = 'required'
+                elif 'MFP-capable' in value:
+                    self.section_info['mfp'] = 'capable'
+            return
+
+        if key == 'ESSID':
+            # Take everything between the outer quotes so embedded quotes survive
+            ssid = value[1:-1] if len(value) >= 2 and value[0] == value[-1] == '"' else value
+            record.ssid = None if not ssid or ssid.startswith('\\x00') else ssid
+        elif key == 'SSID':
+            record.ssid = value or None
+        elif key == 'Channel':
+            record.channel = int(value)
+        elif key == 'DS Parameter set':
+            record.channel = int(value.split()[-1])
+        elif key == 'Frequency':
+            record.frequency = int(round(float(value.split()[0]) * 1000))
+        elif key == 'freq':
+            record.frequency = int(float(value))
+        elif key.startswith('Quality'):
+            # "Quality=70/70  Signal level=-40 dBm" (some drivers use ':' instead of '=')
+            fields = stripped.replace(':', '=').split('  ')
+            for item in fields:
+                name, _, level = item.strip().partition('=')
+                if name == 'Quality':
+                    record.quality = level
+                elif name == 'Signal level':
+                    record.signal = int(float(level.split()[0].split('/')[0]))
+        elif key == 'signal':
+            record.signal = int(float(value.split()[0]))
+        elif key == 'Encryption key':
+            record.encrypted = value == 'on'
+        elif key == 'capability':
+            record.encrypted = record.encrypted or 'Privacy' in value
+        elif key == 'last seen' and value.endswith('ms ago'):
+            record.last_seen = self.now - int(value.split()[0]) / 1000
+        elif stripped.startswith('Extra: Last beacon:') and stripped.endswith('ms ago'):
+            record.last_seen = self.now - int(stripped[19:].split('ms')[0]) / 1000
+
+
+def parse_scan_lines(lines) -> Iterator[BSSRecord]:
+    """Incrementally parse scan output, yielding each BSS as soon as it is complete."""
+    parser = ScanParser()
+    if METRICS.enabled:
+        yield from _parse_scan_lines_timed(parser, lines)
+        return
+    for line in lines:
+        record = parser.feed(line.rstrip('\n'))
+        if record is not None:
+            yield record
+    record = parser.close()
+    if record is not None:
+        yield record
+
+
+def _parse_scan_lines_timed(parser: ScanParser, lines) -> Iterator[BSSRecord]:
+    """parse_scan_lines with parse time, cell and error counts recorded."""
+    parse_time = 0.0
+    cells = 0
+    try:
+        for line in lines:
+            start = time.perf_counter()
+            record = parser.feed(line.rstrip('\n'))
+            parse_time += time.perf_counter() - start
+            if record is not None:
+                cells += 1
+                yield record
+        record = parser.close()
+        if record is not None:
+            cells += 1
+            yield record
+    finally:
+        METRICS.observe('phase.parse', parse_time)
+        METRICS.incr('cells_parsed', cells)
+        METRICS.incr('parse_errors', parser.errors)
+
+
+class CommandResult:
+    """Exit status and output of one command run through a runner."""
+    __slots__ = ('returncode', 'stdout', 'stderr', 'duration')
+
+    def __init__(self, returncode: int, stdout: str = '', stderr: str = '', duration: float = 0.0):
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.duration = duration
+
+
+def command_key(command) -> str:
+    """Fixture key of a shell command line or an argv list."""
+    return command if isinstance(command, str) else shlex.join(command)
+
+
+class SubprocessRunner:
+    """Runs commands for real and reads files from the live system."""
+
+    def run(self, command) -> CommandResult:
+        """Run a shell command line (str) or an argv list; raises OSError if it cannot be started."""
+        start = time.perf_counter()
+        result = subprocess.run(command, shell=isinstance(command, str), capture_output=True, text=True)
+        return CommandResult(result.returncode, result.stdout, result.stderr, time.perf_counter() - start)
+
+    def stream(self, argv: List[str]) -> Iterator[str]:
+        """Yield stdout lines while the command runs; raises CalledProcessError on a non-zero exit."""
+        start = time.perf_counter()
+        process = subprocess.Popen(argv, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, bufsize=1)
+        METRICS.observe('command.spawn', time.perf_counter() - start)
+        try:
+            yield from process.stdout
+        finally:
+            process.stdout.close()
+            process.wait()
+        if process.returncode:
+            raise subprocess.CalledProcessError(process.returncode, argv)
+
+    def read_file(self, path: str) -> Optional[str]:
+        try:
+            with open(path) as f:
+                return f.read()
+        except OSError:
+            return None
+
+
+class RecordingRunner:
+    """Wraps another runner and appends every command and file read to a JSON-lines fixture."""
+
+    def __init__(self, path: str, inner=None):
+        self.inner = inner or SubprocessRunner()
+        self.file = open(path, 'a')
+        self.lock = threading.Lock()
+
+    def _write(self, entry: Dict) -> None:
+        with self.lock:
+            self.file.write(json.dumps(entry) + '\n')
+            self.file.flush()
+
+    def run(self, command) -> CommandResult:
+        result = self.inner.run(command)
+        self._write({'command': command_key(command), 'returncode': result.returncode, 'stdout': result.stdout,
+                     'stderr': result.stderr, 'duration': result.duration})
+        return result
+
+    def stream(self, argv: List[str]) -> Iterator[str]:
+        lines = []
+        returncode = 0
+        start = time.perf_counter()
+        try:
+            for line in self.inner.stream(argv):
+                lines.append(line)
+                yield line
+        except subprocess.CalledProcessError as e:
+            returncode = e.returncode
+            raise
+        finally:
+            self._write({'command': command_key(argv), 'returncode': returncode, 'stdout': ''.join(lines),
+                         'stderr': '', 'duration': time.perf_counter() - start})
+
+    def read_file(self, path: str) -> Optional[str]:
+        start = time.perf_counter()
+        content = self.inner.read_file(path)
+        self._write({'file': path, 'content': content, 'duration': time.perf_counter() - start})
+        return content
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class ReplayRunner:
+    """Answers commands and file reads from fixtures written by RecordingRunner.
+
+    Repeated recordings of one command are replayed in order, the last one
+    repeating, so a recorded monitoring session replays deterministically.
+    Each reply takes its recorded duration times speed (0 for no delay);
+    streamed output is spread evenly over it. Commands that were never
+    recorded fail with exit status 127, files that were never recorded are
+    read from the live system.
+    """
+
+    def __init__(self, paths, speed: float = 1.0):
+        self.speed = speed
+        self.commands: Dict[str, List[Dict]] = {}
+        self.files: Dict[str, List[Dict]] = {}
+        self.position: Dict[tuple, int] = {}
+        self.lock = threading.Lock()
+        self.live = SubprocessRunner()
+        for path in [paths] if isinstance(paths, str) else paths:
+            with open(path) as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        if 'file' in entry:
+                            self.files.setdefault(entry['file'], []).append(entry)
+                        else:
+                            self.commands.setdefault(entry['command'], []).append(entry)
+
+    def _next(self, table: Dict[str, List[Dict]], key: str) -> Optional[Dict]:
+        entries = table.get(key)
+        if not entries:
+            return None
+        with self.lock:
+            index = self.position.get((id(table), key), 0)
+            self.position[(id(table), key)] = index + 1
+        return entries[min(index, len(entries) - 1)]
+
+    def run(self, command) -> CommandResult:
+        entry = self._next(self.commands, command_key(command))
+        if entry is None:
+            return CommandResult(127, '', f"no recording of: {command_key(command)}")
+        if self.speed:
+            time.sleep(entry['duration'] * self.speed)
+        return CommandResult(entry['returncode'], entry['stdout'], entry['stderr'], entry['duration'])
+
+    def stream(self, argv: List[str]) -> Iterator[str]:
+        entry = self._next(self.commands, command_key(argv))
+        if entry is None:
+            raise subprocess.CalledProcessError(127, argv)
+        lines = entry['stdout'].splitlines(keepends=True)
+        delay = entry['duration'] * self.speed / max(1, len(lines))
+        for line in lines:
+            if delay:
+                time.sleep(delay)
+            yield line
+        if entry['returncode']:
+            raise subprocess.CalledProcessError(entry['returncode'], argv)
+
+    def read_file(self, path: str) -> Optional[str]:
+        entry = self._next(self.files, path)
+        return entry['content'] if entry is not None else self.live.read_file(path)
+
+
+# Where commands run and files are read; swapped by --record-commands/--replay-commands and the benchmarks
+RUNNER = SubprocessRunner()
+
+
+def stream_command(argv: List[str]) -> Iterator[str]:
+    """Yield a command's stdout line by line while it is still running."""
+    name = command_name(argv)
+    start = time.perf_counter()
+    METRICS.incr('commands')
+    try:
+        yield from RUNNER.stream(argv)
+    except (OSError, subprocess.CalledProcessError):
+        METRICS.incr('command_failures')
+    finally:
+        METRICS.observe(name, time.perf_counter() - start)
+
+
+# Netlink / nl80211 constants (linux/netlink.h, linux/rtnetlink.h, linux/nl80211.h)
+NETLINK_ROUTE = 0
+NETLINK_GENERIC = 16
+SOL_NETLINK = 270
+NETLINK_ADD_MEMBERSHIP = 1
+
+NLM_F_REQUEST = 0x1
+NLM_F_MULTI = 0x2
+NLM_F_ACK = 0x4
+NLM_F_DUMP = 0x300
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+NLA_TYPE_MASK = 0x3fff
+
+RTM_NEWLINK = 16
+RTM_NEWNEIGH = 28
+RTM_DELNEIGH = 29
+RTM_GETNEIGH = 30
+RTMGRP_LINK = 0x1
+RTMGRP_NEIGH = 0x4
+IFLA_IFNAME = 3
+IFLA_OPERSTATE = 16
+IFF_UP = 0x1
+NDA_DST = 1
+NDA_LLADDR = 2
+NUD_INCOMPLETE = 0x01
+NUD_FAILED = 0x20
+NUD_NOARP = 0x40
+OPERSTATES = {0: 'UNKNOWN', 1: 'NOTPRESENT', 2: 'DOWN', 3: 'LOWERLAYERDOWN', 4: 'TESTING', 5: 'DORMANT', 6: 'UP'}
+
+GENL_ID_CTRL = 0x10
+CTRL_CMD_GETFAMILY = 3
+CTRL_ATTR_FAMILY_ID = 1
+CTRL_ATTR_FAMILY_NAME = 2
+CTRL_ATTR_MCAST_GROUPS = 7
+CTRL_ATTR_MCAST_GRP_NAME = 1
+CTRL_ATTR_MCAST_GRP_ID = 2
+
+NL80211_CMD_SET_WIPHY = 2
+NL80211_CMD_SET_INTERFACE = 6
+NL80211_CMD_NEW_INTERFACE = 7
+NL80211_CMD_DEL_INTERFACE = 8
+NL80211_CMD_GET_SURVEY = 50
+NL80211_CMD_GET_SCAN = 32
+NL80211_CMD_TRIGGER_SCAN = 33
+NL80211_CMD_NEW_SCAN_RESULTS = 34
+NL80211_CMD_SCAN_ABORTED = 35
+NL80211_ATTR_WIPHY = 1
+NL80211_ATTR_IFINDEX = 3
+NL80211_ATTR_IFNAME = 4
+NL80211_ATTR_IFTYPE = 5
+NL80211_ATTR_WIPHY_FREQ = 38
+NL80211_ATTR_SCAN_FREQUENCIES = 44
+NL80211_ATTR_BSS = 47
+NL80211_ATTR_SURVEY_INFO = 84
+NL80211_SURVEY_INFO_FREQUENCY = 1
+NL80211_SURVEY_INFO_NOISE = 2
+NL80211_SURVEY_INFO_IN_USE = 3
+NL80211_SURVEY_INFO_TIME = 4
+NL80211_SURVEY_INFO_TIME_BUSY = 5
+NL80211_SURVEY_INFO_TIME_RX = 7
+NL80211_SURVEY_INFO_TIME_TX = 8
+NL80211_BSS_BSSID = 1
+NL80211_BSS_FREQUENCY = 2
+NL80211_BSS_CAPABILITY = 5
+NL80211_BSS_INFORMATION_ELEMENTS = 6
+NL80211_BSS_SIGNAL_MBM = 7
+NL80211_BSS_STATUS = 9
+NL80211_BSS_SEEN_MS_AGO = 10
+NL80211_BSS_STATUS_ASSOCIATED = 1
+NL80211_IFTYPES = {'managed': 2, 'monitor': 6}
+
+
+
+class NetlinkError(OSError):
+    """Raised when the kernel answers a netlink request with an error."""
+
+
+def nla_pack(attr_type: int, payload: bytes) -> bytes:
+    """Encode a single netlink attribute, padded to 4 bytes."""
+    length = 4 + len(payload)
+    return struct.pack('=HH', length, attr_type) + payload + b'\0' * (-length % 4)
+
+
+def nla_parse(data: bytes) -> Dict[int, bytes]:
+    """Decode a run of netlink attributes into a {type: payload} dict."""
+    attrs = {}
+    offset = 0
+    while offset + 4 <= len(data):
+        length, attr_type = struct.unpack_from('=HH', data, offset)
+        if length < 4:
+            break
+        attrs[attr_type & NLA_TYPE_MASK] = data[offset + 4:offset + length]
+        offset += (length + 3) & ~3
+    return attrs
+
+
+class NetlinkSocket:
+    """Minimal request/response wrapper around a raw netlink socket."""
+
+    def __init__(self, protocol: int, sock=None, groups: int = 0):
+        if sock is None:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, protocol)
+        self.sock = sock
+        self.sock.bind((0, groups))
+        self.seq = 0
+
+    def fileno(self) -> int:
+        return self.sock.fileno()
+
+    def close(self) -> None:
+        self.sock.close()
+
+    def subscribe(self, group: int) -> None:
+        """Join a multicast group so kernel notifications are delivered."""
+        self.sock.setsockopt(SOL_NETLINK, NETLINK_ADD_MEMBERSHIP, group)
+
+    def send(self, msg_type: int, flags: int, payload: bytes) -> int:
+        self.seq += 1
+        header = struct.pack('=IHHII', 16 + len(payload), msg_type, flags | NLM_F_REQUEST, self.seq, 0)
+        self.sock.send(header + payload)
+        return self.seq
+
+    @staticmethod
+    def parse(data: bytes):
+        """Split one received datagram into (type, flags, seq, payload) tuples."""
+        offset = 0
+        while offset + 16 <= len(data):
+            length, msg_type, flags, seq, _ = struct.unpack_from('=IHHII', data, offset)
+            if length < 16:
+                break
+            yield msg_type, flags, seq, data[offset + 16:offset + length]
+            offset += (length + 3) & ~3
+
+    def messages(self):
+        """Yield (type, flags, seq, payload) for every message received."""
+        while True:
+            yield from self.parse(self.sock.recv(65536))
+
+    def drain(self) -> List[tuple]:
+        """Read every message already queued on a non-blocking socket."""
+        messages = []
+        while True:
+            try:
+                data = self.sock.recv(65536)
+            except (BlockingIOError, socket.timeout):
+                return messages
+            messages.extend(self.parse(data))
+
+    def request(self, msg_type: int, flags: int, payload: bytes) -> List[bytes]:
+        """Send a request and collect the reply payloads until it completes."""
+        with METRICS.span('netlink.request'):
+            return self._request(msg_type, flags, payload)
+
+    def _request(self, msg_type: int, flags: int, payload: bytes) -> List[bytes]:
+        seq = self.send(msg_type, flags, payload)
+        replies = []
+        for reply_type, reply_flags, reply_seq, body in self.messages():
+            if reply_seq != seq:
+                continue
+            if reply_type == NLMSG_ERROR:
+                code = struct.unpack_from('=i', body)[0]
+                if code:
+                    raise NetlinkError(-code, os.strerror(-code))
+                return replies
+            if reply_type == NLMSG_DONE:
+                return replies
+            replies.append(body)
+            if not reply_flags & NLM_F_MULTI and not flags & NLM_F_ACK:
+                return replies
+        return replies
+
+
+class RecordedNetlinkSocket:
+    """Socket stand-in that replays recorded kernel datagrams.
+
+    Lets the netlink backend be exercised without a radio: requests are kept
+    in `sent` and every recv() returns the next recorded datagram.
+    """
+
+    def __init__(self, replies: List[bytes]):
+        self.replies = list(replies)
+        self.sent: List[bytes] = []
+
+    @classmethod
+    def from_file(cls, path: str) -> 'RecordedNetlinkSocket':
+        """Load datagrams stored one hex string per line."""
+        with open(path) as f:
+            return cls([bytes.fromhex(line.strip()) for line in f if line.strip()])
+
+    def bind(self, address) -> None:
+        pass
+
+    def setsockopt(self, *args) -> None:
+        pass
+
+    def settimeout(self, timeout) -> None:
+        pass
+
+    def setblocking(self, flag: bool) -> None:
+        pass
+
+    def fileno(self) -> int:
+        return -1
+
+    def close(self) -> None:
+        pass
+
+    def send(self, data: bytes) -> int:
+        self.sent.append(bytes(data))
+        return len(data)
+
+    def recv(self, bufsize: int) -> bytes:
+        if not self.replies:
+            raise socket.timeout('no more recorded replies')
+        return self.replies.pop(0)
+
+
+class RtNetlink:
+    """rtnetlink link configuration (the `ip link set` subset WifiMage needs)."""
+
+    def __init__(self, sock=None):
+        self.nl = NetlinkSocket(NETLINK_ROUTE, sock)
+
+    def set_link(self, ifindex: int, flags: int = 0, change: int = 0, attrs: bytes = b'') -> None:
+        payload = struct.pack('=BxHiII', socket.AF_UNSPEC, 0, ifindex, flags, change) + attrs
+        self.nl.request(RTM_NEWLINK, NLM_F_ACK, payload)
+
+    def dump_neighbours(self) -> List[tuple]:
+        """Return (ip, mac, state, ifindex) for every entry in the neighbour table."""
+        payload = struct.pack('=BBHiHBB', socket.AF_UNSPEC, 0, 0, 0, 0, 0, 0)
+        entries = [parse_neighbour(body) for body in self.nl.request(RTM_GETNEIGH, NLM_F_DUMP, payload)]
+        return [entry for entry in entries if entry]
+
+
+def parse_neighbour(body: bytes) -> Optional[tuple]:
+    """Decode an RTM_NEWNEIGH/RTM_DELNEIGH payload into (ip, mac, state, ifindex)."""
+    family, _, _, ifindex, state, _, _ = struct.unpack_from('=BBHiHBB', body)
+    attrs = nla_parse(body[12:])
+    if NDA_DST not in attrs or family not in (socket.AF_INET, socket.AF_INET6):
+        return None
+    mac = ':'.join(f"{b:02x}" for b in attrs[NDA_LLADDR]) if NDA_LLADDR in attrs else None
+    return socket.inet_ntop(family, attrs[NDA_DST]), mac, state, ifindex
+
+
+class Nl80211:
+    """nl80211 commands over a generic netlink socket."""
+
+    def __init__(self, sock=None):
+        self.nl = NetlinkSocket(NETLINK_GENERIC, sock)
+        self.family, self.groups = self.resolve_family('nl80211')
+
+    def resolve_family(self, name: str):
+        """Look up a generic netlink family id and its multicast groups."""
+        payload = struct.pack('=BBH', CTRL_CMD_GETFAMILY, 1, 0) + nla_pack(CTRL_ATTR_FAMILY_NAME, name.encode() + b'\0')
+        replies = self.nl.request(GENL_ID_CTRL, 0, payload)
+        if not replies:
+            raise NetlinkError(2, f"generic netlink family {name} not found")
+        attrs = nla_parse(replies[0][4:])
+        family = struct.unpack('=H', attrs[CTRL_ATTR_FAMILY_ID][:2])[0]
+        groups = {}
+        for group in nla_parse(attrs.get(CTRL_ATTR_MCAST_GROUPS, b'')).values():
+            group_attrs = nla_parse(group)
+            group_name = group_attrs[CTRL_ATTR_MCAST_GRP_NAME].rstrip(b'\0').decode()
+            groups[group_name] = struct.unpack('=I', group_attrs[CTRL_ATTR_MCAST_GRP_ID])[0]
+        return family, groups
+
+    def command(self, cmd: int, attrs: bytes, flags: int = NLM_F_ACK) -> List[Dict[int, bytes]]:
+        payload = struct.pack('=BBH', cmd, 0, 0) + attrs
+        return [nla_parse(body[4:]) for body in self.nl.request(self.family, flags, payload)]
+
+    def set_iftype(self, ifindex: int, iftype: int) -> None:
+        self.command(NL80211_CMD_SET_INTERFACE,
+                     nla_pack(NL80211_ATTR_IFINDEX, struct.pack('=I', ifindex)) +
+                     nla_pack(NL80211_ATTR_IFTYPE, struct.pack('=I', iftype)))
+
+    def new_interface(self, wiphy: int, name: str, iftype: int) -> None:
+        self.command(NL80211_CMD_NEW_INTERFACE,
+                     nla_pack(NL80211_ATTR_WIPHY, struct.pack('=I', wiphy)) +
+                     nla_pack(NL80211_ATTR_IFNAME, name.encode() + b'\0') +
+                     nla_pack(NL80211_ATTR_IFTYPE, struct.pack('=I', iftype)))
+
+    def del_interface(self, ifindex: int) -> None:
+        self.command(NL80211_CMD_DEL_INTERFACE, nla_pack(NL80211_ATTR_IFINDEX, struct.pack('=I', ifindex)))
+
+    def set_frequency(self, ifindex: int, frequency: int) -> None:
+        self.command(NL80211_CMD_SET_WIPHY,
+                     nla_pack(NL80211_ATTR_IFINDEX, struct.pack('=I', ifindex)) +
+                     nla_pack(NL80211_ATTR_WIPHY_FREQ, struct.pack('=I', frequency)))
+
+    def trigger_scan(self, ifindex: int, freqs: Optional[List[int]] = None) -> None:
+        """Start an active scan, limited to freqs (MHz) when given."""
+        attrs = nla_pack(NL80211_ATTR_IFINDEX, struct.pack('=I', ifindex))
+        if freqs:
+            attrs += nla_pack(NL80211_ATTR_SCAN_FREQUENCIES,
+                              b''.join(nla_pack(i, struct.pack('=I', freq)) for i, freq in enumerate(freqs)))
+        self.command(NL80211_CMD_TRIGGER_SCAN, attrs)
+
+    def get_survey(self, ifindex: int) -> List[Dict[int, bytes]]:
+        """Dump per-frequency survey data as raw NL80211_SURVEY_INFO_* attributes."""
+        replies = self.command(NL80211_CMD_GET_SURVEY, nla_pack(NL80211_ATTR_IFINDEX, struct.pack('=I', ifindex)),
+                               NLM_F_DUMP)
+        return [nla_parse(reply[NL80211_ATTR_SURVEY_INFO]) for reply in replies if NL80211_ATTR_SURVEY_INFO in reply]
+
+    def get_scan(self, ifindex: int) -> List[Dict[int, bytes]]:
+        """Dump the kernel's BSS table for ifindex as raw NL80211_BSS_* attributes."""
+        replies = self.command(NL80211_CMD_GET_SCAN, nla_pack(NL80211_ATTR_IFINDEX, struct.pack('=I', ifindex)),
+                               NLM_F_DUMP)
+        return [nla_parse(reply[NL80211_ATTR_BSS]) for reply in replies if NL80211_ATTR_BSS in reply]
+
+
+def bss_from_nl80211(attrs: Dict[int, bytes]) -> BSSRecord:
+    """Convert NL80211_BSS_* attributes into a BSSRecord."""
+    record = BSSRecord(':'.join(f"{b:02X}" for b in attrs[NL80211_BSS_BSSID]) if NL80211_BSS_BSSID in attrs else None)
+    if NL80211_BSS_FREQUENCY in attrs:
+        record.frequency = struct.unpack('=I', attrs[NL80211_BSS_FREQUENCY])[0]
+        record.channel = freq_to_channel(record.frequency)
+    if NL80211_BSS_SIGNAL_MBM in attrs:
+        record.signal = struct.unpack('=i', attrs[NL80211_BSS_SIGNAL_MBM])[0] // 100
+    if NL80211_BSS_CAPABILITY in attrs:
+        record.encrypted = bool(struct.unpack('=H', attrs[NL80211_BSS_CAPABILITY])[0] & WLAN_CAPABILITY_PRIVACY)
+    if NL80211_BSS_SEEN_MS_AGO in attrs:
+        record.last_seen -= struct.unpack('=I', attrs[NL80211_BSS_SEEN_MS_AGO])[0] / 1000
+    if NL80211_BSS_STATUS in attrs:
+        record.associated = struct.unpack('=I', attrs[NL80211_BSS_STATUS])[0] == NL80211_BSS_STATUS_ASSOCIATED
+    apply_ies(record, attrs.get(NL80211_BSS_INFORMATION_ELEMENTS, b''))
+    return record
+
+
+class CommandBackend:
+    """Interface configuration through the `ip`/`iw`/`iwlist` command line tools."""
+    name = 'cli'
+
+    def __init__(self, wm: 'WifiMage'):
+        self.wm = wm
+
+    def set_link(self, iface: str, up: bool) -> bool:
+        return self.wm.run_command(['sudo', 'ip', 'link', 'set', iface, 'up' if up else 'down'])
+
+    def set_type(self, iface: str, mode: str) -> bool:
+        return self.wm.run_command(['sudo', 'iw', iface, 'set', 'type', mode])
+
+    def set_name(self, iface: str, new_name: str) -> bool:
+        return self.wm.run_command(['sudo', 'ip', 'link', 'set', iface, 'name', new_name])
+
+    def set_channel(self, iface: str, channel: int) -> bool:
+        return self.wm.run_command(['sudo', 'iw', 'dev', iface, 'set', 'channel', str(channel)])
+
+    def add_interface(self, parent: str, name: str, mode: str) -> bool:
+        """Add a virtual interface on parent's phy."""
+        phy = read_sysfs(parent, 'phy80211/name')
+        return bool(phy) and self.wm.run_command(['sudo', 'iw', 'phy', phy, 'interface', 'add', name, 'type', mode])
+
+    def del_interface(self, iface: str) -> bool:
+        return self.wm.run_command(['sudo', 'iw', 'dev', iface, 'del'])
+
+    def survey(self, iface: str) -> List['ChannelSurvey']:
+        return parse_iw_survey(self.wm.read_command(['iw', 'dev', iface, 'survey', 'dump']))
+
+    def scan(self, iface: str, freqs: Optional[List[int]] = None) -> Optional[List[BSSRecord]]:
+        """Scan only freqs with `iw scan freq`; return None for a full sweep so the caller streams `iwlist scan`."""
+        if not freqs:
+            return None
+        return list(parse_scan_lines(stream_command(['sudo', 'iw', 'dev', iface, 'scan', 'freq'] +
+                                                    [str(freq) for freq in freqs])))
+
+    def scan_dump(self, iface: str) -> List[BSSRecord]:
+        """The kernel's cached BSS table, without scanning."""
+        return list(parse_scan_lines(self.wm.read_command(['iw', 'dev', iface, 'scan', 'dump']).splitlines()))
+
+
+class NetlinkBackend:
+    """Interface configuration over rtnetlink and nl80211 sockets.
+
+    Each operation falls back to the CLI backend when the socket call fails,
+    e.g. with EPERM when the tool is not running as root.
+    """
+    name = 'netlink'
+
+    def __init__(self, wm: 'WifiMage', socket_factory=None, scan_timeout: float = 15.0):
+        self.fallback = CommandBackend(wm)
+        self.socket_factory = socket_factory or (lambda protocol: None)
+        self.scan_timeout = scan_timeout
+        self.rt = RtNetlink(self.socket_factory(NETLINK_ROUTE))
+        self.nl80211 = Nl80211(self.socket_factory(NETLINK_GENERIC))
+        # The request sockets are shared by every interface worker thread
+        self.lock = threading.Lock()
+
+    def set_link(self, iface: str, up: bool) -> bool:
+        try:
+            with self.lock:
+                self.rt.set_link(socket.if_nametoindex(iface), IFF_UP if up else 0, IFF_UP)
+            return True
+        except OSError:
+            return self.fallback.set_link(iface, up)
+
+    def set_type(self, iface: str, mode: str) -> bool:
+        try:
+            with self.lock:
+                self.nl80211.set_iftype(socket.if_nametoindex(iface), NL80211_IFTYPES[mode])
+            return True
+        except OSError:
+            return self.fallback.set_type(iface, mode)
+
+    def set_name(self, iface: str, new_name: str) -> bool:
+        try:
+            with self.lock:
+                self.rt.set_link(socket.if_nametoindex(iface), attrs=nla_pack(IFLA_IFNAME, new_name.encode() + b'\0'))
+            return True
+        except OSError:
+            return self.fallback.set_name(iface, new_name)
+
+    def set_channel(self, iface: str, channel: int) -> bool:
+        try:
+            with self.lock:
+                self.nl80211.set_frequency(socket.if_nametoindex(iface), channel_to_freq(channel))
+            return True
+        except OSError:
+            return self.fallback.set_channel(iface, channel)
+
+    def add_interface(self, parent: str, name: str, mode: str) -> bool:
+        try:
+            wiphy = int(read_sysfs(parent, 'phy80211/index'))
+            with self.lock:
+                self.nl80211.new_interface(wiphy, name, NL80211_IFTYPES[mode])
+            return True
+        except (OSError, TypeError, ValueError):
+            return self.fallback.add_interface(parent, name, mode)
+
+    def del_interface(self, iface: str) -> bool:
+        try:
+            with self.lock:
+                self.nl80211.del_interface(socket.if_nametoindex(iface))
+            return True
+        except OSError:
+            return self.fallback.del_interface(iface)
+
+    def survey(self, iface: str) -> List['ChannelSurvey']:
+        try:
+            with self.lock:
+                entries = self.nl80211.get_survey(socket.if_nametoindex(iface))
+            return [survey_from_nl80211(entry) for entry in entries if NL80211_SURVEY_INFO_FREQUENCY in entry]
+        except OSError:
+            return self.fallback.survey(iface)
+
+    def scan_dump(self, iface: str) -> List[BSSRecord]:
+        try:
+            with self.lock:
+                table = self.nl80211.get_scan(socket.if_nametoindex(iface))
+            return [bss_from_nl80211(bss) for bss in table]
+        except OSError:
+            return self.fallback.scan_dump(iface)
+
+    def scan(self, iface: str, freqs: Optional[List[int]] = None) -> Optional[List[BSSRecord]]:
+        """Trigger a scan (of freqs only, when given), wait for the scan-done event and dump the results."""
+        try:
+            ifindex = socket.if_nametoindex(iface)
+            events = NetlinkSocket(NETLINK_GENERIC, self.socket_factory(NETLINK_GENERIC))
+            try:
+                events.subscribe(self.nl80211.groups['scan'])
+                events.sock.settimeout(self.scan_timeout)
+                with self.lock:
+                    self.nl80211.trigger_scan(ifindex, freqs)
+                for _, _, _, body in events.messages():
+                    cmd = body[0]
+                    attrs = nla_parse(body[4:])
+                    if struct.unpack('=I', attrs.get(NL80211_ATTR_IFINDEX, b'\0\0\0\0'))[0] != ifindex:
+                        continue
+                    if cmd == NL80211_CMD_SCAN_ABORTED:
+                        return None
+                    if cmd == NL80211_CMD_NEW_SCAN_RESULTS:
+                        break
+            finally:
+                events.close()
+            with self.lock:
+                table = self.nl80211.get_scan(ifindex)
+            return [bss_from_nl80211(bss) for bss in table]
+        except (OSError, KeyError):
+            return self.fallback.scan(iface, freqs)
+
+
+def make_backend(wm: 'WifiMage', name: str = 'auto'):
+    """Create the requested backend; 'auto' prefers netlink and falls back to the CLI tools."""
+    if name == 'cli':
+        return CommandBackend(wm)
+    try:
+        return NetlinkBackend(wm)
+    except (OSError, KeyError):
+        if name == 'netlink':
+            raise
+        return CommandBackend(wm)
+
+
+def parse_arp_line(line: str, iface: Optional[str] = None) -> Optional[tuple]:
+    """Parse one /proc/net/arp row into (ip, mac, complete) if it belongs to iface."""
+    fields = line.split()
+    if len(fields) < 6 or (iface and fields[5] != iface):
+        return None
+    try:
+        complete = bool(int(fields[2], 16) & ATF_COM) and fields[3] != '00:00:00:00:00:00'
+    except ValueError:
+        return None
+    return fields[0], fields[3].lower(), complete
+
+
+class ClientRecord:
+    """A client MAC with its IP history and first/last seen times."""
+    __slots__ = ('mac', 'ips', 'first_seen', 'last_seen', 'departed')
+    MAX_IPS = 16
+
+    def __init__(self, mac: str, now: float):
+        self.mac = mac
+        # ip -> last time it was bound to this MAC, oldest first
+        self.ips: 'OrderedDict[str, float]' = OrderedDict()
+        self.first_seen = now
+        self.last_seen = now
+        self.departed = False
+
+    @property
+    def ip(self) -> Optional[str]:
+        return next(reversed(self.ips), None)
+
+
+class ClientIndex:
+    """Persistent client table keyed by MAC, fed incrementally.
+
+    Updates come from neighbour netlink events (seen/gone), each O(1), or
+    from diffing successive /proc/net/arp snapshots. The /proc fallback
+    reads and set-diffs the whole table on every poll, O(table), but only
+    parses and applies the rows that changed.
+    A present entry's last_seen is stamped when it leaves the neighbour
+    table; it is reported as departed once absent for ttl seconds, and
+    forgotten once departed for retention seconds or when more than
+    MAX_DEPARTED departed clients are kept.
+    """
+    MAX_DEPARTED = 4096
+
+    def __init__(self, ttl: float = 300.0, retention: float = 86400.0):
+        self.ttl = ttl
+        self.retention = retention
+        self.clients: Dict[str, ClientRecord] = {}
+        self.present: Dict[str, str] = {}
+        self.refs: Dict[str, int] = {}
+        # mac -> time it left the table, in departure order
+        self.absent: 'OrderedDict[str, float]' = OrderedDict()
+        # mac -> time it was reported departed, oldest first
+        self.departed: 'OrderedDict[str, float]' = OrderedDict()
+        self._arp_lines: frozenset = frozenset()
+
+    def __len__(self) -> int:
+        return len(self.clients)
+
+    def seen(self, ip: str, mac: str, now: Optional[float] = None) -> Optional[ClientRecord]:
+        """Record ip -> mac; return the client if it is new or has come back."""
+        now = now or time.time()
+        previous = self.present.get(ip)
+        if previous == mac:
+            return None
+        if previous is not None:
+            self.gone(ip, now)
+        self.present[ip] = mac
+        self.refs[mac] = self.refs.get(mac, 0) + 1
+        self.absent.pop(mac, None)
+        self.departed.pop(mac, None)
+
+        record = self.clients.get(mac)
+        arrived = record is None or record.departed
+        if record is None:
+            record = self.clients[mac] = ClientRecord(mac, now)
+        record.departed = False
+        record.last_seen = now
+        record.ips[ip] = now
+        record.ips.move_to_end(ip)
+        if len(record.ips) > ClientRecord.MAX_IPS:
+            record.ips.popitem(last=False)
+        return record if arrived else None
+
+    def gone(self, ip: str, now: Optional[float] = None) -> None:
+        """Record that ip left the neighbour table."""
+        mac = self.present.pop(ip, None)
+        if mac is None:
+            return
+        self.refs[mac] -= 1
+        if self.refs[mac]:
+            return
+        del self.refs[mac]
+        now = now or time.time()
+        self.clients[mac].last_seen = now
+        self.absent[mac] = now
+
+    def expire(self, now: Optional[float] = None) -> List[ClientRecord]:
+        """Return clients that have now been absent for longer than the TTL."""
+        now = now or time.time()
+        departed = []
+        while self.absent:
+            mac, left = next(iter(self.absent.items()))
+            if now - left < self.ttl:
+                break
+            self.absent.popitem(last=False)
+            record = self.clients[mac]
+            record.departed = True
+            self.departed[mac] = now
+            departed.append(record)
+        while self.departed:
+            mac, left = next(iter(self.departed.items()))
+            if now - left < self.retention and len(self.departed) <= self.MAX_DEPARTED:
+                break
+            self.departed.popitem(last=False)
+            del self.clients[mac]
+        return departed
+
+    def update_from_arp(self, text: str, iface: Optional[str] = None, now: Optional[float] = None):
+        """Apply the difference between this and the previous /proc/net/arp snapshot.
+
+        The snapshot itself is O(table): /proc has no change feed, so every
+        row is hashed to find the changed ones. Returns (arrived, departed)
+        client lists.
+        """
+        now = now or time.time()
+        lines = frozenset(text.splitlines()[1:])
+        removed = self._arp_lines - lines
+        added = lines - self._arp_lines
+        self._arp_lines = lines
+
+        for line in removed:
+            entry = parse_arp_line(line, iface)
+            if entry:
+                self.gone(entry[0], now)
+        arrived = []
+        for line in added:
+            entry = parse_arp_line(line, iface)
+            if entry and entry[2]:
+                record = self.seen(entry[0], entry[1], now)
+                if record:
+                    arrived.append(record)
+        return arrived, self.expire(now)
+
+
+STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS observations (
+    ts REAL NOT NULL,
+    iface TEXT,
+    bssid INTEGER NOT NULL,
+    ssid TEXT,
+    frequency INTEGER,
+    channel INTEGER,
+    signal INTEGER,
+    encrypted INTEGER,
+    wpa TEXT,
+    group_cipher TEXT,
+    pairwise TEXT,
+    akm TEXT,
+    mfp TEXT
+);
+CREATE INDEX IF NOT EXISTS observations_bssid_ts ON observations (bssid, ts);
+CREATE INDEX IF NOT EXISTS observations_ssid_ts ON observations (ssid, ts);
+CREATE INDEX IF NOT EXISTS observations_ts ON observations (ts);
+"""
+STORE_COLUMNS = ('ts', 'iface', 'bssid', 'ssid', 'frequency', 'channel', 'signal', 'encrypted',
+                 'wpa', 'group_cipher', 'pairwise', 'akm', 'mfp')
+
+
+def valid_bssid(bssid: str) -> bool:
+    """Six colon-separated pairs of hex digits."""
+    octets = bssid.split(':')
+    return len(octets) == 6 and all(len(o) == 2 and all(c in '0123456789abcdefABCDEF' for c in o) for o in octets)
+
+
+def bssid_to_int(bssid: str) -> int:
+    return int(bssid.replace(':', ''), 16)
+
+
+def int_to_bssid(value: int) -> str:
+    return ':'.join(f"{value:012X}"[i:i + 2] for i in range(0, 12, 2))
+
+
+def parse_time(value: str) -> float:
+    """Parse '24h' / '30m' / '7d' / '90s' as "that long ago", or an ISO date/time."""
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+    if value and value[-1] in units and value[:-1].replace('.', '', 1).isdigit():
+        return time.time() - float(value[:-1]) * units[value[-1]]
+    return datetime.fromisoformat(value).timestamp()
+
+
+class ScanStore:
+    """Append-only scan history in daily SQLite (WAL) segments.
+
+    Each day gets its own `scans-YYYYMMDD.db` file under the store directory,
+    so old history is dropped by deleting whole segments. Observations are
+    indexed by BSSID, SSID and time; BSSIDs are stored as 48-bit integers.
+    """
+
+    def __init__(self, path: str, retention_days: int = 30):
+        self.path = path
+        self.retention_days = retention_days
+        self.lock = threading.Lock()
+        self.day: Optional[str] = None
+        self.db: Optional[sqlite3.Connection] = None
+        os.makedirs(path, exist_ok=True)
+
+    def _segment_path(self, day: str) -> str:
+        return os.path.join(self.path, f"scans-{day}.db")
+
+    def _writer(self, ts: float) -> sqlite3.Connection:
+        day = datetime.fromtimestamp(ts).strftime('%Y%m%d')
+        if day != self.day:
+            if self.db is not None:
+                self.db.close()
+            self.db = sqlite3.connect(self._segment_path(day), check_same_thread=False)
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute('PRAGMA synchronous=NORMAL')
+            self.db.executescript(STORE_SCHEMA)
+            self.day = day
+            self.prune()
+        return self.db
+
+    def append(self, networks: List[BSSRecord], iface: Optional[str] = None, ts: Optional[float] = None) -> int:
+        """Append one scan; returns the number of observations written."""
+        ts = ts or time.time()
+        rows = [(ts, iface, bssid_to_int(n.bssid), n.ssid, n.frequency, n.channel, n.signal, int(n.encrypted),
+                 '/'.join(n.wpa), n.group_cipher, ' '.join(n.pairwise_ciphers), ' '.join(n.akm_suites), n.mfp)
+                for n in networks if n.bssid]
+        with self.lock:
+            db = self._writer(ts)
+            with db:
+                db.executemany(f"INSERT INTO observations VALUES ({', '.join('?' * len(STORE_COLUMNS))})", rows)
+        return len(rows)
+
+    def close(self) -> None:
+        with self.lock:
+            if self.db is not None:
+                self.db.close()
+                self.db = None
+                self.day = None
+
+    def prune(self) -> None:
+        """Delete segments older than the retention period."""
+        if not self.retention_days:
+            return
+        cutoff = (datetime.now().timestamp() - self.retention_days * 86400)
+        for path in self.segments(until=cutoff):
+            if self._segment_day_end(path) < cutoff:
+                for suffix in ('', '-wal', '-shm'):
+                    try:
+                        os.remove(path + suffix)
+                    except OSError:
+                        pass
+
+    @staticmethod
+    def _segment_day_start(path: str) -> float:
+        return datetime.strptime(os.path.basename(path)[6:14], '%Y%m%d').timestamp()
+
+    def _segment_day_end(self, path: str) -> float:
+        return self._segment_day_start(path) + 86400
+
+    def segments(self, since: Optional[float] = None, until: Optional[float] = None) -> List[str]:
+        """Segment files that may hold observations in [since, until]."""
+        paths = []
+        for path in sorted(glob.glob(os.path.join(self.path, 'scans-[0-9]*.db'))):
+            if since is not None and self._segment_day_end(path) < since:
+                continue
+            if until is not None and self._segment_day_start(path) > until:
+                continue
+            paths.append(path)
+        return paths
+
+    def query(self, bssid: Optional[str] = None, ssid: Optional[str] = None, since: Optional[float] = None,
+              until: Optional[float] = None, limit: Optional[int] = None) -> Iterator[Dict]:
+        """Yield observations in time order, using the BSSID/SSID/time indexes."""
+        clauses, params = [], []
+        if bssid:
+            clauses.append('bssid = ?')
+            params.append(bssid_to_int(bssid))
+        if ssid is not None:
+            clauses.append('ssid = ?')
+            params.append(ssid)
+        if since is not None:
+            clauses.append('ts >= ?')
+            params.append(since)
+        if until is not None:
+            clauses.append('ts <= ?')
+            params.append(until)
+        sql = f"SELECT {', '.join(STORE_COLUMNS)} FROM observations"
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += ' ORDER BY ts'
+
+        remaining = limit
+        for path in self.segments(since, until):
+            db = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+            try:
+                for row in db.execute(sql + (f' LIMIT {int(remaining)}' if remaining else ''), params):
+                    record = dict(zip(STORE_COLUMNS, row))
+                    record['bssid'] = int_to_bssid(record['bssid'])
+                    record['encrypted'] = bool(record['encrypted'])
+                    yield record
+                    if remaining:
+                        remaining -= 1
+                        if not remaining:
+                            return
+            finally:
+                db.close()
+
+    def security_profiles(self, since: Optional[float] = None, until: Optional[float] = None) -> Iterator[Dict]:
+        """Yield one row per BSSID, SSID and advertised security, aggregated by SQLite in each segment."""
+        clauses, params = [], []
+        if since is not None:
+            clauses.append('ts >= ?')
+            params.append(since)
+        if until is not None:
+            clauses.append('ts <= ?')
+            params.append(until)
+        sql = ("SELECT bssid, ssid, encrypted, wpa, pairwise, akm, mfp, COUNT(*), MIN(ts), MAX(ts), "
+               "GROUP_CONCAT(DISTINCT iface) FROM observations")
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += ' GROUP BY bssid, ssid, encrypted, wpa, pairwise, akm, mfp'
+
+        for path in self.segments(since, until):
+            db = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+            try:
+                for bssid, ssid, encrypted, wpa, pairwise, akm, mfp, count, first, last, ifaces in db.execute(sql, params):
+                    yield {'bssid': int_to_bssid(bssid), 'ssid': ssid, 'encrypted': bool(encrypted), 'wpa': wpa or '',
+                           'pairwise': pairwise or '', 'akm': akm or '', 'mfp': mfp, 'observations': count,
+                           'first_seen': first, 'last_seen': last,
+                           'interfaces': tuple(ifaces.split(',')) if ifaces else ()}
+            finally:
+                db.close()
+
+
+# Security levels from weakest to strongest; WPA3 means RSN with only SAE or Suite-B AKMs
+SECURITY_RANK = {'Open': 0, 'WEP': 1, 'WPA': 2, 'WPA/WPA2': 2, 'OWE': 2, 'WPA2': 3, 'WPA2/WPA3': 4, 'WPA3': 5}
+WPA3_AKMS = {'SAE', 'FT/SAE', 'SAE-EXT-KEY', '802.1X/SUITE-B-192'}
+
+
+@lru_cache(maxsize=4096)
+def classify_security(encrypted: bool, wpa: str, pairwise: str, akm: str, mfp: Optional[str]) -> tuple:
+    """Classify one advertised configuration (in store column form) as (level, tkip_only, pmf, issues)."""
+    versions = set(wpa.split('/')) if wpa else set()
+    akms = set(akm.split())
+    if not encrypted:
+        level = 'Open'
+    elif not versions:
+        level = 'WEP'
+    elif 'WPA2' not in versions:
+        level = 'WPA'
+    elif akms == {'OWE'}:
+        level = 'OWE'
+    elif akms & WPA3_AKMS:
+        level = 'WPA3' if akms <= WPA3_AKMS else 'WPA2/WPA3'
+    else:
+        level = 'WPA/WPA2' if 'WPA' in versions else 'WPA2'
+    ciphers = set(pairwise.split())
+    tkip_only = bool(versions) and ciphers == {'TKIP'}
+
+    issues = []
+    if level == 'Open':
+        issues.append('no encryption')
+    elif level == 'WEP':
+        issues.append('WEP is broken')
+    elif level in ('WPA', 'WPA/WPA2'):
+        issues.append('legacy WPA enabled')
+    if tkip_only:
+        issues.append('TKIP only')
+    if level in ('WPA3', 'OWE') and mfp != 'required':
+        issues.append(f'{level} without required PMF')
+    return level, tkip_only, mfp, tuple(issues)
+
+
+class BSSSecurity:
+    """How one BSSID advertised one SSID, with the observations behind it."""
+    __slots__ = ('bssid', 'ssid', 'level', 'tkip_only', 'pmf', 'issues', 'observations', 'first_seen', 'last_seen',
+                 'interfaces')
+
+    def __init__(self, bssid: str, ssid: Optional[str], level: str, tkip_only: bool, pmf: Optional[str], issues: tuple):
+        self.bssid = bssid
+        self.ssid = ssid
+        self.level = level
+        self.tkip_only = tkip_only
+        self.pmf = pmf
+        self.issues = issues
+        self.observations = 0
+        self.first_seen: Optional[float] = None
+        self.last_seen: Optional[float] = None
+        # Interfaces that saw it; NODE/IFACE in history recorded by a collector
+        self.interfaces: Set[str] = set()
+
+    @property
+    def profile(self) -> str:
+        return f"{self.level}{' TKIP-only' if self.tkip_only else ''}, PMF {self.pmf or 'off'}"
+
+    def to_dict(self) -> Dict:
+        return dict({key: getattr(self, key) for key in self.__slots__}, interfaces=sorted(self.interfaces),
+                    issues=list(self.issues))
+
+
+class FleetAnalyzer:
+    """Classify every BSS of live scan tables or recorded history and check managed SSIDs.
+
+    managed maps each of our SSIDs to a policy, all keys optional:
+    {"bssids": ["64:66:B3:*"], "security": "WPA2", "pmf": "required"}.
+    Entries are indexed by SSID and BSSID, and identical configurations are
+    classified once, so history is folded in one aggregated row at a time.
+    """
+
+    def __init__(self, managed: Optional[Dict[str, Dict]] = None):
+        self.managed = managed or {}
+        # (bssid, ssid, level, tkip_only, pmf) -> entry
+        self.entries: Dict[tuple, BSSSecurity] = {}
+        self.by_ssid: Dict[Optional[str], List[BSSSecurity]] = {}
+        self.by_bssid: Dict[str, List[BSSSecurity]] = {}
+
+    def add(self, bssid: str, ssid: Optional[str], encrypted: bool, wpa: str, pairwise: str, akm: str,
+            mfp: Optional[str], observations: int = 1, first_seen: Optional[float] = None,
+            last_seen: Optional[float] = None, interfaces=()) -> BSSSecurity:
+        level, tkip_only, pmf, issues = classify_security(encrypted, wpa, pairwise, akm, mfp)
+        key = (bssid, ssid, level, tkip_only, pmf)
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.entries[key] = BSSSecurity(bssid, ssid, level, tkip_only, pmf, issues)
+            self.by_ssid.setdefault(ssid, []).append(entry)
+            self.by_bssid.setdefault(bssid, []).append(entry)
+        entry.observations += observations
+        if first_seen is not None and (entry.first_seen is None or first_seen < entry.first_seen):
+            entry.first_seen = first_seen
+        if last_seen is not None and (entry.last_seen is None or last_seen > entry.last_seen):
+            entry.last_seen = last_seen
+        entry.interfaces.update(interfaces)
+        return entry
+
+    def add_networks(self, networks: List[BSSRecord], iface: Optional[str] = None) -> None:
+        """Fold in a live scan table."""
+        for n in networks:
+            if n.bssid:
+                self.add(n.bssid.upper(), n.ssid, n.encrypted, '/'.join(n.wpa), ' '.join(n.pairwise_ciphers),
+                         ' '.join(n.akm_suites), n.mfp, 1, n.last_seen, n.last_seen, (iface,) if iface else ())
+
+    def add_store(self, store: ScanStore, since: Optional[float] = None, until: Optional[float] = None) -> None:
+        """Fold in recorded history through ScanStore.security_profiles."""
+        for row in store.security_profiles(since, until):
+            self.add(row['bssid'], row['ssid'], row['encrypted'], row['wpa'], row['pairwise'], row['akm'], row['mfp'],
+                     row['observations'], row['first_seen'], row['last_seen'], row['interfaces'])
+
+    def counts(self) -> Dict[str, int]:
+        """Distinct BSSIDs per security level."""
+        counts: Dict[str, int] = {}
+        for _, level in {(entry.bssid, entry.level) for entry in self.entries.values()}:
+            counts[level] = counts.get(level, 0) + 1
+        return dict(sorted(counts.items(), key=lambda item: SECURITY_RANK.get(item[0], 0)))
+
+    def weak(self) -> List[BSSSecurity]:
+        return sorted((entry for entry in self.entries.values() if entry.issues),
+                      key=lambda entry: (SECURITY_RANK.get(entry.level, 0), entry.ssid or '', entry.bssid))
+
+    def anomalies(self) -> List[Dict]:
+        """Problems with our managed SSIDs: mixed security, unexpected BSSIDs and policy violations."""
+        found = []
+        for ssid, policy in self.managed.items():
+            entries = self.by_ssid.get(ssid, [])
+            if not entries:
+                continue
+            profiles: Dict[str, Set[str]] = {}
+            for entry in entries:
+                profiles.setdefault(entry.profile, set()).add(entry.bssid)
+            if len(profiles) > 1:
+                found.append({'ssid': ssid, 'kind': 'mismatched security',
+                              'detail': '; '.join(f"{profile} on {len(bssids)} BSSID(s)"
+                                                  for profile, bssids in sorted(profiles.items())),
+                              'bssids': sorted(set.union(*profiles.values()))})
+            allowed = [pattern.upper() for pattern in policy.get('bssids', ())]
+            if allowed:
+                unexpected = sorted({entry.bssid for entry in entries
+                                     if not any(fnmatch.fnmatchcase(entry.bssid, pattern) for pattern in allowed)})
+                if unexpected:
+                    found.append({'ssid': ssid, 'kind': 'unexpected BSSID',
+                                  'detail': f"{len(unexpected)} BSSID(s) outside the expected list", 'bssids': unexpected})
+            minimum = policy.get('security')
+            if minimum in SECURITY_RANK:
+                weaker = sorted({entry.bssid for entry in entries if SECURITY_RANK[entry.level] < SECURITY_RANK[minimum]})
+                if weaker:
+                    found.append({'ssid': ssid, 'kind': 'below policy',
+                                  'detail': f"weaker than {minimum}", 'bssids': weaker})
+            if policy.get('pmf') == 'required':
+                optional = sorted({entry.bssid for entry in entries if entry.pmf != 'required'})
+                if optional:
+                    found.append({'ssid': ssid, 'kind': 'below policy',
+                                  'detail': 'PMF not required', 'bssids': optional})
+        return found
+
+    def to_dict(self) -> Dict:
+        return {'counts': self.counts(), 'anomalies': self.anomalies(),
+                'networks': [entry.to_dict() for entry in self.entries.values()]}
+
+
+def load_managed_ssids(policy_file: Optional[str] = None, ssids: Optional[List[str]] = None) -> Dict[str, Dict]:
+    """Managed SSID policies from a JSON file, plus SSIDs named on the command line without a policy."""
+    managed: Dict[str, Dict] = {}
+    if policy_file:
+        with open(policy_file) as f:
+            managed.update(json.load(f))
+    for ssid in ssids or ():
+        managed.setdefault(ssid, {})
+    return managed
+
+
+def print_security_report(analyzer: FleetAnalyzer, limit: Optional[int] = 50) -> None:
+    """Print per-level counts, managed SSID anomalies and the BSSes with security issues."""
+    print(f"\n{Fore.GREEN}Networks by security:")
+    for level, count in analyzer.counts().items():
+        color = Fore.RED if SECURITY_RANK.get(level, 0) < 2 else Fore.YELLOW if SECURITY_RANK[level] < 3 else Fore.WHITE
+        print(f"{color}{level:10} {Fore.LIGHTCYAN_EX}{count}")
+
+    anomalies = analyzer.anomalies()
+    if analyzer.managed:
+        if anomalies:
+            print(f"\n{Fore.RED}Managed SSID anomalies:")
+            for anomaly in anomalies:
+                print(f"{Fore.RED}* {anomaly['ssid']}: {anomaly['kind']} ({anomaly['detail']})")
+                for bssid in anomaly['bssids'][:limit]:
+                    print(f"{Fore.WHITE}    {bssid}")
+        else:
+            print(f"\n{Fore.GREEN}No anomalies in {len(analyzer.managed)} managed SSID(s)")
+
+    weak = analyzer.weak()
+    if weak:
+        print(f"\n{Fore.RED}Networks with security issues:")
+        for entry in weak[:limit]:
+            print(f"{Fore.LIGHTCYAN_EX}{entry.bssid}  {Fore.WHITE}{(entry.ssid or '<hidden>')[:32]:32} "
+                  f"{Fore.YELLOW}{entry.profile:24} {Fore.RED}{', '.join(entry.issues)}")
+        if limit and len(weak) > limit:
+            print(f"{Fore.YELLOW}... and {len(weak) - limit} more")
+
+
+# Radiotap fields up to antenna signal: (alignment, size) by present bit
+RADIOTAP_FIELDS = ((8, 8), (1, 1), (1, 1), (2, 4), (1, 2), (1, 1))
+RADIOTAP_FLAGS_FCS = 0x10
+ETH_P_ALL = 0x0003
+LINKTYPE_IEEE802_11 = 105
+LINKTYPE_RADIOTAP = 127
+IEEE80211_SUBTYPE_PROBE_RESP = 5
+IEEE80211_SUBTYPE_BEACON = 8
+DEFAULT_SURVEY_CHANNELS = (1, 6, 11, 2, 7, 3, 8, 4, 9, 5, 10, 36, 40, 44, 48, 149, 153, 157, 161)
+
+
+def parse_radiotap(frame) -> tuple:
+    """Return (header length, frequency, dBm signal, has FCS) from a radiotap header."""
+    length, present = struct.unpack_from('<HI', frame, 2)
+    offset = 8
+    word = present
+    while word & 0x80000000:
+        word = struct.unpack_from('<I', frame, offset)[0]
+        offset += 4
+    frequency = signal = None
+    fcs = False
+    for bit, (align, size) in enumerate(RADIOTAP_FIELDS):
+        if not present & (1 << bit):
+            continue
+        offset += -offset % align
+        if bit == 1:
+            fcs = bool(frame[offset] & RADIOTAP_FLAGS_FCS)
+        elif bit == 3:
+            frequency = struct.unpack_from('<H', frame, offset)[0]
+        elif bit == 5:
+            signal = struct.unpack_from('<b', frame, offset)[0]
+        offset += size
+    return length, frequency, signal, fcs
+
+
+def iter_pcap(path: str) -> Iterator[tuple]:
+    """Yield (timestamp, frame memoryview, linktype) from a pcap file without copying frames."""
+    with open(path, 'rb') as f:
+        data = memoryview(f.read())
+    magic = struct.unpack_from('<I', data, 0)[0]
+    if magic in (0xa1b2c3d4, 0xa1b23c4d):
+        endian = '<'
+    elif magic in (0xd4c3b2a1, 0x4d3cb2a1):
+        endian = '>'
+    else:
+        raise ValueError(f"{path} is not a pcap file")
+    divisor = 1e9 if magic in (0xa1b23c4d, 0x4d3cb2a1) else 1e6
+    linktype = struct.unpack_from(endian + 'I', data, 20)[0]
+    record = struct.Struct(endian + 'IIII')
+    offset = 24
+    while offset + 16 <= len(data):
+        seconds, fraction, captured, _ = record.unpack_from(data, offset)
+        offset += 16
+        yield seconds + fraction / divisor, data[offset:offset + captured], linktype
+        offset += captured
+
+
+class SurveyEntry(BSSRecord):
+    """A BSS in the passive survey table, with frame and RSSI statistics."""
+    __slots__ = ('frames', 'beacons', 'probe_responses', 'rssi_sum', 'rssi_count', 'rssi_min', 'rssi_max',
+                 'first_seen')
+
+    def __init__(self, bssid: str, now: float):
+        super().__init__(bssid)
+        self.frames = 0
+        self.beacons = 0
+        self.probe_responses = 0
+        self.rssi_sum = 0
+        self.rssi_count = 0
+        self.rssi_min: Optional[int] = None
+        self.rssi_max: Optional[int] = None
+        self.first_seen = now
+        self.last_seen = now
+
+    @property
+    def rssi_avg(self) -> Optional[float]:
+        return self.rssi_sum / self.rssi_count if self.rssi_count else None
+
+
+class SurveyEngine:
+    """Passive site survey from beacons and probe responses on a monitor interface.
+
+    Frames are parsed in place through memoryview/struct: the radiotap
+    header for frequency and signal, then the 802.11 management header for
+    the BSSID. Information elements are only decoded the first time a BSS is
+    seen; later frames just update counters and RSSI statistics.
+    """
+
+    def __init__(self):
+        self.table: Dict[bytes, SurveyEntry] = {}
+        self.channel_frames: Dict[int, int] = {}
+        self.frames = 0
+        self.management_frames = 0
+        self.errors = 0
+        self.current_channel: Optional[int] = None
+        self.started = time.time()
+
+    def feed(self, frame, now: float, radiotap: bool = True) -> None:
+        """Account one captured frame."""
+        self.frames += 1
+        try:
+            if radiotap:
+                header, frequency, signal, fcs = parse_radiotap(frame)
+            else:
+                header, frequency, signal, fcs = 0, None, None, False
+            channel = freq_to_channel(frequency) if frequency else self.current_channel
+            if channel is not None:
+                self.channel_frames[channel] = self.channel_frames.get(channel, 0) + 1
+            end = len(frame) - 4 if fcs else len(frame)
+            if end - header < 36:
+                return
+            fc = frame[header]
+            # Management frames only (type bits 2-3 == 0), beacon or probe response
+            subtype = fc >> 4
+            if fc & 0x0c or subtype not in (IEEE80211_SUBTYPE_BEACON, IEEE80211_SUBTYPE_PROBE_RESP):
+                return
+            self.management_frames += 1
+            key = bytes(frame[header + 16:header + 22])
+            entry = self.table.get(key)
+            if entry is None:
+                entry = self.table[key] = SurveyEntry(':'.join(f"{b:02X}" for b in key), now)
+                capability = struct.unpack_from('<H', frame, header + 34)[0]
+                entry.encrypted = bool(capability & WLAN_CAPABILITY_PRIVACY)
+                apply_ies(entry, frame[header + 36:end])
+                if frequency:
+                    entry.frequency = frequency
+                if entry.channel is None:
+                    entry.channel = channel
+        except (struct.error, IndexError):
+            self.errors += 1
+            return
+
+        entry.frames += 1
+        if subtype == IEEE80211_SUBTYPE_BEACON:
+            entry.beacons += 1
+        else:
+            entry.probe_responses += 1
+        entry.last_seen = now
+        if signal is not None:
+            entry.signal = signal
+            entry.rssi_sum += signal
+            entry.rssi_count += 1
+            if entry.rssi_min is None or signal < entry.rssi_min:
+                entry.rssi_min = signal
+            if entry.rssi_max is None or signal > entry.rssi_max:
+                entry.rssi_max = signal
+
+    def feed_pcap(self, path: str) -> None:
+        """Replay a pcap capture (radiotap or plain 802.11 link type) through the engine."""
+        for ts, frame, linktype in iter_pcap(path):
+            if linktype not in (LINKTYPE_RADIOTAP, LINKTYPE_IEEE802_11):
+                raise ValueError(f"unsupported pcap link type {linktype}")
+            self.feed(frame, ts, linktype == LINKTYPE_RADIOTAP)
+
+    def channel_occupancy(self) -> List[tuple]:
+        """(channel, BSS count, frames of any type, share of frames) sorted by channel."""
+        bss_per_channel: Dict[int, int] = {}
+        for entry in self.table.values():
+            if entry.channel is not None:
+                bss_per_channel[entry.channel] = bss_per_channel.get(entry.channel, 0) + 1
+        total = sum(self.channel_frames.values()) or 1
+        channels = sorted(set(bss_per_channel) | set(self.channel_frames))
+        return [(channel, bss_per_channel.get(channel, 0), self.channel_frames.get(channel, 0),
+                 self.channel_frames.get(channel, 0) / total) for channel in channels]
+
+    def capture(self, iface: str, backend, channels=DEFAULT_SURVEY_CHANNELS, dwell: float = 0.25,
+                duration: Optional[float] = None, on_tick=None, tick: float = 5.0) -> None:
+        """Capture from iface with an AF_PACKET socket while hopping channels."""
+        sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+        sock.bind((iface, 0))
+        sock.settimeout(0.5)
+        stop = threading.Event()
+
+        def hop():
+            while not stop.is_set():
+                for channel in channels:
+                    if stop.is_set():
+                        break
+                    if backend.set_channel(iface, channel):
+                        self.current_channel = channel
+                    stop.wait(dwell)
+
+        hopper = threading.Thread(target=hop, daemon=True)
+        if len(channels) > 1:
+            hopper.start()
+        elif channels:
+            backend.set_channel(iface, channels[0])
+            self.current_channel = channels[0]
+
+        buffer = bytearray(65536)
+        view = memoryview(buffer)
+        deadline = time.time() + duration if duration else None
+        next_tick = time.time() + tick
+        try:
+            while deadline is None or time.time() < deadline:
+                try:
+                    size = sock.recv_into(buffer)
+                except socket.timeout:
+                    size = 0
+                now = time.time()
+                if size:
+                    self.feed(view[:size], now)
+                if on_tick and now >= next_tick:
+                    on_tick(self)
+                    next_tick = now + tick
+        finally:
+            stop.set()
+            sock.close()
+
+
+class ChannelSurvey:
+    """Survey counters for one frequency; times are cumulative milliseconds."""
+    __slots__ = ('frequency', 'noise', 'in_use', 'active', 'busy', 'rx', 'tx')
+
+    def __init__(self, frequency: int):
+        self.frequency = frequency
+        self.noise: Optional[int] = None
+        self.in_use = False
+        self.active: Optional[int] = None
+        self.busy: Optional[int] = None
+        self.rx: Optional[int] = None
+        self.tx: Optional[int] = None
+
+
+def parse_iw_survey(text: str) -> List[ChannelSurvey]:
+    """Parse `iw dev <iface> survey dump` output."""
+    surveys = []
+    fields = {'channel active time': 'active', 'channel busy time': 'busy',
+              'channel receive time': 'rx', 'channel transmit time': 'tx'}
+    for line in text.splitlines():
+        key, _, value = line.strip().partition(':')
+        value = value.strip()
+        if key == 'frequency':
+            surveys.append(ChannelSurvey(int(value.split()[0])))
+            surveys[-1].in_use = '[in use]' in value
+        elif not surveys or not value:
+            continue
+        elif key == 'noise':
+            surveys[-1].noise = int(value.split()[0])
+        elif key in fields:
+            setattr(surveys[-1], fields[key], int(value.split()[0]))
+    return surveys
+
+
+def survey_from_nl80211(attrs: Dict[int, bytes]) -> ChannelSurvey:
+    """Convert NL80211_SURVEY_INFO_* attributes into a ChannelSurvey."""
+    survey = ChannelSurvey(struct.unpack('=I', attrs[NL80211_SURVEY_INFO_FREQUENCY])[0])
+    survey.in_use = NL80211_SURVEY_INFO_IN_USE in attrs
+    if NL80211_SURVEY_INFO_NOISE in attrs:
+        survey.noise = struct.unpack('=b', attrs[NL80211_SURVEY_INFO_NOISE][:1])[0]
+    for attr, name in ((NL80211_SURVEY_INFO_TIME, 'active'), (NL80211_SURVEY_INFO_TIME_BUSY, 'busy'),
+                       (NL80211_SURVEY_INFO_TIME_RX, 'rx'), (NL80211_SURVEY_INFO_TIME_TX, 'tx')):
+        if attr in attrs:
+            setattr(survey, name, struct.unpack('=Q', attrs[attr][:8])[0])
+    return survey
+
+
+class SurveySampler:
+    """Incremental channel utilisation from successive survey dumps.
+
+    Only the previous counters and a bounded window of per-sample deltas
+    (active, busy, rx, tx ms) are kept per frequency, so sampling can run
+    continuously at sub-second intervals. Counter resets are skipped.
+    """
+
+    def __init__(self, window: int = 64):
+        self.window = window
+        self.previous: Dict[int, ChannelSurvey] = {}
+        self.deltas: Dict[int, deque] = {}
+        self.noise: Dict[int, int] = {}
+
+    def add(self, surveys: List[ChannelSurvey]) -> None:
+        for survey in surveys:
+            if survey.noise is not None:
+                self.noise[survey.frequency] = survey.noise
+            previous = self.previous.get(survey.frequency)
+            self.previous[survey.frequency] = survey
+            if previous is None or survey.active is None or previous.active is None:
+                continue
+            delta = tuple((getattr(survey, name) or 0) - (getattr(previous, name) or 0)
+                          for name in ('active', 'busy', 'rx', 'tx'))
+            if delta[0] <= 0 or min(delta) < 0:
+                continue
+            self.deltas.setdefault(survey.frequency, deque(maxlen=self.window)).append(delta)
+
+    def utilization(self, frequency: int) -> Optional[float]:
+        """Busy time over active time across the window, falling back to the absolute counters."""
+        deltas = self.deltas.get(frequency)
+        if deltas:
+            active = sum(d[0] for d in deltas)
+            return sum(d[1] for d in deltas) / active if active else None
+        survey = self.previous.get(frequency)
+        if survey and survey.active and survey.busy is not None:
+            return survey.busy / survey.active
+        return None
+
+
+class ChannelLoad:
+    """Load estimate for one channel, the numbers behind a channel recommendation."""
+    __slots__ = ('channel', 'bss', 'co_channel', 'adjacent', 'utilization', 'noise', 'score')
+
+    def __init__(self, channel: int):
+        self.channel = channel
+        self.bss = 0
+        self.co_channel = 0.0
+        self.adjacent = 0.0
+        self.utilization: Optional[float] = None
+        self.noise: Optional[int] = None
+        self.score = 0.0
+
+    @property
+    def measured(self) -> bool:
+        """Whether the channel was surveyed or has BSSes on it; otherwise its load is unknown."""
+        return self.utilization is not None or self.bss > 0
+
+    def to_dict(self) -> Dict:
+        return {key: getattr(self, key) for key in self.__slots__}
+
+
+CANDIDATE_CHANNELS_2GHZ = (1, 6, 11)
+CANDIDATE_CHANNELS_5GHZ = (36, 40, 44, 48, 149, 153, 157, 161, 165)
+
+
+def _signal_weight(signal: Optional[int]) -> float:
+    """How much a neighbouring BSS counts: 0 at -95 dBm or below, 1 at -35 dBm or above."""
+    if signal is None:
+        return 0.5
+    return min(1.0, max(0.0, (signal + 95) / 60))
+
+
+def channel_loads(networks: List[BSSRecord], sampler: Optional[SurveySampler] = None,
+                  exclude_bssid: Optional[str] = None) -> Dict[int, ChannelLoad]:
+    """Score candidate and occupied channels from the scan table and survey data.
+
+    co_channel sums the signal weight of BSSes on the channel; adjacent adds
+    2.4 GHz BSSes up to four channels away, scaled by spectral overlap.
+    score = 100 * busy ratio + 20 * co_channel + 10 * adjacent (lower is better);
+    the busy term is left out where the channel has no survey data, so such
+    scores only compare with each other.
+    """
+    loads: Dict[int, ChannelLoad] = {}
+    occupied = {n.channel for n in networks if n.channel}
+    for channel in set(CANDIDATE_CHANNELS_2GHZ) | set(CANDIDATE_CHANNELS_5GHZ) | occupied:
+        loads[channel] = ChannelLoad(channel)
+
+    for network in networks:
+        if not network.channel or (exclude_bssid and network.bssid == exclude_bssid):
+            continue
+        weight = _signal_weight(network.signal)
+        for load in loads.values():
+            distance = abs(load.channel - network.channel)
+            if distance == 0:
+                load.bss += 1
+                load.co_channel += weight
+            elif network.channel <= 14 and load.channel <= 14 and distance < 5:
+                load.adjacent += weight * (5 - distance) / 5
+
+    for load in loads.values():
+        if sampler is not None:
+            frequency = channel_to_freq(load.channel)
+            load.utilization = sampler.utilization(frequency)
+            load.noise = sampler.noise.get(frequency)
+        load.score = 100 * (load.utilization or 0) + 20 * load.co_channel + 10 * load.adjacent
+    return loads
+
+
+SCAN_TIERS = ('cache', 'targeted', 'full')
+
+
+class ScanReport:
+    """Outcome of one scheduled scan: which tier ran, how long it took and how old its data is."""
+    __slots__ = ('tier', 'networks', 'duration', 'timestamp')
+
+    def __init__(self, tier: str, networks: List[BSSRecord], duration: float):
+        self.tier = tier
+        self.networks = networks
+        self.duration = duration
+        self.timestamp = time.time()
+
+    @property
+    def age(self) -> Optional[float]:
+        """Seconds since the most recently observed BSS was seen."""
+        return self.timestamp - max(n.last_seen for n in self.networks) if self.networks else None
+
+    @property
+    def oldest(self) -> Optional[float]:
+        return self.timestamp - min(n.last_seen for n in self.networks) if self.networks else None
+
+    def summary(self) -> str:
+        text = f"{self.tier.capitalize()} scan: {len(self.networks)} networks in {self.duration:.2f}s"
+        if self.networks:
+            text += f", data age {self.age:.1f}s (oldest {self.oldest:.1f}s)"
+        return text
+
+
+class ScanScheduler:
+    """Pick the cheapest scan that keeps an interface's BSS table fresh.
+
+    1. cache: dump the kernel's BSS table, used as is while this
+       scheduler's last active scan is younger than cache_max_age. The
+       entries' own timestamps are no guide: the associated AP refreshes
+       its entry with every beacon.
+    2. targeted: an active scan of only the frequencies where known
+       networks live (or the fixed freqs given).
+    3. full: a sweep of every channel, on the first run (unless freqs
+       are fixed) and then every full_interval seconds. A sweep that turns
+       up no new BSS doubles full_interval up to max_full_interval; one
+       that does resets it.
+    """
+
+    def __init__(self, wm: 'WifiMage', iface: str, cache_max_age: float = 10.0, full_interval: float = 60.0,
+                 max_full_interval: float = 600.0, freqs: Optional[List[int]] = None, tier: str = 'auto'):
+        self.wm = wm
+        self.iface = iface
+        self.cache_max_age = cache_max_age
+        self.min_full_interval = full_interval
+        self.max_full_interval = max(full_interval, max_full_interval)
+        self.full_interval = full_interval
+        self.freqs = freqs
+        self.tier = tier
+        # Nothing scanned yet: the first run sweeps every channel, or only the fixed freqs
+        self.last_full = time.time() if freqs else 0.0
+        self.last_scan = 0.0
+        # bssid -> frequency of every network seen by the last scans
+        self.known: Dict[str, int] = {}
+
+    def full_due(self) -> bool:
+        return time.time() - self.last_full >= self.full_interval
+
+    def run(self, on_record=None) -> ScanReport:
+        """Run the tier the schedule calls for; on_record is called with each BSS as it arrives."""
+        start = time.perf_counter()
+        tier = self.tier
+        cached = []
+        if tier == 'auto':
+            tier = 'full' if self.full_due() else None
+        if tier in (None, 'cache'):
+            with METRICS.span('phase.parse'):
+                cached = self.wm.backend.scan_dump(self.iface)
+            if tier == 'cache' or (cached and time.time() - self.last_scan <= self.cache_max_age):
+                return self._finish('cache', cached, start, on_record)
+        freqs = None
+        if tier != 'full':
+            freqs = self.freqs or sorted({n.frequency for n in cached if n.frequency} | set(self.known.values()))
+            tier = 'targeted' if freqs else 'full'
+        networks = []
+        for network in self.wm.scan(self.iface, freqs):
+            networks.append(network)
+            if on_record is not None:
+                on_record(network)
+        return self._finish(tier, networks, start)
+
+    def _finish(self, tier: str, networks: List[BSSRecord], start: float, on_record=None) -> ScanReport:
+        if on_record is not None:
+            for network in networks:
+                on_record(network)
+        report = ScanReport(tier, networks, time.perf_counter() - start)
+        METRICS.observe(f'scan.{tier}', report.duration)
+        METRICS.incr(f'scans_{tier}')
+        seen = {n.bssid: n.frequency for n in networks if n.bssid and n.frequency}
+        if tier != 'cache':
+            self.last_scan = time.time()
+        if tier == 'full':
+            found_new = bool(seen.keys() - self.known.keys())
+            self.full_interval = (self.min_full_interval if found_new
+                                  else min(self.full_interval * 2, self.max_full_interval))
+            self.last_full = time.time()
+            self.known = seen
+        else:
+            self.known.update(seen)
+        return report
+
+
+class RSSIHistory:
+    """Signal history of one BSS in fixed-size ring buffers, with its presence state."""
+    __slots__ = ('bssid', 'ssid', 'channel', 'samples', 'times', 'next', 'count', 'smoothed',
+                 'present', 'hits', 'misses', 'first_seen', 'last_seen')
+
+    def __init__(self, bssid: str, size: int = 64):
+        self.bssid = bssid
+        self.ssid: Optional[str] = None
+        self.channel: Optional[int] = None
+        self.samples = array('h', bytes(2 * size))
+        self.times = array('d', bytes(8 * size))
+        self.next = 0
+        self.count = 0
+        self.smoothed: Optional[float] = None
+        self.present = False
+        self.hits = 0
+        self.misses = 0
+        self.first_seen: Optional[float] = None
+        self.last_seen = 0.0
+
+    def add(self, signal: int, ts: float, alpha: float = 0.3) -> None:
+        """Store a sample, overwriting the oldest once the buffer is full, and update the EWMA."""
+        self.samples[self.next] = signal
+        self.times[self.next] = ts
+        self.next = (self.next + 1) % len(self.samples)
+        self.count = min(self.count + 1, len(self.samples))
+        self.smoothed = signal if self.smoothed is None else self.smoothed + alpha * (signal - self.smoothed)
+
+    def series(self) -> List[tuple]:
+        """(timestamp, dBm) samples, oldest first."""
+        start = (self.next - self.count) % len(self.samples)
+        return [(self.times[(start + i) % len(self.samples)], self.samples[(start + i) % len(self.samples)])
+                for i in range(self.count)]
+
+    @property
+    def signal_text(self) -> str:
+        return f"{self.smoothed:.0f} dBm" if self.smoothed is not None else 'N/A'
+
+
+class BSSTracker:
+    """Debounced per-BSSID presence and roaming from successive scan tables.
+
+    A BSS appears after appear_after consecutive fresh sightings above
+    min_signal and disappears after disappear_after consecutive scans
+    without one; a present BSS may fade hysteresis dB below min_signal
+    before it counts as missed. Entries absent for forget_after scans are
+    dropped and at most max_entries are kept, so memory stays bounded.
+    """
+
+    def __init__(self, size: int = 64, appear_after: int = 2, disappear_after: int = 3, min_signal: int = -90,
+                 hysteresis: int = 5, alpha: float = 0.3, roam_margin: float = 8.0, forget_after: int = 100,
+                 max_entries: int = 4096):
+        self.size = size
+        self.appear_after = appear_after
+        self.disappear_after = disappear_after
+        self.min_signal = min_signal
+        self.hysteresis = hysteresis
+        self.alpha = alpha
+        self.roam_margin = roam_margin
+        self.forget_after = forget_after
+        self.max_entries = max_entries
+        # Least recently seen first
+        self.entries: 'OrderedDict[str, RSSIHistory]' = OrderedDict()
+        self.associated: Optional[str] = None
+        self.roam_candidate: Optional[str] = None
+
+    def update(self, networks: List[BSSRecord]) -> List[tuple]:
+        """Fold in one scan table; returns (event, history, other) tuples.
+
+        Events are 'appeared', 'disappeared', 'roamed' (other is the BSS
+        we left) and 'roam_candidate' (other is the current, weaker BSS).
+        """
+        events = []
+        fresh = set()
+        associated = None
+        for network in networks:
+            if not network.bssid:
+                continue
+            history = self.entries.get(network.bssid)
+            if history is None:
+                history = self.entries[network.bssid] = RSSIHistory(network.bssid, self.size)
+                history.first_seen = network.last_seen
+            if network.associated:
+                associated = network.bssid
+            fresh.add(network.bssid)
+            # Kernel cache entries that were not heard again since the last table are neither a hit nor a miss
+            if network.last_seen <= history.last_seen:
+                continue
+            history.last_seen = network.last_seen
+            history.ssid = network.ssid or history.ssid
+            history.channel = network.channel or history.channel
+            self.entries.move_to_end(network.bssid)
+            if network.signal is not None:
+                history.add(network.signal, network.last_seen, self.alpha)
+            floor = self.min_signal - (self.hysteresis if history.present else 0)
+            if history.smoothed is not None and history.smoothed < floor:
+                self._miss(history, events)
+                continue
+            history.misses = 0
+            history.hits += 1
+            if not history.present and history.hits >= self.appear_after:
+                history.present = True
+                events.append(('appeared', history, None))
+
+        for bssid, history in list(self.entries.items()):
+            if bssid not in fresh:
+                self._miss(history, events)
+                if not history.present and history.misses >= self.forget_after:
+                    del self.entries[bssid]
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+        self._check_roaming(associated, events)
+        return events
+
+    def _miss(self, history: RSSIHistory, events: List[tuple]) -> None:
+        history.hits = 0
+        history.misses += 1
+        if history.present and history.misses >= self.disappear_after:
+            history.present = False
+            events.append(('disappeared', history, None))
+
+    def _check_roaming(self, associated: Optional[str], events: List[tuple]) -> None:
+        if associated is None:
+            return
+        current = self.entries.get(associated)
+        if self.associated and associated != self.associated and current is not None:
+            events.append(('roamed', current, self.entries.get(self.associated)))
+            self.roam_candidate = None
+        self.associated = associated
+        if current is None or current.smoothed is None:
+            return
+        better = [h for h in self.entries.values() if h.present and h.ssid == current.ssid and h is not current
+                  and h.smoothed is not None and h.smoothed >= current.smoothed + self.roam_margin]
+        best = max(better, key=lambda h: h.smoothed).bssid if better else None
+        if best is not None and best != self.roam_candidate:
+            events.append(('roam_candidate', self.entries[best], current))
+        self.roam_candidate = best
+
+    def present(self) -> List[RSSIHistory]:
+        return [history for history in self.entries.values() if history.present]
+
+
+# --json/--ndjson record types of BSSTracker events
+EVENT_TYPES = {'appeared': 'network_appeared', 'disappeared': 'network_lost'}
+
+
+class RealtimeMonitor:
+    """Event-driven real-time monitor for one interface.
+
+    With the netlink backend it listens to nl80211 scan-done notifications
+    and rtnetlink neighbour/link events and diffs state as soon as each
+    event arrives. Active scans run on an adaptive cadence: a scan that
+    finds changes resets the interval to min_interval, a quiet one doubles
+    it up to max_interval. Without netlink the same cadence drives a
+    polling loop over /proc/net/arp. Each active scan goes through a
+    ScanScheduler, so most cycles read the kernel's BSS cache or scan only
+    the known channels; scans triggered by other programs are diffed too.
+    """
+
+    def __init__(self, wm: 'WifiMage', iface: str, min_interval: float = 2.0, max_interval: float = 60.0,
+                 label: str = '', client_ttl: float = 300.0):
+        self.wm = wm
+        self.iface = iface
+        self.label = label
+        self.networks = wm.bss_tracker()
+        self.clients = ClientIndex(client_ttl)
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        self.ifindex: Optional[int] = None
+        self.nl80211: Optional[Nl80211] = None
+        self.operstate: Optional[str] = None
+        self.event_sockets: List[NetlinkSocket] = []
+        self.stopped: Optional[asyncio.Event] = None
+        self.scheduler = wm.scan_scheduler(iface)
+        self.scanning = False
+        self.scan_finished = 0.0
+        self.scan_fetch: Optional[asyncio.Task] = None
+
+    def stop(self) -> None:
+        if self.stopped is not None:
+            self.stopped.set()
+
+    def _open_event_sockets(self, loop) -> None:
+        backend = self.wm.backend
+        if not isinstance(backend, NetlinkBackend):
+            return
+        opened: List[NetlinkSocket] = []
+        try:
+            self.ifindex = socket.if_nametoindex(self.iface)
+            scan_events = NetlinkSocket(NETLINK_GENERIC, backend.socket_factory(NETLINK_GENERIC))
+            opened.append(scan_events)
+            scan_events.subscribe(backend.nl80211.groups['scan'])
+            route_events = NetlinkSocket(NETLINK_ROUTE, backend.socket_factory(NETLINK_ROUTE),
+                                         groups=RTMGRP_LINK | RTMGRP_NEIGH)
+            opened.append(route_events)
+            neighbours = backend.rt.dump_neighbours()
+        except (OSError, KeyError):
+            # Fall back to polling without leaking the sockets opened so far
+            for nlsock in opened:
+                nlsock.close()
+            return
+        self.nl80211 = backend.nl80211
+        for nlsock, handler in ((scan_events, self._on_scan_event), (route_events, self._on_route_event)):
+            nlsock.sock.setblocking(False)
+            loop.add_reader(nlsock.fileno(), self._on_readable, nlsock, handler)
+            self.event_sockets.append(nlsock)
+        for ip, mac, state, ifindex in neighbours:
+            if ifindex == self.ifindex and mac and not state & (NUD_INCOMPLETE | NUD_FAILED | NUD_NOARP):
+                self.report_client(self.clients.seen(ip, mac))
+
+    def _close_event_sockets(self, loop) -> None:
+        for nlsock in self.event_sockets:
+            loop.remove_reader(nlsock.fileno())
+            nlsock.close()
+        self.event_sockets = []
+
+    def _on_readable(self, nlsock: NetlinkSocket, handler) -> None:
+        for msg_type, _, _, body in nlsock.drain():
+            METRICS.incr('netlink_events')
+            try:
+                handler(msg_type, body)
+            except (OSError, ValueError, struct.error) as e:
+                print(f"{Fore.RED}Error handling netlink event: {str(e)}")
+        sys.stdout.flush()
+
+    def _on_scan_event(self, msg_type: int, body: bytes) -> None:
+        attrs = nla_parse(body[4:])
+        if body[0] != NL80211_CMD_NEW_SCAN_RESULTS or attrs.get(NL80211_ATTR_IFINDEX) != struct.pack('=I', self.ifindex):
+            return
+        # Our own scans are diffed by _active_scan; this picks up scans run by others
+        if self.scanning or self.scan_fetch or time.monotonic() - self.scan_finished < 1.0:
+            return
+        self.scan_fetch = asyncio.get_running_loop().create_task(self._fetch_scan())
+
+    def _read_scan(self) -> List[BSSRecord]:
+        with self.wm.backend.lock:
+            dump = self.nl80211.get_scan(self.ifindex)
+        return [bss_from_nl80211(bss) for bss in dump]
+
+    async def _fetch_scan(self) -> None:
+        """Dump the BSS cache off the event loop and diff it, after a scan run by another program."""
+        try:
+            self.on_networks(await asyncio.get_running_loop().run_in_executor(None, self._read_scan))
+        except (OSError, ValueError, struct.error) as e:
+            print(f"{Fore.RED}Error handling netlink event: {str(e)}")
+        finally:
+            self.scan_fetch = None
+        sys.stdout.flush()
+
+    def _on_route_event(self, msg_type: int, body: bytes) -> None:
+        if msg_type in (RTM_NEWNEIGH, RTM_DELNEIGH):
+            entry = parse_neighbour(body)
+            if entry is None:
+                return
+            ip, mac, state, ifindex = entry
+            if ifindex != self.ifindex:
+                return
+            if msg_type == RTM_DELNEIGH or state & (NUD_INCOMPLETE | NUD_FAILED | NUD_NOARP) or not mac:
+                self.clients.gone(ip)
+            else:
+                self.report_client(self.clients.seen(ip, mac))
+        elif msg_type == RTM_NEWLINK:
+            ifindex = struct.unpack_from('=i', body, 4)[0]
+            operstate = nla_parse(body[16:]).get(IFLA_OPERSTATE)
+            if ifindex == self.ifindex and operstate:
+                state = OPERSTATES.get(operstate[0], 'UNKNOWN')
+                if self.operstate is not None and state != self.operstate and \
+                        not self.wm.emit('link_state', interface=self.iface, state=state):
+                    print(f"\n{self.label}{Fore.YELLOW}Interface {Fore.LIGHTCYAN_EX}{self.iface}{Fore.YELLOW} is now {state}")
+                self.operstate = state
+
+    def on_networks(self, networks: List[BSSRecord]) -> None:
+        """Diff a fresh scan table and adapt the active scan cadence."""
+        METRICS.incr('scans')
+        self.wm.record_scan(self.iface, networks)
+        self.wm.push('scan', interface=self.iface, networks=[network.to_dict() for network in networks])
+        with METRICS.span('phase.diff'):
+            changed = self.report_networks(networks)
+        self.interval = self.min_interval if changed else min(self.interval * 2, self.max_interval)
+
+    def report_networks(self, networks: List[BSSRecord]) -> bool:
+        """Print debounced appear/disappear and roaming events; return True if there were any."""
+        events = self.networks.update(networks)
+        if self.wm.output is not None:
+            for event, history, other in events:
+                self.wm.emit(EVENT_TYPES.get(event, event), interface=self.iface, bssid=history.bssid, ssid=history.ssid,
+                             channel=history.channel, signal=history.smoothed, other=other.bssid if other else None)
+            return bool(events)
+        appeared = [history for event, history, _ in events if event == 'appeared']
+        disappeared = [history for event, history, _ in events if event == 'disappeared']
+
+        if appeared:
+            print(f"\n{self.label}{Fore.GREEN}New networks detected:")
+            for history in appeared:
+                print(f"{Fore.LIGHTCYAN_EX}* {history.ssid or '<hidden>'} {Fore.WHITE}({history.bssid}, "
+                      f"ch {history.channel or '-'}, {history.signal_text})")
+        if disappeared:
+            print(f"\n{self.label}{Fore.YELLOW}Networks lost:")
+            for history in disappeared:
+                print(f"{Fore.LIGHTCYAN_EX}* {history.ssid or '<hidden>'} {Fore.WHITE}({history.bssid}, "
+                      f"last {history.signal_text})")
+        for event, history, other in events:
+            if event == 'roamed':
+                print(f"\n{self.label}{Fore.YELLOW}Roamed on {Fore.LIGHTCYAN_EX}{history.ssid or '<hidden>'}"
+                      f"{Fore.YELLOW}: {other.bssid if other else '?'} -> {history.bssid} ({history.signal_text})")
+            elif event == 'roam_candidate':
+                print(f"\n{self.label}{Fore.YELLOW}Stronger AP for {Fore.LIGHTCYAN_EX}{history.ssid or '<hidden>'}"
+                      f"{Fore.YELLOW}: {history.bssid} ({history.signal_text}) vs current {other.bssid} "
+                      f"({other.signal_text})")
+        return bool(events)
+
+    def report_client(self, record: Optional[ClientRecord]) -> None:
+        """Print a client that has just connected (or come back)."""
+        if record is None:
+            return
+        self.wm.push('client_connected', interface=self.iface, ip=record.ip, mac=record.mac)
+        if self.wm.emit('client_connected', interface=self.iface, ip=record.ip, mac=record.mac):
+            return
+        print(f"\n{self.label}{Fore.GREEN}New client connected:")
+        print(f"{Fore.LIGHTCYAN_EX}IP: {record.ip}")
+        print(f"{Fore.LIGHTCYAN_EX}MAC: {record.mac}")
+
+    def report_departures(self, departed: List[ClientRecord]) -> None:
+        for record in departed:
+            self.wm.push('client_disconnected', interface=self.iface, ip=record.ip, mac=record.mac,
+                         last_seen=record.last_seen)
+            if self.wm.emit('client_disconnected', interface=self.iface, ip=record.ip, mac=record.mac,
+                            last_seen=record.last_seen):
+                continue
+            last_seen = datetime.fromtimestamp(record.last_seen).strftime('%H:%M:%S')
+            print(f"\n{self.label}{Fore.YELLOW}Client disconnected:")
+            print(f"{Fore.LIGHTCYAN_EX}IP: {record.ip}")
+            print(f"{Fore.LIGHTCYAN_EX}MAC: {record.mac} (last seen {last_seen})")
+
+    def poll_clients(self) -> None:
+        """Feed the client index from /proc/net/arp when neighbour events are unavailable."""
+        arrived, departed = self.clients.update_from_arp(self.wm.read_arp_table(), self.iface)
+        METRICS.incr('clients_arrived', len(arrived))
+        METRICS.incr('clients_departed', len(departed))
+        for record in arrived:
+            self.report_client(record)
+        self.report_departures(departed)
+
+    async def _active_scan(self, loop) -> None:
+        self.scanning = True
+        try:
+            with METRICS.span('phase.scan'):
+                report = await loop.run_in_executor(None, self.scheduler.run)
+        finally:
+            self.scanning = False
+            self.scan_finished = time.monotonic()
+        if self.wm.verbose_scans and not self.wm.emit('scan', interface=self.iface, tier=report.tier,
+                                                      duration=report.duration, age=report.age,
+                                                      networks=len(report.networks)):
+            print(f"{self.label}{Fore.WHITE}{report.summary()}")
+        self.on_networks(report.networks)
+        if not self.event_sockets:
+            self.poll_clients()
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        self.stopped = asyncio.Event()
+        self._open_event_sockets(loop)
+        try:
+            while not self.stopped.is_set():
+                try:
+                    await self._active_scan(loop)
+                except Exception as e:
+                    print(f"{Fore.RED}Error scanning networks: {str(e)}")
+                try:
+                    await asyncio.wait_for(self.stopped.wait(), timeout=min(self.interval, self.clients.ttl))
+                except asyncio.TimeoutError:
+                    pass
+                self.report_departures(self.clients.expire())
+                sys.stdout.flush()
+        finally:
+            self._close_event_sockets(loop)
+            if self.scan_fetch:
+                self.scan_fetch.cancel()
+
+
+async def run_monitors(monitors: List[RealtimeMonitor]) -> None:
+    """Run monitors concurrently until SIGINT/SIGTERM."""
+    loop = asyncio.get_running_loop()
+
+    def stop():
+        for monitor in monitors:
+            monitor.stop()
+
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop)
+    try:
+        await asyncio.gather(*(monitor.run() for monitor in monitors))
+    finally:
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.remove_signal_handler(signum)
+
+
+DEFAULT_DAEMON_SOCKET = '/run/wifimage.sock'
+
+
+class ScanCache:
+    """Latest BSS table per interface; a BSS expires ttl seconds after it was last seen."""
+
+    def __init__(self, ttl: float = 120.0):
+        self.ttl = ttl
+        self.tables: Dict[str, Dict[str, BSSRecord]] = {}
+        self.scanned: Dict[str, float] = {}
+
+    def update(self, iface: str, networks: List[BSSRecord]) -> None:
+        table = self.tables.setdefault(iface, {})
+        for network in networks:
+            table[network.bssid or network.ssid or ''] = network
+        self.scanned[iface] = time.time()
+
+    def age(self, iface: str) -> float:
+        """Seconds since iface was last scanned (infinite if never)."""
+        scanned = self.scanned.get(iface)
+        return time.time() - scanned if scanned is not None else float('inf')
+
+    def get(self, iface: str) -> List[BSSRecord]:
+        table = self.tables.get(iface, {})
+        cutoff = time.time() - self.ttl
+        for key in [key for key, network in table.items() if network.last_seen < cutoff]:
+            del table[key]
+        return list(table.values())
+
+
+class ScanDaemon:
+    """Owns the scan loop and answers scan/info/security requests over a Unix socket.
+
+    The protocol is one JSON object per line in each direction, e.g.
+    {"op": "scan", "iface": "wlan0", "max_age": 10} answered by
+    {"ok": true, "age": 1.2, "networks": [...]}. Requests for the same
+    interface that arrive while a scan is running share that scan.
+    """
+
+    def __init__(self, wm: 'WifiMage', path: str = DEFAULT_DAEMON_SOCKET, ifaces: Optional[List[str]] = None,
+                 interval: float = 10.0, max_age: float = 10.0, ttl: float = 120.0, snapshot_max_age: float = 2.0):
+        self.wm = wm
+        self.path = path
+        self.ifaces = ifaces or []
+        self.interval = interval
+        self.max_age = max_age
+        self.snapshot_max_age = snapshot_max_age
+        self.cache = ScanCache(ttl)
+        # (op, iface) -> (timestamp, snapshot dict)
+        self.snapshots: Dict[tuple, tuple] = {}
+        self.inflight: Dict[tuple, asyncio.Future] = {}
+        self.schedulers: Dict[str, ScanScheduler] = {}
+        self.stopped: Optional[asyncio.Event] = None
+
+    def stop(self) -> None:
+        if self.stopped is not None:
+            self.stopped.set()
+
+    async def _coalesced(self, key: tuple, func, *args):
+        """Run func in a worker thread, sharing the result with callers asking for the same key meanwhile."""
+        future = self.inflight.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().run_in_executor(None, func, *args)
+            self.inflight[key] = future
+            future.add_done_callback(lambda _: self.inflight.pop(key, None))
+        else:
+            METRICS.incr('daemon_coalesced')
+        return await asyncio.shield(future)
+
+    async def refresh(self, iface: str) -> None:
+        scheduler = self.schedulers.get(iface)
+        if scheduler is None:
+            scheduler = self.schedulers[iface] = self.wm.scan_scheduler(iface)
+        report = await self._coalesced(('scan', iface), scheduler.run)
+        self.cache.update(iface, report.networks)
+        self.wm.record_scan(iface, report.networks)
+
+    async def networks(self, iface: str, max_age: float) -> List[BSSRecord]:
+        if self.cache.age(iface) > max_age:
+            await self.refresh(iface)
+        return self.cache.get(iface)
+
+    async def snapshot(self, op: str, iface: str, max_age: float) -> Dict:
+        cached = self.snapshots.get((op, iface))
+        if cached is None or time.time() - cached[0] > max_age:
+            snapshot = await self._coalesced((op, iface), self.wm.collect_snapshot, iface, op == 'security')
+            cached = self.snapshots[(op, iface)] = (time.time(), asdict(snapshot))
+        return cached[1]
+
+    async def answer(self, request: Dict) -> Dict:
+        op = request.get('op')
+        if op == 'ping':
+            return {'ok': True, 'interfaces': sorted(self.cache.scanned)}
+        iface = request.get('iface')
+        if op not in ('scan', 'info', 'security') or not isinstance(iface, str):
+            return {'ok': False, 'error': 'expected {"op": "scan"|"info"|"security"|"ping", "iface": NAME}'}
+        if not self.wm.check_interface_exists(iface):
+            return {'ok': False, 'error': f"Interface {iface} not found!"}
+        if op == 'scan':
+            networks = await self.networks(iface, float(request.get('max_age', self.max_age)))
+            return {'ok': True, 'age': self.cache.age(iface), 'networks': [n.to_dict() for n in networks]}
+        return {'ok': True, 'snapshot': await self.snapshot(op, iface, float(request.get('max_age', self.snapshot_max_age)))}
+
+    async def handle(self, reader: 'asyncio.StreamReader', writer: 'asyncio.StreamWriter') -> None:
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                METRICS.incr('daemon_requests')
+                try:
+                    with METRICS.span('daemon.request'):
+                        reply = await self.answer(json.loads(line))
+                except (ValueError, TypeError, AttributeError):
+                    reply = {'ok': False, 'error': 'malformed request'}
+                except Exception as e:
+                    reply = {'ok': False, 'error': str(e)}
+                writer.write(json.dumps(reply, separators=(',', ':')).encode() + b'\n')
+                await writer.drain()
+        except (ConnectionError, asyncio.LimitOverrunError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _scan_loop(self, iface: str) -> None:
+        while not self.stopped.is_set():
+            if self.cache.age(iface) >= self.interval:
+                try:
+                    await self.refresh(iface)
+                except Exception as e:
+                    print(f"{Fore.RED}Error scanning networks on {iface}: {str(e)}")
+            try:
+                await asyncio.wait_for(self.stopped.wait(),
+                                       timeout=max(0.1, self.interval - self.cache.age(iface)))
+            except asyncio.TimeoutError:
+                pass
+
+    def _remove_stale_socket(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.path)
+        except OSError:
+            os.unlink(self.path)
+            return
+        finally:
+            probe.close()
+        raise OSError(errno.EADDRINUSE, f"a daemon is already listening on {self.path}")
+
+    async def serve(self) -> None:
+        """Serve until SIGINT/SIGTERM, scanning the configured interfaces in the background."""
+        loop = asyncio.get_running_loop()
+        self.stopped = asyncio.Event()
+        self._remove_stale_socket()
+        server = await asyncio.start_unix_server(self.handle, path=self.path)
+        os.chmod(self.path, 0o660)
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, self.stop)
+        print(f"{Fore.GREEN}Serving scans on {Fore.LIGHTCYAN_EX}{self.path}{Fore.GREEN} "
+              f"for {Fore.LIGHTCYAN_EX}{', '.join(self.ifaces) or 'on-demand interfaces'}")
+        scanners = [asyncio.ensure_future(self._scan_loop(iface)) for iface in self.ifaces]
+        try:
+            await self.stopped.wait()
+        finally:
+            for task in scanners:
+                task.cancel()
+            server.close()
+            await server.wait_closed()
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                loop.remove_signal_handler(signum)
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+
+class DaemonClient:
+    """Client side of the ScanDaemon protocol; raises OSError when no daemon answers."""
+
+    def __init__(self, path: str = DEFAULT_DAEMON_SOCKET, timeout: float = 30.0):
+        self.path = path
+        self.timeout = timeout
+
+    def request(self, op: str, iface: Optional[str] = None, **params) -> Dict:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.path)
+            sock.sendall(json.dumps(dict(params, op=op, iface=iface)).encode() + b'\n')
+            with sock.makefile('rb') as f:
+                line = f.readline()
+        finally:
+            sock.close()
+        if not line:
+            raise OSError(errno.ECONNRESET, 'daemon closed the connection')
+        return json.loads(line)
+
+
+DEFAULT_COLLECTOR_PORT = 7531
+# Batches not yet accepted by the collector, one compressed frame per file, in a private per-user directory
+SPOOL_DIR = os.environ.get('WIFIMAGE_SPOOL') or (
+    '/var/spool/wifimage' if os.geteuid() == 0 else
+    os.path.join(os.environ.get('XDG_STATE_HOME') or os.path.expanduser('~/.local/state'), 'wifimage', 'spool'))
+MAX_FRAME = 16 << 20
+MAX_BATCH = 64 << 20
+
+
+def parse_address(text: str, default_port: int = DEFAULT_COLLECTOR_PORT) -> tuple:
+    """Split HOST[:PORT] (IPv6 hosts in brackets) into (host, port)."""
+    host, sep, port = text.rpartition(':')
+    if not sep or host.count(':') and not host.endswith(']'):
+        host, port = text, ''
+    return host.strip('[]') or '0.0.0.0', int(port) if port else default_port
+
+
+def encode_batch(batch: Dict) -> bytes:
+    """A batch as sent on the wire: 4-byte big-endian length, then zlib-compressed JSON."""
+    payload = zlib.compress(json.dumps(batch, separators=(',', ':')).encode(), 6)
+    return struct.pack('>I', len(payload)) + payload
+
+
+def decode_batch(payload: bytes) -> Dict:
+    decompressor = zlib.decompressobj()
+    data = decompressor.decompress(payload, MAX_BATCH)
+    if decompressor.unconsumed_tail:
+        raise ValueError('batch too large')
+    return json.loads(data)
+
+
+class ScanPusher:
+    """Streams scan and client events to a collector over TCP.
+
+    Events are queued and a sender thread packs them into batches of up to
+    batch_size events (or whatever arrived within batch_interval), each
+    compressed and numbered and sent only after the previous one was
+    acknowledged. A full queue blocks the producer for up to block seconds
+    and then drops the event, so a slow collector slows sensors down instead
+    of growing memory. While the collector is unreachable batches go to the
+    spool directory (oldest deleted beyond spool_max bytes) and are sent
+    first, in order, once it answers again.
+
+    Each pusher spools into its own subdirectory of spool, named after its
+    session and locked while it runs, so several processes can share one
+    spool. Subdirectories whose lock is free were left behind by a pusher
+    that exited before delivering them; they are claimed and sent too.
+    """
+
+    def __init__(self, address: tuple, node: str, spool: str = SPOOL_DIR, batch_size: int = 500,
+                 batch_interval: float = 1.0, queue_size: int = 10000, spool_max: int = 64 << 20,
+                 timeout: float = 10.0, block: float = 1.0):
+        self.address = address
+        self.node = node
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.spool_max = spool_max
+        self.timeout = timeout
+        self.block = block
+        # Sequence numbers restart with each session; the collector drops batches it has already acknowledged
+        self.session = os.urandom(4).hex()
+        self.seq = 0
+        self.queue: 'queue.Queue' = queue.Queue(queue_size)
+        self.sock: Optional[socket.socket] = None
+        self.retry_at = 0.0
+        self.backoff = 1.0
+        self.error: Optional[str] = None
+        self.spool_root = private_dir(spool)
+        self.spool = os.path.join(spool, self.session)
+        # Lock the directory before it gets its visible name, so nobody claims it meanwhile
+        hidden = os.path.join(spool, f".{self.session}")
+        os.mkdir(hidden, 0o700)
+        self.lock_file = open(os.path.join(hidden, '.lock'), 'w')
+        fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        os.rename(hidden, self.spool)
+        # Claimed directories of exited pushers -> their lock file, looked for every orphan_interval seconds
+        self.claimed: Dict[str, io.TextIOWrapper] = {}
+        self.orphan_interval = 60.0
+        self.orphans_checked: Optional[float] = None
+        self.thread = threading.Thread(target=self._run, name='wifimage-push', daemon=True)
+        self.thread.start()
+
+    def push(self, kind: str, **data) -> None:
+        try:
+            self.queue.put({'type': kind, 'time': time.time(), **data}, timeout=self.block)
+            METRICS.incr('push_events')
+        except queue.Full:
+            METRICS.incr('push_dropped')
+
+    def close(self, timeout: float = 15.0) -> None:
+        """Send (or spool) everything queued and stop the sender."""
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self.thread.join(timeout)
+
+    def _gather(self) -> tuple:
+        """Next batch of events and whether the pusher was closed."""
+        events = []
+        deadline = time.monotonic() + self.batch_interval
+        while len(events) < self.batch_size:
+            try:
+                event = self.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if event is None:
+                return events, True
+            events.append(event)
+        return events, False
+
+    def _run(self) -> None:
+        closed = False
+        while not closed:
+            events, closed = self._gather()
+            spooled = self._spooled()
+            if spooled and self._connect(force=closed):
+                spooled = self._drain(spooled)
+            if not events:
+                continue
+            self.seq += 1
+            frame = encode_batch({'node': self.node, 'session': self.session, 'seq': self.seq, 'events': events})
+            METRICS.incr('push_batches')
+            if spooled or not self._connect(force=closed) or not self._send(frame, self.seq):
+                self._spool(frame)
+        self._disconnect()
+        for directory, lock_file in list(self.claimed.items()) + [(self.spool, self.lock_file)]:
+            self._release(directory, lock_file)
+        self.claimed = {}
+
+    def _connect(self, force: bool = False) -> bool:
+        if self.sock is not None:
+            return True
+        if not force and time.monotonic() < self.retry_at:
+            return False
+        try:
+            self.sock = socket.create_connection(self.address, timeout=self.timeout)
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except OSError as e:
+            self._failed(e)
+            return False
+        self.backoff = 1.0
+        if self.error is not None:
+            print(f"{Fore.GREEN}Collector {self.address[0]}:{self.address[1]} is reachable again")
+            self.error = None
+        return True
+
+    def _failed(self, e: OSError) -> None:
+        self._disconnect()
+        self.retry_at = time.monotonic() + self.backoff
+        self.backoff = min(self.backoff * 2, 60.0)
+        if self.error is None:
+            print(f"{Fore.RED}Collector {self.address[0]}:{self.address[1]} unreachable ({str(e)}), "
+                  f"spooling to {self.spool}")
+        self.error = str(e)
+
+    def _disconnect(self) -> None:
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def _send(self, frame: bytes, seq: int) -> bool:
+        """Send one frame and wait for the collector to acknowledge it."""
+        try:
+            with METRICS.span('push.send'):
+                self.sock.sendall(frame)
+                ack = b''
+                while len(ack) < 8:
+                    chunk = self.sock.recv(8 - len(ack))
+                    if not chunk:
+                        raise OSError(errno.ECONNRESET, 'collector closed the connection')
+                    ack += chunk
+            if struct.unpack('>Q', ack)[0] != seq:
+                raise OSError(errno.EPROTO, 'unexpected acknowledgement')
+        except OSError as e:
+            self._failed(e)
+            return False
+        METRICS.incr('push_bytes', len(frame))
+        return True
+
+    def _frames(self, directory: str) -> List[str]:
+        try:
+            return [os.path.join(directory, name) for name in sorted(os.listdir(directory)) if name.endswith('.batch')]
+        except OSError:
+            return []
+
+    def _claim(self, directory: str) -> bool:
+        """Take over the spool directory of a pusher that has exited."""
+        if directory in self.claimed:
+            return True
+        try:
+            lock_file = open(os.path.join(directory, '.lock'), 'a')
+        except OSError:
+            return False
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self.claimed[directory] = lock_file
+        return True
+
+    def _release(self, directory: str, lock_file) -> None:
+        """Remove a spool directory without frames left and drop its lock."""
+        if not self._frames(directory):
+            for name in os.listdir(directory) if os.path.isdir(directory) else ():
+                try:
+                    os.remove(os.path.join(directory, name))
+                except OSError:
+                    pass
+            try:
+                os.rmdir(directory)
+            except OSError:
+                pass
+        lock_file.close()
+
+    def _spooled(self) -> List[str]:
+        """Spooled frames in send order: those left by exited pushers, then ours."""
+        frames = []
+        names = []
+        now = time.monotonic()
+        if self.orphans_checked is None or now - self.orphans_checked >= self.orphan_interval:
+            self.orphans_checked = now
+            try:
+                names = sorted(os.listdir(self.spool_root))
+            except OSError:
+                pass
+        for name in names:
+            directory = os.path.join(self.spool_root, name)
+            if name.startswith('.') or directory == self.spool or not os.path.isdir(directory):
+                continue
+            self._claim(directory)
+        for directory in list(self.claimed):
+            left = self._frames(directory)
+            if left:
+                frames.extend(left)
+            else:
+                self._release(directory, self.claimed.pop(directory))
+        return frames + self._frames(self.spool)
+
+    def _spool(self, frame: bytes) -> None:
+        """Keep a frame that could not be sent, in send order, within spool_max bytes."""
+        path = os.path.join(self.spool, f"{self.seq:010d}.batch")
+        try:
+            with open(path + '.tmp', 'wb') as f:
+                f.write(frame)
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            METRICS.incr('push_dropped_batches')
+            print(f"{Fore.RED}Error spooling batch: {str(e)}")
+            return
+        METRICS.incr('push_spooled')
+        sizes = []
+        for frame_path in self._spooled():
+            try:
+                st = os.stat(frame_path)
+            except OSError:
+                continue
+            sizes.append((st.st_mtime, frame_path, st.st_size))
+        total = sum(size for _, _, size in sizes)
+        for _, frame_path, size in sorted(sizes):
+            if total <= self.spool_max:
+                break
+            try:
+                os.remove(frame_path)
+                METRICS.incr('push_dropped_batches')
+            except OSError:
+                pass
+            total -= size
+
+    def _drain(self, paths: List[str]) -> List[str]:
+        """Send spooled frames oldest first; return the ones still waiting."""
+        for index, path in enumerate(paths):
+            try:
+                with open(path, 'rb') as f:
+                    frame = f.read()
+                seq = int(os.path.basename(path)[:-len('.batch')])
+            except (OSError, ValueError):
+                continue
+            if not self._send(frame, seq):
+                return paths[index:]
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        return []
+
+class CollectorView:
+    """One deduplicated view of every BSS reported by every node.
+
+    Each BSSID keeps its latest SSID, channel and security, when it was
+    first and last seen anywhere and the latest signal per node, so the
+    strongest node locates it. Batches carry (node, session, seq) and a
+    batch that was already merged, e.g. resent from a spool after a lost
+    acknowledgement, is dropped. Sessions idle for longer than ttl are
+    forgotten along with the BSSes nobody has seen for that long.
+    """
+
+    def __init__(self, ttl: float = 3600.0):
+        self.ttl = ttl
+        self.bss: Dict[str, Dict] = {}
+        self.clients: Dict[str, Dict] = {}
+        self.nodes: Dict[str, Dict] = {}
+        # (node, session) -> (last merged seq, when), least recently active first
+        self.merged: 'OrderedDict[tuple, tuple]' = OrderedDict()
+
+    def accept(self, batch: Dict, peer: str = '') -> bool:
+        """Merge a batch; False if it was a duplicate."""
+        node = str(batch['node'])
+        key = (node, batch.get('session'))
+        seq = int(batch['seq'])
+        if key in self.merged and seq <= self.merged[key][0]:
+            METRICS.incr('collector_duplicates')
+            return False
+        self.merged[key] = (seq, time.time())
+        self.merged.move_to_end(key)
+        info = self.nodes.setdefault(node, {'batches': 0, 'events': 0, 'scans': 0})
+        info.update(address=peer, last_seen=time.time())
+        info['batches'] += 1
+        info['events'] += len(batch['events'])
+        for event in batch['events']:
+            kind = event.get('type')
+            if kind == 'scan':
+                info['scans'] += 1
+                self.merge_scan(node, event)
+            elif kind in ('client_connected', 'client_disconnected'):
+                self.merge_client(node, event)
+        return True
+
+    def merge_scan(self, node: str, event: Dict) -> List[BSSRecord]:
+        networks = [BSSRecord.from_dict(network) for network in event.get('networks', ())]
+        for n in networks:
+            if not n.bssid:
+                continue
+            bssid = n.bssid.upper()
+            entry = self.bss.get(bssid)
+            if entry is None:
+                entry = self.bss[bssid] = {'bssid': bssid, 'first_seen': n.last_seen, 'last_seen': 0.0,
+                                           'observations': 0, 'nodes': {}}
+            entry['observations'] += 1
+            if n.last_seen >= entry['last_seen']:
+                level, _, pmf, issues = classify_security(n.encrypted, '/'.join(n.wpa), ' '.join(n.pairwise_ciphers),
+                                                          ' '.join(n.akm_suites), n.mfp)
+                entry.update(ssid=n.ssid, channel=n.channel, frequency=n.frequency, security=level, pmf=pmf,
+                             issues=list(issues), last_seen=n.last_seen)
+            entry['first_seen'] = min(entry['first_seen'], n.last_seen)
+            seen = entry['nodes'].get(node)
+            if seen is None or n.last_seen >= seen['last_seen']:
+                entry['nodes'][node] = {'signal': n.signal, 'interface': event.get('interface'),
+                                        'last_seen': n.last_seen}
+        return networks
+
+    def merge_client(self, node: str, event: Dict) -> None:
+        mac = event.get('mac')
+        if mac:
+            self.clients[mac] = {'mac': mac, 'ip': event.get('ip'), 'node': node, 'interface': event.get('interface'),
+                                 'connected': event['type'] == 'client_connected', 'last_seen': event.get('time')}
+
+    def expire(self) -> None:
+        cutoff = time.time() - self.ttl
+        for bssid in [bssid for bssid, entry in self.bss.items() if entry['last_seen'] < cutoff]:
+            del self.bss[bssid]
+        while self.merged and next(iter(self.merged.values()))[1] < cutoff:
+            self.merged.popitem(last=False)
+
+    def strongest(self, entry: Dict) -> Optional[str]:
+        heard = [(seen['signal'], node) for node, seen in entry['nodes'].items() if seen['signal'] is not None]
+        return max(heard)[1] if heard else None
+
+    def to_dict(self) -> Dict:
+        return {'time': time.time(), 'nodes': self.nodes,
+                'networks': [dict(entry, strongest_node=self.strongest(entry))
+                             for entry in sorted(self.bss.values(), key=lambda entry: entry['bssid'])],
+                'clients': sorted(self.clients.values(), key=lambda client: client['mac'])}
+
+
+class Collector:
+    """TCP server merging batches from ScanPusher sensors into a CollectorView.
+
+    Every frame is acknowledged with its 8-byte sequence number once merged,
+    which is what paces each sensor. The view is written to output every
+    interval seconds, and with a store every scan is also recorded, with the
+    interface named NODE/IFACE, for `wifimage.py query` and `audit`.
+    """
+
+    def __init__(self, address: tuple, view: CollectorView, output: Optional[str] = None,
+                 interval: float = 10.0, store: Optional[ScanStore] = None):
+        self.address = address
+        self.view = view
+        self.output = output
+        self.interval = interval
+        self.store = store
+        self.stopped: Optional[asyncio.Event] = None
+        self.loop = None
+        # Set once listening; address then holds the bound port (useful with port 0)
+        self.listening = threading.Event()
+
+    def stop(self) -> None:
+        if self.stopped is not None:
+            self.loop.call_soon_threadsafe(self.stopped.set)
+
+    async def handle(self, reader: 'asyncio.StreamReader', writer: 'asyncio.StreamWriter') -> None:
+        peer = writer.get_extra_info('peername')
+        peer = f"{peer[0]}:{peer[1]}" if peer else ''
+        try:
+            while True:
+                header = await reader.readexactly(4)
+                length = struct.unpack('>I', header)[0]
+                if length > MAX_FRAME:
+                    raise ValueError(f'frame of {length} bytes')
+                payload = await reader.readexactly(length)
+                METRICS.incr('collector_bytes', 4 + length)
+                with METRICS.span('collector.merge'):
+                    batch = decode_batch(payload)
+                    if self.view.accept(batch, peer) and self.store is not None:
+                        self.record(batch)
+                METRICS.incr('collector_batches')
+                writer.write(struct.pack('>Q', int(batch['seq'])))
+                await writer.drain()
+        except asyncio.IncompleteReadError:
+            pass
+        except (ConnectionError, ValueError, KeyError, TypeError, zlib.error) as e:
+            print(f"{Fore.RED}Dropping connection from {peer}: {str(e)}")
+        finally:
+            writer.close()
+
+    def record(self, batch: Dict) -> None:
+        for event in batch['events']:
+            if event.get('type') == 'scan':
+                try:
+                    self.store.append([BSSRecord.from_dict(n) for n in event.get('networks', ())],
+                                      f"{batch['node']}/{event.get('interface')}", event.get('time'))
+                except (sqlite3.Error, OSError) as e:
+                    print(f"{Fore.RED}Error recording scan: {str(e)}")
+
+    def write(self) -> None:
+        """Atomically replace the output file with the current view."""
+        self.view.expire()
+        if not self.output:
+            return
+        try:
+            with open(self.output + '.tmp', 'w') as f:
+                json.dump(self.view.to_dict(), f, indent=2)
+            os.replace(self.output + '.tmp', self.output)
+        except OSError as e:
+            print(f"{Fore.RED}Error writing {self.output}: {str(e)}")
+
+    async def serve(self) -> None:
+        """Serve until stop() is called, from any thread."""
+        self.loop = asyncio.get_running_loop()
+        self.stopped = asyncio.Event()
+        server = await asyncio.start_server(self.handle, self.address[0], self.address[1], backlog=1024)
+        self.address = server.sockets[0].getsockname()[:2]
+        self.listening.set()
+        print(f"{Fore.GREEN}Collecting scans on {Fore.LIGHTCYAN_EX}{self.address[0]}:{self.address[1]}")
+        sys.stdout.flush()
+        try:
+            while not self.stopped.is_set():
+                try:
+                    await asyncio.wait_for(self.stopped.wait(), timeout=self.interval)
+                except asyncio.TimeoutError:
+                    pass
+                self.write()
+                print(f"{Fore.WHITE}{datetime.now().strftime('%H:%M:%S')} {len(self.view.nodes)} nodes, "
+                      f"{len(self.view.bss)} BSSIDs, {len(self.view.clients)} clients")
+                sys.stdout.flush()
+        finally:
+            server.close()
+            await server.wait_closed()
 
-# Initialize colorama
-init(autoreset=True)
 
 class WifiMage:
     def __init__(self):
-        self.original_interface: Optional[str] = None
-        self.current_interface: Optional[str] = None
-        self.scan_results: List[Dict] = []
-        self.interface_info: Dict = {}
+        # Interfaces whose mode was changed, current name -> original name
+        self.mode_changes: Dict[str, str] = {}
+        # Monitor interfaces added next to a managed one, name -> parent
+        self.vifs: Dict[str, str] = {}
+        # Names changed or created by this run, undone by restore_original
+        self.touched: Set[str] = set()
+        self.state_file: Optional[str] = None
+        self.add_vif: bool = False
+        self.managed_ssids: Dict[str, Dict] = {}
+        self.rssi_history: int = 64
+        # --json/--ndjson sink; None for human output
+        self.output: Optional[JsonOutput] = None
+        self.show_banner: bool = True
+        self.appear_after: int = 2
+        self.disappear_after: int = 3
+        self.scan_results: Dict[str, List[BSSRecord]] = {}
+        self.interface_info: Dict[str, Dict] = {}
         self.monitoring: bool = False
-        self.known_networks: Set[str] = set()
-        self.connected_clients: Dict[str, List[str]] = {}
         self.running: bool = True
+        self.max_workers: int = 8
+        self.lock = threading.RLock()
+        self._banner_shown = False
+        self.backend_name: str = 'auto'
+        self.scan_interval: float = 2.0
+        self.max_scan_interval: float = 60.0
+        self.client_ttl: float = 300.0
+        self.store: Optional[ScanStore] = None
+        self.survey_samples: int = 5
+        self.survey_interval: float = 0.2
+        self._backend = None
+        self.daemon: Optional[DaemonClient] = None
+        self.scan_tier: str = 'auto'
+        self.scan_freqs: Optional[List[int]] = None
+        self.cache_max_age: float = 10.0
+        self.full_scan_interval: float = 60.0
+        self.max_full_scan_interval: float = 600.0
+        self.verbose_scans: bool = False
+        self.pusher: Optional[ScanPusher] = None
 
-    def run_command(self, command: str) -> bool:
-        """Execute a system command and return True if successful."""
+    @property
+    def backend(self):
+        """Interface configuration backend, created on first use."""
+        with self.lock:
+            if self._backend is None:
+                self._backend = make_backend(self, self.backend_name)
+        return self._backend
+
+    def execute(self, command) -> CommandResult:
+        """Run a command through the current runner, counting and timing it."""
+        METRICS.incr('commands')
         try:
-            subprocess.run(command, shell=True, check=True, capture_output=True)
-            return True
-        except subprocess.CalledProcessError as e:
-            print(f"{Fore.RED}Error executing command: {command}")
-            print(f"{Fore.RED}Error: {e.stderr.decode()}")
+            with METRICS.span(command_name(command)):
+                result = RUNNER.run(command)
+        except OSError as e:
+            result = CommandResult(127, '', str(e))
+        if result.returncode != 0:
+            METRICS.incr('command_failures')
+        return result
+
+    def run_command(self, command) -> bool:
+        """Execute a command (an argv list, or a shell line) and return True if successful."""
+        result = self.execute(command)
+        if result.returncode != 0:
+            print(f"{Fore.RED}Error executing command: {command_key(command)}")
+            print(f"{Fore.RED}Error: {result.stderr}")
             return False
+        return True
 
     def get_command_output(self, command: str) -> str:
         """Execute a command and return its output."""
-        try:
-            result = subprocess.run(command, shell=True, check=True, capture_output=True, text=True)
-            return result.stdout
-        except subprocess.CalledProcessError as e:
+        result = self.execute(command)
+        if result.returncode != 0:
             print(f"{Fore.RED}Error executing command: {command}")
-            print(f"{Fore.RED}Error: {e.stderr.decode()}")
+            print(f"{Fore.RED}Error: {result.stderr}")
             return ""
+        return result.stdout
+
+    def read_command(self, argv: List[str]) -> str:
+        """Run a probing command without a shell and return its output, or '' on failure."""
+        result = self.execute(argv)
+        return result.stdout if result.returncode == 0 else ""
+
+    def emit(self, kind: str, **data) -> bool:
+        """Send a record to the --json/--ndjson output; False when output is for humans."""
+        if self.output is None:
+            return False
+        self.output.emit(kind, **data)
+        return True
+
+    def push(self, kind: str, **data) -> None:
+        """Queue an event for the --push collector, if there is one."""
+        if self.pusher is not None:
+            self.pusher.push(kind, **data)
 
     def banner(self) -> None:
-        """Display the program banner."""
+        """Display the program banner (once per run, on terminals)."""
+        with self.lock:
+            if self._banner_shown or not self.show_banner or self.output is not None:
+                return
+            self._banner_shown = True
         print(f'''
             {Fore.LIGHTGREEN_EX},   {Fore.LIGHTYELLOW_EX} _
            {Fore.LIGHTGREEN_EX}/|   {Fore.LIGHTYELLOW_EX}| |
@@ -69,8 +3652,46 @@ class WifiMage:
 
     def check_interface_exists(self, iface: str) -> bool:
         """Check if the interface exists in the system."""
-        result = subprocess.run(f"ip link show {iface}", shell=True, capture_output=True)
-        return result.returncode == 0
+        return valid_ifname(iface) and read_sysfs(iface, 'ifindex') is not None
+
+    def from_daemon(self, op: str, iface: str) -> Optional[Dict]:
+        """Answer from a running scan daemon, or None to do the work locally."""
+        if self.daemon is None:
+            return None
+        try:
+            reply = self.daemon.request(op, iface)
+        except (OSError, ValueError):
+            self.daemon = None
+            return None
+        return reply if reply.get('ok') else None
+
+    def collect_snapshot(self, iface: str, security: bool = False) -> InterfaceSnapshot:
+        """Collect interface state from sysfs, /proc and at most two `iw` calls.
+
+        With security=True a single `iwconfig` call is added for the
+        encryption and power management fields, which `iw` does not expose.
+        """
+        reply = self.from_daemon('security' if security else 'info', iface)
+        if reply is not None:
+            return InterfaceSnapshot(**reply['snapshot'])
+        snapshot = InterfaceSnapshot(name=iface)
+        operstate = read_sysfs(iface, 'operstate')
+        snapshot.status = operstate.upper() if operstate else None
+        snapshot.mac = read_sysfs(iface, 'address')
+        snapshot.phy = read_sysfs(iface, 'phy80211/name')
+
+        snapshot.update(parse_proc_wireless(RUNNER.read_file(PROC_WIRELESS) or '', iface))
+
+        iw_info = self.read_command(['iw', 'dev', iface, 'info'])
+        if iw_info:
+            snapshot.update(parse_iw_link(self.read_command(['iw', 'dev', iface, 'link'])))
+            snapshot.update(parse_iw_info(iw_info))
+        if security or not iw_info:
+            snapshot.update(parse_iwconfig(self.read_command(['iwconfig', iface])))
+
+        if snapshot.channel is None and snapshot.frequency:
+            snapshot.channel = freq_to_channel(snapshot.frequency)
+        return snapshot
 
     def get_interface_info(self, iface: str) -> None:
         """Get detailed information about the interface."""
@@ -78,27 +3699,59 @@ class WifiMage:
             print(f"{Fore.RED}Interface {iface} not found!")
             return
 
-        self.interface_info = {
+        snapshot = self.collect_snapshot(iface)
+        self.interface_info[iface] = {
             'name': iface,
-            'status': self.get_command_output(f"ip link show {iface} | grep -o 'state [A-Z]*' | cut -d' ' -f2"),
-            'mac': self.get_command_output(f"ip link show {iface} | grep -o 'ether [0-9a-f:]*' | cut -d' ' -f2"),
-            'mode': self.get_command_output(f"iwconfig {iface} 2>/dev/null | grep -o 'Mode:[A-Z]*' | cut -d':' -f2"),
-            'channel': self.get_command_output(f"iwconfig {iface} 2>/dev/null | grep -o 'Channel [0-9]*' | cut -d' ' -f2"),
-            'frequency': self.get_command_output(f"iwconfig {iface} 2>/dev/null | grep -o 'Frequency=[0-9.]* GHz' | cut -d'=' -f2"),
-            'signal': self.get_command_output(f"iwconfig {iface} 2>/dev/null | grep -o 'Signal level=[-0-9]* dBm' | cut -d'=' -f2")
+            'status': snapshot.status,
+            'mac': snapshot.mac,
+            'mode': snapshot.mode,
+            'channel': snapshot.channel,
+            'frequency': snapshot.frequency_text,
+            'signal': snapshot.signal_text
         }
 
     def show_interface_info(self, iface: str) -> None:
         """Display detailed information about the interface."""
+        if self.output is not None:
+            if self.check_interface_exists(iface):
+                self.emit('interface_info', **asdict(self.collect_snapshot(iface)))
+            else:
+                print(f"{Fore.RED}Interface {iface} not found!")
+            return
         self.get_interface_info(iface)
+        info = self.interface_info.get(iface, {})
         self.banner()
         print(f"{Fore.YELLOW}Interface Information for {Fore.LIGHTCYAN_EX}{iface}{Fore.YELLOW}:")
-        print(f"{Fore.GREEN}Status: {Fore.WHITE}{self.interface_info.get('status', 'N/A')}")
-        print(f"{Fore.GREEN}MAC Address: {Fore.WHITE}{self.interface_info.get('mac', 'N/A')}")
-        print(f"{Fore.GREEN}Mode: {Fore.WHITE}{self.interface_info.get('mode', 'N/A')}")
-        print(f"{Fore.GREEN}Channel: {Fore.WHITE}{self.interface_info.get('channel', 'N/A')}")
-        print(f"{Fore.GREEN}Frequency: {Fore.WHITE}{self.interface_info.get('frequency', 'N/A')}")
-        print(f"{Fore.GREEN}Signal Level: {Fore.WHITE}{self.interface_info.get('signal', 'N/A')}")
+        print(f"{Fore.GREEN}Status: {Fore.WHITE}{info.get('status') or 'N/A'}")
+        print(f"{Fore.GREEN}MAC Address: {Fore.WHITE}{info.get('mac') or 'N/A'}")
+        print(f"{Fore.GREEN}Mode: {Fore.WHITE}{info.get('mode') or 'N/A'}")
+        print(f"{Fore.GREEN}Channel: {Fore.WHITE}{info.get('channel') or 'N/A'}")
+        print(f"{Fore.GREEN}Frequency: {Fore.WHITE}{info.get('frequency') or 'N/A'}")
+        print(f"{Fore.GREEN}Signal Level: {Fore.WHITE}{info.get('signal') or 'N/A'}")
+
+    def scan(self, iface: str, freqs: Optional[List[int]] = None) -> Iterator[BSSRecord]:
+        """Scan through the backend, falling back to streaming `iwlist scan` output.
+
+        With freqs (MHz) only those frequencies are scanned. Records are
+        yielded as soon as each cell has been parsed.
+        """
+        networks = self.backend.scan(iface, freqs)
+        if networks is not None:
+            yield from networks
+            return
+        yield from parse_scan_lines(stream_command(['sudo', 'iwlist', iface, 'scan']))
+
+    def scan_table(self, iface: str) -> List[BSSRecord]:
+        """Run a complete scan and return the table, timing it as the scan phase."""
+        with METRICS.span('phase.scan'):
+            return list(self.scan(iface))
+
+    def bss_tracker(self) -> BSSTracker:
+        return BSSTracker(self.rssi_history, self.appear_after, self.disappear_after)
+
+    def scan_scheduler(self, iface: str) -> ScanScheduler:
+        return ScanScheduler(self, iface, self.cache_max_age, self.full_scan_interval,
+                             self.max_full_scan_interval, self.scan_freqs, self.scan_tier)
 
     def scan_networks(self, iface: str) -> None:
         """Scan for available wireless networks."""
@@ -107,36 +3760,52 @@ class WifiMage:
             return
 
         print(f"{Fore.YELLOW}Scanning for networks... This may take a few seconds.")
-        scan_output = self.get_command_output(f"sudo iwlist {iface} scan 2>/dev/null")
-        
-        networks = []
-        current_network = {}
-        
-        for line in scan_output.split('\n'):
-            if 'Cell' in line:
-                if current_network:
-                    networks.append(current_network)
-                current_network = {}
-            elif 'ESSID' in line:
-                current_network['ssid'] = line.split('"')[1]
-            elif 'Channel' in line:
-                current_network['channel'] = line.split(':')[1].strip()
-            elif 'Quality' in line:
-                current_network['signal'] = line.split('=')[1].split()[0]
-            elif 'Encryption key' in line:
-                current_network['encryption'] = 'Yes' if 'on' in line else 'No'
-
-        if current_network:
-            networks.append(current_network)
-
-        self.scan_results = networks
         self.banner()
-        print(f"{Fore.YELLOW}Found {Fore.LIGHTCYAN_EX}{len(networks)}{Fore.YELLOW} networks:")
-        for network in networks:
-            print(f"\n{Fore.GREEN}SSID: {Fore.WHITE}{network.get('ssid', 'N/A')}")
-            print(f"{Fore.GREEN}Channel: {Fore.WHITE}{network.get('channel', 'N/A')}")
-            print(f"{Fore.GREEN}Signal: {Fore.WHITE}{network.get('signal', 'N/A')}")
-            print(f"{Fore.GREEN}Encryption: {Fore.WHITE}{network.get('encryption', 'N/A')}")
+        sys.stdout.flush()
+        networks = []
+        start = time.perf_counter()
+
+        def show(network: BSSRecord) -> None:
+            networks.append(network)
+            if self.emit('network', interface=iface, **network.to_dict()):
+                return
+            print(f"\n{Fore.GREEN}SSID: {Fore.WHITE}{network.ssid or '<hidden>'}")
+            print(f"{Fore.GREEN}BSSID: {Fore.WHITE}{network.bssid or 'N/A'}")
+            print(f"{Fore.GREEN}Channel: {Fore.WHITE}{network.channel or 'N/A'}")
+            print(f"{Fore.GREEN}Signal: {Fore.WHITE}{f'{network.signal} dBm' if network.signal is not None else network.quality or 'N/A'}")
+            print(f"{Fore.GREEN}Encryption: {Fore.WHITE}{network.encryption}")
+
+        reply = self.from_daemon('scan', iface)
+        if reply is not None:
+            for network in reply['networks']:
+                show(BSSRecord.from_dict(network))
+        else:
+            report = self.scan_scheduler(iface).run(show)
+        METRICS.observe('phase.scan', time.perf_counter() - start)
+        METRICS.incr('scans')
+        self.scan_results[iface] = networks
+        if reply is None:
+            self.record_scan(iface, networks)
+        self.push('scan', interface=iface, networks=[network.to_dict() for network in networks])
+        if self.output is not None:
+            self.emit('scan', interface=iface, networks=len(networks),
+                      **({'tier': 'daemon', 'age': reply['age']} if reply is not None else
+                         {'tier': report.tier, 'duration': report.duration, 'age': report.age}))
+            return
+        if reply is None:
+            print(f"\n{Fore.YELLOW}{report.summary()}")
+        else:
+            print(f"\n{Fore.YELLOW}Served by the scan daemon, scanned {reply['age']:.1f}s ago")
+        print(f"\n{Fore.YELLOW}Found {Fore.LIGHTCYAN_EX}{len(networks)}{Fore.YELLOW} networks")
+
+    def record_scan(self, iface: str, networks: List[BSSRecord]) -> None:
+        """Append a scan to the history store when --record is active."""
+        if self.store is None:
+            return
+        try:
+            self.store.append(networks, iface)
+        except (sqlite3.Error, OSError) as e:
+            print(f"{Fore.RED}Error recording scan: {str(e)}")
 
     def save_scan_results(self, filename: str = None) -> None:
         """Save scan results to a JSON file."""
@@ -150,52 +3819,153 @@ class WifiMage:
 
         try:
             with open(filename, 'w') as f:
-                json.dump(self.scan_results, f, indent=4)
+                json.dump([dict(network.to_dict(), interface=iface)
+                           for iface, networks in self.scan_results.items() for network in networks], f, indent=4)
             print(f"{Fore.GREEN}Scan results saved to {Fore.LIGHTCYAN_EX}{filename}")
         except Exception as e:
             print(f"{Fore.RED}Error saving scan results: {str(e)}")
 
+    def load_state(self, path: str = STATE_FILE) -> None:
+        """Load interfaces changed by earlier runs, dropping ones that no longer exist."""
+        self.state_file = path
+        try:
+            with os.fdopen(os.open(path, os.O_RDONLY | os.O_NOFOLLOW)) as f:
+                st = os.fstat(f.fileno())
+                if st.st_uid != os.geteuid() or st.st_mode & 0o022:
+                    print(f"{Fore.RED}Ignoring interface state {path}: not owned by this user or writable by others")
+                    return
+                state = json.load(f)
+            renamed = dict(state.get('renamed', {}))
+            vifs = dict(state.get('vifs', {}))
+        except (OSError, ValueError, TypeError, AttributeError):
+            return
+        # Names end up in commands run with sudo, so only well-formed ones are trusted
+        with self.lock:
+            self.mode_changes.update({iface: original for iface, original in renamed.items()
+                                      if valid_ifname(original) and self.check_interface_exists(iface)})
+            self.vifs.update({iface: parent for iface, parent in vifs.items()
+                              if valid_ifname(parent) and self.check_interface_exists(iface)})
+
+    def save_state(self) -> None:
+        if self.state_file is None:
+            return
+        with self.lock:
+            state = {'renamed': {iface: original for iface, original in self.mode_changes.items() if original},
+                     'vifs': dict(self.vifs)}
+        try:
+            private_dir(os.path.dirname(self.state_file) or '.')
+            tmp = f"{self.state_file}.tmp"
+            with os.fdopen(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_NOFOLLOW, 0o600), 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp, self.state_file)
+        except OSError as e:
+            print(f"{Fore.RED}Error saving interface state: {str(e)}")
+
+    def transaction(self, steps) -> bool:
+        """Run (do, undo) steps in order; if one fails, undo the completed ones in reverse."""
+        done = []
+        for do, undo in steps:
+            if not do():
+                for undo_step in reversed(done):
+                    if undo_step is not None:
+                        undo_step()
+                if done:
+                    print(f"{Fore.YELLOW}Rolled back {len(done)} completed step(s)")
+                return False
+            done.append(undo)
+        return True
+
     def monitor(self, iface: str) -> None:
-        """Set interface to monitor mode."""
+        """Set interface to monitor mode, or with add_vif add a monitor interface next to it."""
         if not self.check_interface_exists(iface):
             print(f"{Fore.RED}Interface {iface} not found!")
             return
 
-        self.original_interface = iface
-        commands = [
-            f"sudo ip link set {iface} down",
-            f"sudo iw {iface} set type monitor",
-            f"sudo ip link set {iface} name wmg0mon",
-            f"sudo ip link set wmg0mon up"
-        ]
+        monitor_name = self.allocate_monitor_name()
+        if self.add_vif:
+            # The managed link keeps its association; only a new interface on the same phy is created
+            steps = [
+                (lambda: self.backend.add_interface(iface, monitor_name, 'monitor'),
+                 lambda: self.backend.del_interface(monitor_name)),
+                (lambda: self.backend.set_link(monitor_name, True), None)
+            ]
+        else:
+            steps = [
+                (lambda: self.backend.set_link(iface, False), lambda: self.backend.set_link(iface, True)),
+                (lambda: self.backend.set_type(iface, 'monitor'), lambda: self.backend.set_type(iface, 'managed')),
+                (lambda: self.backend.set_name(iface, monitor_name), lambda: self.backend.set_name(monitor_name, iface)),
+                (lambda: self.backend.set_link(monitor_name, True), None)
+            ]
 
-        for cmd in commands:
-            if not self.run_command(cmd):
-                return
+        if not self.transaction(steps):
+            with self.lock:
+                self.mode_changes.pop(monitor_name, None)
+            return
 
-        self.current_interface = "wmg0mon"
+        with self.lock:
+            if self.add_vif:
+                self.mode_changes.pop(monitor_name, None)
+                self.vifs[monitor_name] = iface
+            else:
+                self.mode_changes[monitor_name] = self.mode_changes.pop(iface, iface)
+            self.touched.add(monitor_name)
+        self.save_state()
         self.banner()
-        print(f"{Fore.GREEN}Interface {Fore.LIGHTCYAN_EX}wmg0mon{Fore.GREEN} is now in monitor mode")
+        if self.add_vif:
+            print(f"{Fore.GREEN}Monitor interface {Fore.LIGHTCYAN_EX}{monitor_name}{Fore.GREEN} added next to "
+                  f"{Fore.LIGHTCYAN_EX}{iface}{Fore.GREEN}, which stays connected")
+        else:
+            print(f"{Fore.GREEN}Interface {Fore.LIGHTCYAN_EX}{monitor_name}{Fore.GREEN} is now in monitor mode")
+
+    def allocate_monitor_name(self) -> str:
+        """Reserve the first free wmg<N>mon name so concurrent radios do not collide."""
+        with self.lock:
+            n = 0
+            while self.check_interface_exists(f"wmg{n}mon") or f"wmg{n}mon" in self.mode_changes:
+                n += 1
+            name = f"wmg{n}mon"
+            self.mode_changes[name] = ''
+            return name
 
     def managed(self, iface: str) -> None:
-        """Set interface to managed mode."""
+        """Set interface to managed mode, or remove it if it is a monitor interface WifiMage added."""
         if not self.check_interface_exists(iface):
             print(f"{Fore.RED}Interface {iface} not found!")
             return
 
-        managed_name = iface.replace('mon', '')
-        commands = [
-            f"sudo ip link set {iface} down",
-            f"sudo iw {iface} set type managed",
-            f"sudo ip link set {iface} name {managed_name}",
-            f"sudo ip link set {managed_name} up"
+        with self.lock:
+            parent = self.vifs.get(iface)
+        if parent is not None:
+            if not self.backend.del_interface(iface):
+                return
+            with self.lock:
+                self.vifs.pop(iface, None)
+                self.touched.discard(iface)
+            self.save_state()
+            self.banner()
+            print(f"{Fore.GREEN}Monitor interface {Fore.LIGHTCYAN_EX}{iface}{Fore.GREEN} removed, "
+                  f"{Fore.LIGHTCYAN_EX}{parent}{Fore.GREEN} was left untouched")
+            return
+
+        with self.lock:
+            # Interfaces WifiMage did not rename keep their current name
+            managed_name = self.mode_changes.get(iface) or iface
+        steps = [
+            (lambda: self.backend.set_link(iface, False), lambda: self.backend.set_link(iface, True)),
+            (lambda: self.backend.set_type(iface, 'managed'), lambda: self.backend.set_type(iface, 'monitor'))
         ]
+        if managed_name != iface:
+            steps.append((lambda: self.backend.set_name(iface, managed_name),
+                          lambda: self.backend.set_name(managed_name, iface)))
+        steps.append((lambda: self.backend.set_link(managed_name, True), None))
 
-        for cmd in commands:
-            if not self.run_command(cmd):
-                return
+        if not self.transaction(steps):
+            return
 
-        self.current_interface = managed_name
+        with self.lock:
+            self.mode_changes.pop(iface, None)
+            self.touched.discard(iface)
+        self.save_state()
         self.banner()
         print(f"{Fore.GREEN}Interface {Fore.LIGHTCYAN_EX}{managed_name}{Fore.GREEN} is now in managed mode")
 
@@ -204,112 +3974,173 @@ class WifiMage:
         if not self.check_interface_exists(iface):
             print(f"{Fore.RED}Interface {iface} not found!")
             return
+        if not valid_ifname(new_name):
+            print(f"{Fore.RED}Invalid interface name: {new_name!r}")
+            return
 
-        commands = [
-            f"sudo ip link set {iface} down",
-            f"sudo ip link set {iface} name {new_name}",
-            f"sudo ip link set {new_name} up"
+        steps = [
+            (lambda: self.backend.set_link(iface, False), lambda: self.backend.set_link(iface, True)),
+            (lambda: self.backend.set_name(iface, new_name), lambda: self.backend.set_name(new_name, iface)),
+            (lambda: self.backend.set_link(new_name, True), None)
         ]
 
-        for cmd in commands:
-            if not self.run_command(cmd):
-                return
+        if not self.transaction(steps):
+            return
 
-        self.current_interface = new_name
+        with self.lock:
+            for changes in (self.mode_changes, self.vifs):
+                if iface in changes:
+                    changes[new_name] = changes.pop(iface)
+            if iface in self.touched:
+                self.touched.discard(iface)
+                self.touched.add(new_name)
+        self.save_state()
         self.banner()
         print(f"{Fore.GREEN}Interface {Fore.LIGHTCYAN_EX}{iface}{Fore.GREEN} has been renamed to {Fore.LIGHTCYAN_EX}{new_name}")
 
     def list_interfaces(self) -> None:
         """List all available network interfaces."""
+        if self.output is not None:
+            for iface in sorted(os.listdir(SYSFS_NET)):
+                operstate = read_sysfs(iface, 'operstate')
+                self.emit('interface', name=iface, status=operstate.upper() if operstate else None,
+                          mac=read_sysfs(iface, 'address'), phy=read_sysfs(iface, 'phy80211/name'))
+            return
         self.banner()
         print(f"{Fore.YELLOW}Available network interfaces:")
-        subprocess.run("ip link show | grep -E '^[0-9]+:'", shell=True)
+        output = self.get_command_output("ip link show")
+        print('\n'.join(line for line in output.splitlines() if line[:1].isdigit()))
 
-    def restore_original(self) -> None:
-        """Restore interface to its original state."""
-        if self.original_interface and self.current_interface:
-            self.managed(self.current_interface)
+    def restore_original(self, everything: bool = False) -> None:
+        """Undo the monitor switches and interfaces of this run, or with everything=True of every recorded run."""
+        with self.lock:
+            changed = [iface for iface, original in self.mode_changes.items() if original] + list(self.vifs)
+            if not everything:
+                changed = [iface for iface in changed if iface in self.touched]
+        if changed:
+            self.run_on_interfaces(changed, self.managed)
+        elif everything:
+            print(f"{Fore.YELLOW}Nothing to restore")
 
-    def start_monitoring(self, iface: str) -> None:
-        """Start real-time network monitoring."""
-        if not self.check_interface_exists(iface):
+    def run_on_interfaces(self, ifaces: List[str], action) -> None:
+        """Run action(iface) for each interface on a bounded thread pool.
+
+        Output is buffered per interface and printed in the given order, so the
+        total time is that of the slowest radio rather than the sum.
+        """
+        if not ifaces:
+            print(f"{Fore.RED}No matching wireless interfaces found!")
+            return
+        if len(ifaces) == 1:
+            action(ifaces[0])
+            return
+
+        self.banner()
+        output = ThreadOutput(sys.stdout)
+
+        def work(iface: str) -> str:
+            output.local.buffer = io.StringIO()
+            try:
+                action(iface)
+            except Exception as e:
+                print(f"{Fore.RED}Unexpected error: {str(e)}")
+            finally:
+                text = output.local.buffer.getvalue()
+                output.local.buffer = None
+            return text
+
+        sys.stdout = output
+        try:
+            with futures.ThreadPoolExecutor(max_workers=min(self.max_workers, len(ifaces))) as pool:
+                for iface, text in zip(ifaces, pool.map(work, ifaces)):
+                    output.stream.write(f"\n{Fore.LIGHTMAGENTA_EX}==> {iface} <==\n")
+                    output.stream.write(text)
+        finally:
+            sys.stdout = output.stream
+
+    def start_monitoring(self, ifaces: List[str]) -> None:
+        """Start real-time network monitoring on one or more interfaces."""
+        missing = [iface for iface in ifaces if not self.check_interface_exists(iface)]
+        for iface in missing:
             print(f"{Fore.RED}Interface {iface} not found!")
+        ifaces = [iface for iface in ifaces if iface not in missing]
+        if not ifaces:
             return
 
         self.monitoring = True
         self.banner()
-        print(f"{Fore.YELLOW}Starting real-time monitoring on {Fore.LIGHTCYAN_EX}{iface}{Fore.YELLOW}...")
+        print(f"{Fore.YELLOW}Starting real-time monitoring on {Fore.LIGHTCYAN_EX}{', '.join(ifaces)}{Fore.YELLOW}...")
         print(f"{Fore.YELLOW}Press Ctrl+C to stop monitoring")
+        sys.stdout.flush()
 
-        def monitor_thread():
-            while self.monitoring and self.running:
-                try:
-                    # Get current networks
-                    try:
-                        scan_result = subprocess.run(f"sudo iwlist {iface} scan 2>/dev/null", 
-                                                   shell=True, capture_output=True, text=True)
-                        if scan_result.returncode == 0:
-                            current_networks = set()
-                            
-                            for line in scan_result.stdout.split('\n'):
-                                if 'ESSID' in line:
-                                    ssid = line.split('"')[1]
-                                    current_networks.add(ssid)
-                            
-                            # Check for new networks
-                            new_networks = current_networks - self.known_networks
-                            if new_networks:
-                                print(f"\n{Fore.GREEN}New networks detected:")
-                                for network in new_networks:
-                                    print(f"{Fore.LIGHTCYAN_EX}* {network}")
-                            
-                            # Update known networks
-                            self.known_networks = current_networks
-                    except Exception as e:
-                        print(f"{Fore.RED}Error scanning networks: {str(e)}")
-                    
-                    # Get connected clients
-                    try:
-                        clients_output = subprocess.run("sudo arp -n", shell=True, capture_output=True, text=True)
-                        if clients_output.returncode == 0:
-                            current_clients = {}
-                            
-                            for line in clients_output.stdout.split('\n'):
-                                if 'ether' in line:
-                                    parts = line.split()
-                                    if len(parts) >= 3:
-                                        ip = parts[0]
-                                        mac = parts[2]
-                                        if ip not in current_clients:
-                                            current_clients[ip] = []
-                                        current_clients[ip].append(mac)
-                            
-                            # Check for new clients
-                            for ip, macs in current_clients.items():
-                                if ip not in self.connected_clients:
-                                    print(f"\n{Fore.GREEN}New client connected:")
-                                    print(f"{Fore.LIGHTCYAN_EX}IP: {ip}")
-                                    print(f"{Fore.LIGHTCYAN_EX}MAC: {', '.join(macs)}")
-                            
-                            self.connected_clients = current_clients
-                    except Exception as e:
-                        print(f"{Fore.RED}Error getting client information: {str(e)}")
-                    
-                    time.sleep(5)  # Wait 5 seconds before next scan
-                    
-                except Exception as e:
-                    print(f"{Fore.RED}Error during monitoring: {str(e)}")
-                    self.monitoring = False
-                    break
+        monitors = [RealtimeMonitor(self, iface, self.scan_interval, self.max_scan_interval,
+                                    label=f"{Fore.LIGHTMAGENTA_EX}[{iface}] " if len(ifaces) > 1 else '',
+                                    client_ttl=self.client_ttl)
+                    for iface in ifaces]
+        asyncio.run(run_monitors(monitors))
+        self.monitoring = False
+        print(f"\n{Fore.YELLOW}Monitoring stopped")
+
+    def read_arp_table(self) -> str:
+        """Return the kernel's IPv4 neighbour table from /proc/net/arp."""
+        content = RUNNER.read_file(PROC_ARP)
+        if content is None:
+            print(f"{Fore.RED}Error getting client information: cannot read {PROC_ARP}")
+            return ""
+        return content
+
+    def survey(self, iface: str, pcap: Optional[str] = None, channels=DEFAULT_SURVEY_CHANNELS,
+               dwell: float = 0.25, duration: Optional[float] = None) -> None:
+        """Passive site survey on a monitor-mode interface, or offline from a pcap file."""
+        engine = SurveyEngine()
+        if pcap:
+            self.banner()
+            try:
+                engine.feed_pcap(pcap)
+            except (OSError, ValueError) as e:
+                print(f"{Fore.RED}Error reading capture: {str(e)}")
+                return
+            self.print_survey(engine)
+            return
+
+        if not self.check_interface_exists(iface):
+            print(f"{Fore.RED}Interface {iface} not found!")
+            return
+        if read_sysfs(iface, 'type') != ARPHRD_IEEE80211_RADIOTAP:
+            print(f"{Fore.RED}Interface {iface} is not in monitor mode! Use -mon first.")
+            return
+
+        self.banner()
+        print(f"{Fore.YELLOW}Surveying on {Fore.LIGHTCYAN_EX}{iface}{Fore.YELLOW} "
+              f"(channels {','.join(map(str, channels))}, {dwell:g}s dwell)...")
+        print(f"{Fore.YELLOW}Press Ctrl+C to stop the survey")
+        try:
+            engine.capture(iface, self.backend, channels, dwell, duration, on_tick=self.print_survey)
+        except KeyboardInterrupt:
+            pass
+        except OSError as e:
+            print(f"{Fore.RED}Error capturing on {iface}: {str(e)}")
+        self.print_survey(engine)
 
-        def signal_handler(signum, frame):
-            self.monitoring = False
-            self.running = False
-            print(f"\n{Fore.YELLOW}Monitoring stopped")
+    def print_survey(self, engine: SurveyEngine) -> None:
+        """Display the survey BSS table and per-channel occupancy."""
+        with METRICS.span('phase.render'):
+            self._print_survey(engine)
 
-        signal.signal(signal.SIGINT, signal_handler)
-        
-        monitor_thread()
+    def _print_survey(self, engine: SurveyEngine) -> None:
+        elapsed = max(time.time() - engine.started, 1e-9)
+        print(f"\n{Fore.YELLOW}Survey: {Fore.LIGHTCYAN_EX}{len(engine.table)}{Fore.YELLOW} BSS, "
+              f"{engine.management_frames}/{engine.frames} management frames, {engine.errors} errors")
+        print(f"{Fore.GREEN}{'BSSID':17}  {'CH':>3}  {'RSSI avg/min/max':>16}  {'Frames':>7}  {'Security':22}  SSID")
+        entries = sorted(engine.table.values(), key=lambda e: -(e.rssi_avg if e.rssi_avg is not None else -999))
+        for entry in entries:
+            rssi = (f"{entry.rssi_avg:.0f}/{entry.rssi_min}/{entry.rssi_max}" if entry.rssi_count else 'N/A')
+            print(f"{Fore.WHITE}{entry.bssid}  {str(entry.channel or '-'):>3}  {rssi:>16}  {entry.frames:>7}  "
+                  f"{entry.encryption[:22]:22}  {Fore.LIGHTCYAN_EX}{entry.ssid or '<hidden>'}")
+        print(f"\n{Fore.YELLOW}Channel occupancy:")
+        for channel, bss, frames, share in engine.channel_occupancy():
+            print(f"{Fore.GREEN}Channel {channel:>3}: {Fore.WHITE}{bss} BSS, {frames} frames "
+                  f"({share * 100:.1f}%)")
 
     def analyze_security(self, iface: str) -> None:
         """Analyze network security settings."""
@@ -321,17 +4152,13 @@ class WifiMage:
         print(f"{Fore.YELLOW}Analyzing security settings for {Fore.LIGHTCYAN_EX}{iface}{Fore.YELLOW}...")
 
         # Check interface security
+        snapshot = self.collect_snapshot(iface, security=True)
         security_info = {
-            'encryption': self.get_command_output(f"iwconfig {iface} 2>/dev/null | grep -o 'Encryption key:[a-z]*' | cut -d':' -f2"),
-            'authentication': self.get_command_output(f"iwconfig {iface} 2>/dev/null | grep -o 'Authentication Suites : [A-Z]*' | cut -d':' -f2"),
-            'power_management': self.get_command_output(f"iwconfig {iface} 2>/dev/null | grep -o 'Power Management:[a-z]*' | cut -d':' -f2")
+            'encryption': snapshot.encryption,
+            'authentication': snapshot.authentication,
+            'power_management': snapshot.power_management
         }
 
-        print(f"\n{Fore.GREEN}Security Analysis:")
-        print(f"{Fore.WHITE}Encryption: {Fore.LIGHTCYAN_EX}{security_info['encryption'] or 'N/A'}")
-        print(f"{Fore.WHITE}Authentication: {Fore.LIGHTCYAN_EX}{security_info['authentication'] or 'N/A'}")
-        print(f"{Fore.WHITE}Power Management: {Fore.LIGHTCYAN_EX}{security_info['power_management'] or 'N/A'}")
-
         # Check for common security issues
         issues = []
         if security_info['encryption'] == 'off':
@@ -339,12 +4166,54 @@ class WifiMage:
         if security_info['power_management'] == 'on':
             issues.append("Power management is enabled (may affect performance)")
 
+        # Classify every network around us, reusing this run's scan when there is one
+        networks = self.scan_results.get(iface)
+        if networks is None:
+            reply = self.from_daemon('scan', iface)
+            networks = ([BSSRecord.from_dict(n) for n in reply['networks']] if reply is not None
+                        else self.scan_scheduler(iface).run().networks)
+        analyzer = FleetAnalyzer(self.managed_ssids)
+        analyzer.add_networks(networks, iface)
+        if self.emit('security', interface=iface, issues=issues, **security_info, **analyzer.to_dict()):
+            return
+
+        print(f"\n{Fore.GREEN}Security Analysis:")
+        print(f"{Fore.WHITE}Encryption: {Fore.LIGHTCYAN_EX}{security_info['encryption'] or 'N/A'}")
+        print(f"{Fore.WHITE}Authentication: {Fore.LIGHTCYAN_EX}{security_info['authentication'] or 'N/A'}")
+        print(f"{Fore.WHITE}Power Management: {Fore.LIGHTCYAN_EX}{security_info['power_management'] or 'N/A'}")
+
         if issues:
             print(f"\n{Fore.RED}Potential Security Issues:")
             for issue in issues:
                 print(f"{Fore.RED}* {issue}")
         else:
             print(f"\n{Fore.GREEN}No major security issues detected")
+        print_security_report(analyzer)
+
+    def analyze_channels(self, iface: str, snapshot: InterfaceSnapshot) -> Dict[int, ChannelLoad]:
+        """Sample channel survey counters around a scan and print per-channel load."""
+        sampler = SurveySampler()
+        sampler.add(self.backend.survey(iface))
+        networks = self.scan_table(iface)
+        for _ in range(self.survey_samples):
+            time.sleep(self.survey_interval)
+            sampler.add(self.backend.survey(iface))
+        loads = channel_loads(networks, sampler, exclude_bssid=snapshot.bssid)
+        if self.output is not None:
+            return loads
+
+        print(f"\n{Fore.YELLOW}Channel analysis ({len(networks)} networks, {self.survey_samples} survey samples):")
+        print(f"{Fore.GREEN}{'CH':>3}  {'BSS':>3}  {'Co-ch':>5}  {'Adj':>5}  {'Busy':>5}  {'Noise':>8}  {'Score':>5}")
+        for channel in sorted(loads):
+            load = loads[channel]
+            if not (load.bss or load.utilization is not None or channel == snapshot.channel):
+                continue
+            busy = f"{load.utilization * 100:.0f}%" if load.utilization is not None else '-'
+            noise = f"{load.noise} dBm" if load.noise is not None else '-'
+            marker = f" {Fore.LIGHTCYAN_EX}<- current" if channel == snapshot.channel else ''
+            print(f"{Fore.WHITE}{channel:>3}  {load.bss:>3}  {load.co_channel:>5.2f}  {load.adjacent:>5.2f}  "
+                  f"{busy:>5}  {noise:>8}  {load.score:>5.0f}{marker}")
+        return loads
 
     def diagnose_connection(self, iface: str) -> None:
         """Diagnose connection issues."""
@@ -355,27 +4224,51 @@ class WifiMage:
         self.banner()
         print(f"{Fore.YELLOW}Diagnosing connection for {Fore.LIGHTCYAN_EX}{iface}{Fore.YELLOW}...")
 
+        snapshot = self.collect_snapshot(iface)
+
         # Check interface status
-        status = self.get_command_output(f"ip link show {iface} | grep -o 'state [A-Z]*' | cut -d' ' -f2")
+        status = snapshot.status
         print(f"\n{Fore.GREEN}Interface Status: {Fore.LIGHTCYAN_EX}{status}")
 
         # Check signal strength
-        signal = self.get_command_output(f"iwconfig {iface} 2>/dev/null | grep -o 'Signal level=[-0-9]* dBm' | cut -d'=' -f2")
-        print(f"{Fore.GREEN}Signal Strength: {Fore.LIGHTCYAN_EX}{signal or 'N/A'}")
+        print(f"{Fore.GREEN}Signal Strength: {Fore.LIGHTCYAN_EX}{snapshot.signal_text or 'N/A'}")
 
         # Check connection quality
-        quality = self.get_command_output(f"iwconfig {iface} 2>/dev/null | grep -o 'Link Quality=[0-9]*/[0-9]*' | cut -d'=' -f2")
-        print(f"{Fore.GREEN}Link Quality: {Fore.LIGHTCYAN_EX}{quality or 'N/A'}")
+        print(f"{Fore.GREEN}Link Quality: {Fore.LIGHTCYAN_EX}{snapshot.quality_text or 'N/A'}")
 
         # Check for common issues
         issues = []
         if status != 'UP':
             issues.append("Interface is not up")
-        if signal and int(signal.split()[0]) < -70:
+        if snapshot.signal is not None and snapshot.signal < -70:
             issues.append("Signal strength is weak")
-        if quality and int(quality.split('/')[0]) < 50:
+        if snapshot.link_quality is not None and snapshot.link_quality < 50:
             issues.append("Link quality is poor")
 
+        # Check channel utilisation and interference
+        best = None
+        loads = {}
+        if status == 'UP' and snapshot.phy and snapshot.channel:
+            loads = self.analyze_channels(iface, snapshot)
+            current = loads.get(snapshot.channel)
+            # Only channels with known load compete, and surveyed ones only with surveyed ones
+            surveyed = current is not None and current.utilization is not None
+            band = [load for load in loads.values() if (load.channel <= 14) == (snapshot.channel <= 14)
+                    and load.channel in CANDIDATE_CHANNELS_2GHZ + CANDIDATE_CHANNELS_5GHZ + (snapshot.channel,)
+                    and load.measured and (load.utilization is not None or not surveyed)]
+            best = min(band, key=lambda load: load.score) if band else None
+            if current and best and best.channel != current.channel and current.score - best.score >= 20:
+                issues.append(f"Channel {current.channel} is congested")
+            else:
+                best = None
+
+        if self.output is not None:
+            self.emit('diagnosis', interface=iface, status=status, signal=snapshot.signal,
+                      link_quality=snapshot.link_quality, link_quality_max=snapshot.link_quality_max,
+                      channel=snapshot.channel, issues=issues, recommended_channel=best.channel if best else None,
+                      channels=[load.to_dict() for _, load in sorted(loads.items())] if loads else [])
+            return
+
         if issues:
             print(f"\n{Fore.RED}Detected Issues:")
             for issue in issues:
@@ -387,8 +4280,12 @@ class WifiMage:
             if "Signal strength is weak" in issues:
                 print(f"{Fore.WHITE}* Try moving closer to the access point")
                 print(f"{Fore.WHITE}* Check for physical obstacles")
+            if best is not None:
+                print(f"{Fore.WHITE}* Move the access point to channel {best.channel} "
+                      f"(score {best.score:.0f} vs {loads[snapshot.channel].score:.0f} on channel {snapshot.channel})")
             if "Link quality is poor" in issues:
-                print(f"{Fore.WHITE}* Try changing the channel")
+                if best is None:
+                    print(f"{Fore.WHITE}* Try changing the channel")
                 print(f"{Fore.WHITE}* Check for interference from other devices")
         else:
             print(f"\n{Fore.GREEN}No connection issues detected")
@@ -397,27 +4294,180 @@ def main():
     parser = argparse.ArgumentParser(description='WifiMage - Wireless Network Interface Manager')
     parser.add_argument('-r', '--rename', nargs=2, metavar=('INTERFACE', 'NEW_NAME'),
                       help='Rename an interface')
-    parser.add_argument('-mon', '--monitor', metavar='INTERFACE',
-                      help='Set interface to monitor mode')
-    parser.add_argument('-man', '--managed', metavar='INTERFACE',
-                      help='Set interface to managed mode')
+    parser.add_argument('-mon', '--monitor', nargs='+', metavar='INTERFACE',
+                      help='Set interfaces to monitor mode')
+    parser.add_argument('--vif', action='store_true',
+                      help='With -mon, add a monitor interface on the same radio instead of switching the interface')
+    parser.add_argument('--restore', action='store_true',
+                      help='Undo every monitor switch and remove every monitor interface WifiMage created')
+    parser.add_argument('-man', '--managed', nargs='+', metavar='INTERFACE',
+                      help='Set interfaces to managed mode')
     parser.add_argument('-l', '--list', action='store_true',
                       help='List available interfaces')
-    parser.add_argument('-i', '--info', metavar='INTERFACE',
+    parser.add_argument('-i', '--info', nargs='+', metavar='INTERFACE',
                       help='Show detailed interface information')
-    parser.add_argument('-s', '--scan', metavar='INTERFACE',
+    parser.add_argument('-s', '--scan', nargs='+', metavar='INTERFACE',
                       help='Scan available networks')
     parser.add_argument('-save', '--save-scan', metavar='FILENAME',
                       help='Save scan results to a JSON file')
-    parser.add_argument('-rt', '--realtime', metavar='INTERFACE',
+    parser.add_argument('--record', metavar='DIRECTORY',
+                      help='Append every scan (-s, -rt) to a scan history store in DIRECTORY')
+    parser.add_argument('--retention', type=int, default=30, metavar='DAYS',
+                      help='Days of history kept by --record (default: 30, 0 keeps everything)')
+    parser.add_argument('-rt', '--realtime', nargs='+', metavar='INTERFACE',
                       help='Start real-time network monitoring')
-    parser.add_argument('-sec', '--security', metavar='INTERFACE',
+    parser.add_argument('-survey', '--survey', metavar='INTERFACE',
+                      help='Passive channel-hopping survey on a monitor-mode interface')
+    parser.add_argument('--pcap', metavar='FILENAME',
+                      help='Run the survey offline from a radiotap pcap capture')
+    parser.add_argument('--channels', metavar='LIST',
+                      help='Comma separated channels for the survey to hop over')
+    parser.add_argument('--dwell', type=float, default=0.25, metavar='SECONDS',
+                      help='Time spent on each channel by the survey (default: 0.25)')
+    parser.add_argument('--duration', type=float, metavar='SECONDS',
+                      help='Stop the survey after this many seconds')
+    parser.add_argument('-sec', '--security', nargs='+', metavar='INTERFACE',
                       help='Analyze network security settings')
-    parser.add_argument('-d', '--diagnose', metavar='INTERFACE',
+    parser.add_argument('--policy', metavar='FILENAME',
+                      help='JSON policies for managed SSIDs checked by -sec: {"SSID": {"bssids": [...], "security": "WPA2", "pmf": "required"}}')
+    parser.add_argument('--managed-ssid', action='append', metavar='SSID',
+                      help='SSID of ours checked by -sec for mismatched security (repeatable)')
+    parser.add_argument('-d', '--diagnose', nargs='+', metavar='INTERFACE',
                       help='Diagnose connection issues')
+    parser.add_argument('-j', '--jobs', type=int, default=8, metavar='N',
+                      help='Interfaces to handle concurrently when several (or "all") are given (default: 8)')
+    parser.add_argument('--survey-samples', type=int, default=5, metavar='N',
+                      help='Channel survey samples taken by -d (default: 5)')
+    parser.add_argument('--survey-interval', type=float, default=0.2, metavar='SECONDS',
+                      help='Time between channel survey samples in -d (default: 0.2)')
+    parser.add_argument('--interval', type=float, default=2.0, metavar='SECONDS',
+                      help='Shortest active scan interval in real-time mode (default: 2)')
+    parser.add_argument('--max-interval', type=float, default=60.0, metavar='SECONDS',
+                      help='Longest active scan interval in real-time mode when nothing changes (default: 60)')
+    parser.add_argument('--rssi-history', type=int, default=64, metavar='N',
+                      help='Signal samples kept per BSSID in real-time mode (default: 64)')
+    parser.add_argument('--appear-after', type=int, default=2, metavar='SCANS',
+                      help='Sightings in a row before a network is reported as new (default: 2)')
+    parser.add_argument('--disappear-after', type=int, default=3, metavar='SCANS',
+                      help='Scans in a row without a network before it is reported as lost (default: 3)')
+    parser.add_argument('--client-ttl', type=float, default=300.0, metavar='SECONDS',
+                      help='Report a client as disconnected after this long out of the neighbour table (default: 300)')
+    parser.add_argument('--json', action='store_true',
+                      help='Write results as one JSON document for scripts (progress and errors go to stderr)')
+    parser.add_argument('--ndjson', action='store_true',
+                      help='Write results as one JSON object per line as they happen (streams in -rt)')
+    parser.add_argument('--profile', action='store_true',
+                      help='Print command and phase timings and counters at exit')
+    parser.add_argument('--metrics-file', metavar='FILENAME',
+                      help='Periodically write metrics to FILENAME (Prometheus text or JSON lines)')
+    parser.add_argument('--metrics-format', choices=['prom', 'jsonl'], default='prom',
+                      help='Format of --metrics-file (default: prom)')
+    parser.add_argument('--metrics-interval', type=float, default=10.0, metavar='SECONDS',
+                      help='How often --metrics-file is written (default: 10)')
+    parser.add_argument('--backend', choices=['auto', 'netlink', 'cli'], default='auto',
+                      help='How to talk to the kernel: netlink sockets or the ip/iw/iwlist tools (default: auto)')
+    parser.add_argument('--scan-tier', choices=('auto',) + SCAN_TIERS, default='auto',
+                      help='cache: read the kernel BSS table, targeted: scan known channels only, '
+                           'full: sweep every channel (default: auto, the cheapest that is fresh enough)')
+    parser.add_argument('--scan-channels', type=parse_channel_list, metavar='LIST',
+                      help='Comma separated channels for targeted scans (default: where known networks are)')
+    parser.add_argument('--cache-age', type=float, default=10.0, metavar='SECONDS',
+                      help='Use the kernel BSS cache for this long after an active scan (default: 10)')
+    parser.add_argument('--full-interval', type=float, default=60.0, metavar='SECONDS',
+                      help='Shortest time between full sweeps in real-time mode (default: 60)')
+    parser.add_argument('--max-full-interval', type=float, default=600.0, metavar='SECONDS',
+                      help='Longest time between full sweeps while they find nothing new (default: 600)')
+    parser.add_argument('--scan-stats', action='store_true',
+                      help='Print the tier, duration and data age of every real-time scan')
+    parser.add_argument('--record-commands', metavar='FILENAME',
+                      help='Append every command output and /proc, /sys read to a JSON-lines fixture')
+    parser.add_argument('--replay-commands', metavar='FILENAME',
+                      help='Answer commands and file reads from a fixture instead of the system (implies --backend cli)')
+    parser.add_argument('--replay-speed', type=float, default=1.0, metavar='FACTOR',
+                      help='Scale recorded command durations when replaying (default: 1, 0 for no delay)')
+    parser.add_argument('--socket', default=DEFAULT_DAEMON_SOCKET, metavar='PATH',
+                      help=f'Scan daemon socket used by -s, -i and -sec when it exists (default: {DEFAULT_DAEMON_SOCKET})')
+    parser.add_argument('--no-daemon', action='store_true',
+                      help='Always scan locally, even if a scan daemon is running')
+    parser.add_argument('--push', metavar='HOST[:PORT]',
+                      help=f'Stream scans (-s, -rt) and client events to a `wifimage.py collect` server '
+                           f'(default port: {DEFAULT_COLLECTOR_PORT})')
+    parser.add_argument('--node', default=socket.gethostname(),
+                      help='Name of this sensor at the collector (default: the hostname)')
+    parser.add_argument('--spool', default=SPOOL_DIR, metavar='DIRECTORY',
+                      help=f'Where batches wait while the collector is unreachable (default: {SPOOL_DIR})')
+    parser.add_argument('--spool-max', type=float, default=64, metavar='MB',
+                      help='Spool size limit, oldest batches are dropped beyond it (default: 64)')
+    parser.add_argument('--batch-size', type=int, default=500, metavar='N',
+                      help='Most events sent to the collector in one batch (default: 500)')
+    parser.add_argument('--batch-interval', type=float, default=1.0, metavar='SECONDS',
+                      help='Longest time an event waits to be batched (default: 1)')
 
     args = parser.parse_args()
+    global RUNNER
+    if args.replay_commands:
+        try:
+            RUNNER = ReplayRunner(args.replay_commands, args.replay_speed)
+        except (OSError, ValueError) as e:
+            print(f"{Fore.RED}Error loading command fixture: {str(e)}")
+            sys.exit(1)
+        args.backend = 'cli'
+        args.no_daemon = True
+    if args.record_commands:
+        RUNNER = RecordingRunner(args.record_commands, RUNNER)
     wm = WifiMage()
+    if args.json or args.ndjson:
+        wm.output = JsonOutput(sys.stdout, ndjson=args.ndjson)
+        sys.stdout = sys.stderr
+    else:
+        wm.show_banner = sys.stdout.isatty()
+        sys.stdout = buffered_stdout(sys.stdout)
+        init_colors()
+    wm.backend_name = args.backend
+    wm.scan_interval = args.interval
+    wm.max_scan_interval = max(args.interval, args.max_interval)
+    wm.max_workers = max(1, args.jobs)
+    wm.client_ttl = args.client_ttl
+    wm.rssi_history = max(1, args.rssi_history)
+    wm.appear_after = max(1, args.appear_after)
+    wm.disappear_after = max(1, args.disappear_after)
+    wm.survey_samples = max(0, args.survey_samples)
+    wm.survey_interval = args.survey_interval
+    wm.scan_tier = args.scan_tier
+    if args.scan_channels:
+        wm.scan_freqs = [channel_to_freq(c) for c in args.scan_channels]
+    wm.cache_max_age = args.cache_age
+    wm.full_scan_interval = args.full_interval
+    wm.max_full_scan_interval = args.max_full_interval
+    wm.verbose_scans = args.scan_stats
+    wm.add_vif = args.vif
+    try:
+        wm.managed_ssids = load_managed_ssids(args.policy, args.managed_ssid)
+    except (OSError, ValueError) as e:
+        print(f"{Fore.RED}Error loading policy: {str(e)}")
+        sys.exit(1)
+    wm.load_state()
+    if args.record:
+        wm.store = ScanStore(args.record, args.retention)
+    if not args.no_daemon and os.path.exists(args.socket):
+        wm.daemon = DaemonClient(args.socket)
+    if args.push:
+        try:
+            wm.pusher = ScanPusher(parse_address(args.push), args.node, args.spool, max(1, args.batch_size),
+                                   args.batch_interval, spool_max=int(args.spool_max * (1 << 20)))
+        except (OSError, ValueError) as e:
+            print(f"{Fore.RED}Error setting up --push: {str(e)}")
+            sys.exit(1)
+    METRICS.enabled = bool(args.profile or args.metrics_file)
+    metrics_writer = None
+    if args.metrics_file:
+        metrics_writer = METRICS.start_writer(args.metrics_file, args.metrics_format, args.metrics_interval)
+
+    def interfaces(names: List[str], mode: Optional[str] = None) -> List[str]:
+        # "all" expands to every wireless interface (in the mode the command switches from)
+        if 'all' in names:
+            return list_wireless_interfaces(mode)
+        return list(dict.fromkeys(names))
 
     try:
         if len(sys.argv) == 1:
@@ -428,23 +4478,28 @@ def main():
         if args.rename:
             wm.rename(args.rename[0], args.rename[1])
         elif args.monitor:
-            wm.monitor(args.monitor)
+            wm.run_on_interfaces(interfaces(args.monitor, 'managed'), wm.monitor)
         elif args.managed:
-            wm.managed(args.managed)
+            wm.run_on_interfaces(interfaces(args.managed, 'monitor'), wm.managed)
+        elif args.restore:
+            wm.restore_original(everything=True)
         elif args.list:
             wm.list_interfaces()
         elif args.info:
-            wm.show_interface_info(args.info)
+            wm.run_on_interfaces(interfaces(args.info), wm.show_interface_info)
         elif args.scan:
-            wm.scan_networks(args.scan)
+            wm.run_on_interfaces(interfaces(args.scan), wm.scan_networks)
             if args.save_scan:
                 wm.save_scan_results(args.save_scan)
         elif args.realtime:
-            wm.start_monitoring(args.realtime)
+            wm.start_monitoring(interfaces(args.realtime))
+        elif args.survey or args.pcap:
+            channels = tuple(int(c) for c in args.channels.split(',')) if args.channels else DEFAULT_SURVEY_CHANNELS
+            wm.survey(args.survey, args.pcap, channels, args.dwell, args.duration)
         elif args.security:
-            wm.analyze_security(args.security)
+            wm.run_on_interfaces(interfaces(args.security), wm.analyze_security)
         elif args.diagnose:
-            wm.diagnose_connection(args.diagnose)
+            wm.run_on_interfaces(interfaces(args.diagnose), wm.diagnose_connection)
         else:
             parser.print_help()
     except KeyboardInterrupt:
@@ -454,7 +4509,213 @@ def main():
         print(f"{Fore.RED}Unexpected error: {str(e)}")
         wm.restore_original()
     finally:
+        if wm.pusher is not None:
+            wm.pusher.close()
+        if wm.store is not None:
+            wm.store.close()
+        if metrics_writer is not None:
+            metrics_writer.set()
+            try:
+                METRICS.write(args.metrics_file, args.metrics_format)
+            except OSError as e:
+                print(f"{Fore.RED}Error writing metrics: {str(e)}")
+        if args.profile:
+            print_profile(METRICS)
+        if wm.output is not None:
+            wm.output.close()
+        else:
+            print(Style.RESET_ALL)
+        sys.stdout.flush()
+
+
+def print_profile(metrics: Metrics) -> None:
+    """Print the --profile summary."""
+    snapshot = metrics.snapshot()
+    print(f"\n{Fore.YELLOW}Profile ({snapshot['uptime']:.2f}s):")
+    print(f"{Fore.GREEN}{'Span':24} {'Count':>6} {'Total':>10} {'Avg':>10} {'p95':>10} {'Max':>10}")
+    for name, timing in sorted(snapshot['timings'].items(), key=lambda item: -item[1]['total']):
+        print(f"{Fore.WHITE}{name:24} {timing['count']:>6} {timing['total'] * 1000:>8.1f}ms "
+              f"{timing['avg'] * 1000:>8.2f}ms {timing['p95'] * 1000:>8.2f}ms {timing['max'] * 1000:>8.2f}ms")
+    for name, value in sorted(snapshot['counters'].items()):
+        print(f"{Fore.GREEN}{name}: {Fore.WHITE}{value:g}")
+
+
+def query_main(argv: List[str]) -> None:
+    """`wifimage.py query` - read back scan history recorded with --record."""
+    parser = argparse.ArgumentParser(prog='wifimage.py query', description='Query recorded scan history')
+    parser.add_argument('store', metavar='DIRECTORY', help='Scan history store written by --record')
+    parser.add_argument('--bssid', help='Only this BSSID')
+    parser.add_argument('--ssid', help='Only this SSID')
+    parser.add_argument('--since', help="Start time: ISO date/time or age such as '24h', '30m', '7d'")
+    parser.add_argument('--until', help='End time: ISO date/time or age')
+    parser.add_argument('--limit', type=int, help='Return at most this many observations')
+    parser.add_argument('--format', choices=['table', 'json', 'csv'], default='table', help='Output format')
+    parser.add_argument('-o', '--output', metavar='FILENAME', help='Write to a file instead of stdout')
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.store):
+        print(f"{Fore.RED}Scan history store {args.store} not found!")
+        sys.exit(1)
+    if args.bssid and not valid_bssid(args.bssid):
+        print(f"{Fore.RED}Invalid BSSID {args.bssid}, expected the form 00:11:22:33:44:55")
+        sys.exit(1)
+    try:
+        since = parse_time(args.since) if args.since else None
+        until = parse_time(args.until) if args.until else None
+    except ValueError as e:
+        print(f"{Fore.RED}Invalid time: {str(e)}")
+        sys.exit(1)
+    store = ScanStore(args.store, retention_days=0)
+    rows = store.query(args.bssid, args.ssid, since, until, args.limit)
+
+    out = open(args.output, 'w', newline='') if args.output else sys.stdout
+    # Color codes only when writing to a terminal, never into -o files
+    color = Fore if out.isatty() else _NoColor()
+    try:
+        if args.format == 'json':
+            json.dump(list(rows), out, indent=4)
+            out.write('\n')
+        elif args.format == 'csv':
+            writer = csv.DictWriter(out, fieldnames=STORE_COLUMNS)
+            writer.writeheader()
+            writer.writerows(rows)
+        else:
+            count = 0
+            for row in rows:
+                count += 1
+                ts = datetime.fromtimestamp(row['ts']).strftime('%Y-%m-%d %H:%M:%S')
+                security = row['wpa'] or ('WEP' if row['encrypted'] else 'Open')
+                signal = f"{row['signal']} dBm" if row['signal'] is not None else 'N/A'
+                out.write(f"{color.WHITE}{ts}  {color.LIGHTCYAN_EX}{row['bssid']}  {color.GREEN}{signal:>8}  "
+                          f"{color.WHITE}ch {str(row['channel'] or '-'):>3}  {security:9} {row['ssid'] or '<hidden>'}\n")
+            out.write(f"{color.YELLOW}{count} observations\n")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+def audit_main(argv: List[str]) -> None:
+    """`wifimage.py audit` - classify the security of every BSS in recorded scan history."""
+    parser = argparse.ArgumentParser(prog='wifimage.py audit', description='Security audit of recorded scan history')
+    parser.add_argument('store', metavar='DIRECTORY', help='Scan history store written by --record')
+    parser.add_argument('--since', help="Start time: ISO date/time or age such as '24h', '30m', '7d'")
+    parser.add_argument('--until', help='End time: ISO date/time or age')
+    parser.add_argument('--policy', metavar='FILENAME', help='JSON policies for managed SSIDs')
+    parser.add_argument('--managed-ssid', action='append', metavar='SSID', help='SSID of ours (repeatable)')
+    parser.add_argument('--limit', type=int, default=50, help='Networks listed per section (0 for all)')
+    parser.add_argument('--format', choices=['table', 'json'], default='table', help='Output format')
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.store):
+        print(f"{Fore.RED}Scan history store {args.store} not found!")
+        sys.exit(1)
+    try:
+        since = parse_time(args.since) if args.since else None
+        until = parse_time(args.until) if args.until else None
+    except ValueError as e:
+        print(f"{Fore.RED}Invalid time: {str(e)}")
+        sys.exit(1)
+    try:
+        analyzer = FleetAnalyzer(load_managed_ssids(args.policy, args.managed_ssid))
+    except (OSError, ValueError) as e:
+        print(f"{Fore.RED}Error loading policy: {str(e)}")
+        sys.exit(1)
+    analyzer.add_store(ScanStore(args.store, retention_days=0), since, until)
+
+    if args.format == 'json':
+        json.dump(analyzer.to_dict(), sys.stdout, indent=4)
+        sys.stdout.write('\n')
+    else:
+        print(f"{Fore.YELLOW}{sum(e.observations for e in analyzer.entries.values())} observations of "
+              f"{len(analyzer.by_bssid)} BSSIDs")
+        print_security_report(analyzer, args.limit or None)
+
+
+def daemon_main(argv: List[str]) -> None:
+    """`wifimage.py daemon` - keep scanning and serve cached results to -s, -i and -sec."""
+    parser = argparse.ArgumentParser(prog='wifimage.py daemon', description='Resident scan daemon')
+    parser.add_argument('interfaces', nargs='*', metavar='INTERFACE',
+                        help='Interfaces scanned in the background ("all" for every wireless one); '
+                             'others are scanned on first request')
+    parser.add_argument('--socket', default=DEFAULT_DAEMON_SOCKET, metavar='PATH',
+                        help=f'Unix socket to listen on (default: {DEFAULT_DAEMON_SOCKET})')
+    parser.add_argument('--interval', type=float, default=10.0, metavar='SECONDS',
+                        help='Background scan interval (default: 10)')
+    parser.add_argument('--max-age', type=float, default=10.0, metavar='SECONDS',
+                        help='Rescan on request when the cached table is older than this (default: 10)')
+    parser.add_argument('--ttl', type=float, default=120.0, metavar='SECONDS',
+                        help='Drop a BSS this long after it was last seen (default: 120)')
+    parser.add_argument('--record', metavar='DIRECTORY', help='Also append every scan to a scan history store')
+    parser.add_argument('--retention', type=int, default=30, metavar='DAYS',
+                        help='Days of history kept by --record (default: 30)')
+    parser.add_argument('--backend', choices=['auto', 'netlink', 'cli'], default='auto',
+                        help='How to talk to the kernel (default: auto)')
+    args = parser.parse_args(argv)
+
+    wm = WifiMage()
+    wm.backend_name = args.backend
+    if args.record:
+        wm.store = ScanStore(args.record, args.retention)
+    ifaces = list_wireless_interfaces() if 'all' in args.interfaces else list(dict.fromkeys(args.interfaces))
+    daemon = ScanDaemon(wm, args.socket, ifaces, args.interval, args.max_age, args.ttl)
+    try:
+        asyncio.run(daemon.serve())
+    except OSError as e:
+        print(f"{Fore.RED}Error starting scan daemon: {str(e)}")
+        sys.exit(1)
+    finally:
+        if wm.store is not None:
+            wm.store.close()
+        print(Style.RESET_ALL)
+
+
+def collect_main(argv: List[str]) -> None:
+    """`wifimage.py collect` - merge the scans pushed by many sensors into one view."""
+    parser = argparse.ArgumentParser(prog='wifimage.py collect', description='Multi-sensor scan collector')
+    parser.add_argument('--listen', default=f"0.0.0.0:{DEFAULT_COLLECTOR_PORT}", metavar='HOST[:PORT]',
+                        help=f'Address to accept sensors on (default: 0.0.0.0:{DEFAULT_COLLECTOR_PORT})')
+    parser.add_argument('-o', '--output', metavar='FILENAME',
+                        help='JSON file replaced with the merged per-BSS view every --interval')
+    parser.add_argument('--interval', type=float, default=10.0, metavar='SECONDS',
+                        help='How often the view is written and summarised (default: 10)')
+    parser.add_argument('--ttl', type=float, default=3600.0, metavar='SECONDS',
+                        help='Drop a BSS no sensor has seen for this long (default: 3600)')
+    parser.add_argument('--record', metavar='DIRECTORY', help='Also append every scan to a scan history store')
+    parser.add_argument('--retention', type=int, default=30, metavar='DAYS',
+                        help='Days of history kept by --record (default: 30)')
+    args = parser.parse_args(argv)
+
+    store = ScanStore(args.record, args.retention) if args.record else None
+    collector = Collector(parse_address(args.listen), CollectorView(args.ttl), args.output, args.interval, store)
+
+    async def serve():
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, collector.stop)
+        await collector.serve()
+
+    try:
+        asyncio.run(serve())
+    except OSError as e:
+        print(f"{Fore.RED}Error starting collector: {str(e)}")
+        sys.exit(1)
+    finally:
+        collector.write()
+        if store is not None:
+            store.close()
         print(Style.RESET_ALL)
 
+
 if __name__ == '__main__':
-    main()
+    if sys.argv[1:2] in (['query'], ['audit'], ['daemon'], ['collect']):
+        init_colors()
+    if sys.argv[1:2] == ['query']:
+        query_main(sys.argv[2:])
+    elif sys.argv[1:2] == ['audit']:
+        audit_main(sys.argv[2:])
+    elif sys.argv[1:2] == ['daemon']:
+        daemon_main(sys.argv[2:])
+    elif sys.argv[1:2] == ['collect']:
+        collect_main(sys.argv[2:])
+    else:
+        main()